@@ -26,6 +26,7 @@
 except ImportError:
     from Cookie import SimpleCookie  # Py 2
 import logging
+import struct
 
 import tornado
 from tornado import web
@@ -33,17 +34,63 @@
 
 from zmq.utils import jsonapi
 
-from IPython.kernel.zmq.session import Session
+from IPython.kernel.zmq.session import Session, COMPRESSION_KEY
 from IPython.utils.jsonutil import date_default
-from IPython.utils.py3compat import PY3, cast_unicode
+from IPython.utils.py3compat import PY3, cast_unicode, cast_bytes, buffer_to_bytes
 
 from .handlers import IPythonHandler
 
+#-----------------------------------------------------------------------------
+# Binary messages
+#-----------------------------------------------------------------------------
+
+# the parts of a message, before its buffers
+MSG_PARTS = ('header', 'parent_header', 'metadata', 'content')
+
+def serialize_binary_message(parts):
+    """Join the parts of a message into one binary websocket message.
+
+    The layout is::
+
+        [n (uint32), offset_1 ... offset_n (uint32), part_1 ... part_n]
+
+    with big-endian integers, where each offset is the start of a part
+    from the beginning of the message.  The first four parts are the
+    header, parent_header, metadata and content as utf8 JSON,
+    and any further parts are the buffers of the message.
+    """
+    n = len(parts)
+    offsets = []
+    offset = 4 * (n + 1)
+    for part in parts:
+        offsets.append(offset)
+        offset += len(part)
+    head = struct.pack('!%iI' % (n + 1), n, *offsets)
+    return b''.join([head] + [buffer_to_bytes(part) for part in parts])
+
+
+def deserialize_binary_message(bmsg):
+    """Split a binary websocket message into its parts.
+
+    The inverse of serialize_binary_message.
+    """
+    n, = struct.unpack('!I', bmsg[:4])
+    offsets = list(struct.unpack('!%iI' % n, bmsg[4:4 * (n + 1)]))
+    offsets.append(len(bmsg))
+    parts = [bmsg[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+    if len(parts) < len(MSG_PARTS):
+        raise ValueError("Binary message has %i parts, expected at least %i" % (
+            len(parts), len(MSG_PARTS)))
+    return parts
+
 #-----------------------------------------------------------------------------
 # ZMQ handlers
 #-----------------------------------------------------------------------------
 
 class ZMQStreamHandler(websocket.WebSocketHandler):
+    
+    # whether this connection uses binary messages
+    binary = False
 
     def check_origin(self, origin):
         """Check Origin == Host or Access-Control-Allow-Origin.
@@ -98,7 +145,17 @@ def _reserialize_reply(self, msg_list):
         be sent back to the browser.
         """
         idents, msg_list = self.session.feed_identities(msg_list)
+        if self.binary:
+            return self._reserialize_binary_reply(msg_list)
         msg = self.session.unserialize(msg_list)
+        return self._serialize_msg(msg)
+
+    def _serialize_msg(self, msg):
+        """Serialize a message dict for the websocket, as JSON or binary."""
+        if self.binary:
+            parts = [jsonapi.dumps(msg[key], default=date_default) for key in MSG_PARTS]
+            parts.extend(msg.get('buffers', []))
+            return serialize_binary_message(parts)
         try:
             msg['header'].pop('date')
         except KeyError:
@@ -107,9 +164,24 @@ def _reserialize_reply(self, msg_list):
             msg['parent_header'].pop('date')
         except KeyError:
             pass
-        msg.pop('buffers')
+        msg.pop('buffers', None)
         return jsonapi.dumps(msg, default=date_default)
 
+    def _reserialize_binary_reply(self, msg_list):
+        """Reserialize a reply message as a binary message, with its buffers.
+
+        With the json packer, the parts of the message are already JSON,
+        so they are only checked against the signature and passed on as-is.
+        """
+        if self.session.packer == 'json' and \
+                cast_bytes(COMPRESSION_KEY) not in msg_list[3]:
+            self.session.check_signature(msg_list)
+            parts = msg_list[1:]
+        else:
+            # other packers, and compressed buffers, need a full round trip
+            return self._serialize_msg(self.session.unserialize(msg_list))
+        return serialize_binary_message(parts)
+
     def _on_zmq_reply(self, msg_list):
         # Sometimes this gets triggered when the on_close method is scheduled in the
         # eventloop but hasn't been called.
@@ -119,7 +191,7 @@ def _on_zmq_reply(self, msg_list):
         except Exception:
             self.log.critical("Malformed message: %r" % msg_list, exc_info=True)
         else:
-            self.write_message(msg)
+            self.write_message(msg, binary=self.binary)
 
     def allow_draft76(self):
         """Allow draft 76, until browsers such as Safari update to RFC 6455.
@@ -147,6 +219,7 @@ def open(self, kernel_id):
                 raise web.HTTPError(403)
 
         self.session = Session(config=self.config)
+        self.binary = self.get_argument('binary', u'') == u'1'
         self.save_on_message = self.on_message
         self.on_message = self.on_first_message
 
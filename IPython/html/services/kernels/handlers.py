@@ -17,15 +17,20 @@
 #-----------------------------------------------------------------------------
 
 import logging
+import time
+
 from tornado import web
 
+from zmq.eventloop import ioloop
 from zmq.utils import jsonapi
 
-from IPython.utils.jsonutil import date_default
 from IPython.html.utils import url_path_join, url_escape
 
 from ...base.handlers import IPythonHandler, json_errors
-from ...base.zmqhandlers import AuthenticatedZMQStreamHandler
+from ...base.zmqhandlers import (
+    AuthenticatedZMQStreamHandler, deserialize_binary_message,
+    serialize_binary_message, MSG_PARTS,
+)
 
 #-----------------------------------------------------------------------------
 # Kernel handlers
@@ -118,8 +123,18 @@ def on_first_message(self, msg):
             self.zmq_stream.on_recv(self._on_zmq_reply)
 
     def on_message(self, msg):
-        msg = jsonapi.loads(msg)
-        self.session.send(self.zmq_stream, msg)
+        if isinstance(msg, bytes):
+            # a binary message, which may have buffers
+            parts = deserialize_binary_message(msg)
+            if self.session.packer == 'json':
+                # the parts are already JSON, so send them as they are
+                self.session.send_raw(self.zmq_stream, parts)
+                return
+            msg = dict(zip(MSG_PARTS, [jsonapi.loads(part) for part in parts[:4]]))
+            self.session.send(self.zmq_stream, msg, buffers=parts[4:])
+        else:
+            msg = jsonapi.loads(msg)
+            self.session.send(self.zmq_stream, msg)
 
     def on_close(self):
         # This method can be called twice, once by self.kernel_died and once
@@ -131,15 +146,83 @@ def on_close(self):
 
 
 class IOPubHandler(ZMQChannelHandler):
+    """Relays IOPub messages to the websocket, in batches.
+
+    Messages that arrive within batch_interval of each other are sent
+    in one websocket message: a JSON list of messages, or, for binary
+    connections, a binary message whose first part is "batch" and whose
+    other parts are binary messages.
+    Consecutive stream messages with the same parent and name are merged.
+
+    While the websocket is still sending earlier messages, messages are
+    held back.  Once max_queue are waiting, further stream messages
+    are dropped, and a notice of how many were dropped is sent instead.
+    Other messages, including results, errors and displays, are always sent.
+
+    A browser that reconnects can pass the msg_id of the last message
+    it saw as the `last_msg_id` argument, to have the messages it missed
+    replayed from the kernel manager's record.  Merged messages have
+    the msg_id of the last message merged into them.  Messages made by
+    the server, which are not recorded, have 'from_server' in their metadata.
+    """
     channel = 'iopub'
     
+    # The time to wait for more messages, before sending a batch, in seconds.
+    # 0 sends each message as soon as it arrives.
+    batch_interval = 0.02
+    # The most messages to hold for the websocket, not counting merged ones.
+    max_queue = 1000
+    # message types which may be dropped when the queue is full
+    droppable = frozenset(['stream'])
+    
+    def initialize(self, *args, **kwargs):
+        super(IOPubHandler, self).initialize(*args, **kwargs)
+        self._queue = []
+        self._dropped = 0
+        self._dropped_parent = None
+        self._flush_timeout = None
+        # msg_ids of replayed messages, which may also arrive live
+        self._replayed = set()
+    
     def create_stream(self):
         super(IOPubHandler, self).create_stream()
         km = self.kernel_manager
         km.add_restart_callback(self.kernel_id, self.on_kernel_restarted)
         km.add_restart_callback(self.kernel_id, self.on_restart_failed, 'dead')
+        last_msg_id = self.get_argument('last_msg_id', None)
+        if last_msg_id is not None:
+            self.replay(last_msg_id)
+    
+    def replay(self, last_msg_id):
+        """Send the messages the kernel published after last_msg_id
+
+        The new IOPub stream is already subscribed, so the latest of these
+        may also arrive on it.  Their msg_ids are kept, so that they are
+        not sent twice.
+        """
+        msg_lists = self.kernel_manager.replay_iopub(self.kernel_id, last_msg_id)
+        self.log.info("Replaying %i IOPub messages for kernel %s",
+            len(msg_lists), self.kernel_id)
+        for msg_list in msg_lists:
+            msg_list = list(msg_list)
+            msg_id = self._msg_id(msg_list)
+            if msg_id is not None:
+                self._replayed.add(msg_id)
+            self._relay_reply(msg_list)
+    
+    def _msg_id(self, msg_list):
+        """The msg_id of a message from the kernel, or None if it is malformed"""
+        try:
+            idents, parts = self.session.feed_identities(msg_list)
+            return self.session.unpack(parts[1])['msg_id']
+        except Exception:
+            return None
     
     def on_close(self):
+        if self._flush_timeout is not None:
+            ioloop.IOLoop.instance().remove_timeout(self._flush_timeout)
+            self._flush_timeout = None
+        self._queue = []
         km = self.kernel_manager
         if self.kernel_id in km:
             km.remove_restart_callback(
@@ -150,11 +233,112 @@ def on_close(self):
             )
         super(IOPubHandler, self).on_close()
     
+    def _server_msg(self, msg_type, content, parent=None):
+        """A message made by the server, rather than the kernel.
+
+        These are marked, so that the browser doesn't ask to replay
+        the messages after them, which the kernel manager never saw.
+        """
+        return self.session.msg(msg_type, content, parent=parent,
+            metadata={'from_server': True})
+    
     def _send_status_message(self, status):
-        msg = self.session.msg("status",
+        msg = self._server_msg("status",
             {'execution_state': status}
         )
-        self.write_message(jsonapi.dumps(msg, default=date_default))
+        if self.batch_interval:
+            # keep it in order with the messages in the queue
+            self._queue.append(msg)
+            self._schedule_flush()
+        else:
+            self.write_message(self._serialize_msg(msg), binary=self.binary)
+    
+    def _on_zmq_reply(self, msg_list):
+        if self._replayed:
+            if self._msg_id(msg_list) in self._replayed:
+                # already sent by replay
+                return
+            # messages arrive in the order they were published,
+            # so no message after this one was replayed
+            self._replayed.clear()
+        self._relay_reply(msg_list)
+    
+    def _relay_reply(self, msg_list):
+        """Send a message from the kernel to the websocket, batching if enabled"""
+        if not self.batch_interval:
+            return super(IOPubHandler, self)._on_zmq_reply(msg_list)
+        if self.stream.closed(): return
+        try:
+            self._queue_reply(msg_list)
+        except Exception:
+            self.log.critical("Malformed message: %r" % msg_list, exc_info=True)
+        else:
+            self._schedule_flush()
+    
+    def _queue_reply(self, msg_list):
+        """Add a message from the kernel to the queue.
+
+        Stream messages are held as message dicts, so that they can be merged.
+        Other messages are reserialized for the websocket right away.
+        """
+        idents, parts = self.session.feed_identities(msg_list)
+        # the header is only peeked at here, and checked when it is unserialized
+        msg_type = self.session.unpack(parts[1])['msg_type']
+        if len(self._queue) >= self.max_queue and msg_type in self.droppable:
+            self._dropped += 1
+            self._dropped_parent = self.session.unpack(parts[2])
+            return
+        if msg_type != 'stream':
+            self._queue.append(self._reserialize_reply(msg_list))
+            return
+        msg = self.session.unserialize(parts)
+        last = self._queue[-1] if self._queue else None
+        if isinstance(last, dict) and last['msg_type'] == 'stream' and \
+                last['parent_header'].get('msg_id') == msg['parent_header'].get('msg_id') and \
+                last['content']['name'] == msg['content']['name']:
+            last['content']['data'] += msg['content']['data']
+            # a browser that reconnects has seen all of the merged messages
+            last['header'] = msg['header']
+            last['msg_id'] = msg['msg_id']
+        else:
+            self._queue.append(msg)
+    
+    def _schedule_flush(self):
+        if self._flush_timeout is None:
+            loop = ioloop.IOLoop.instance()
+            self._flush_timeout = loop.add_timeout(time.time() + self.batch_interval,
+                self._flush_queue)
+    
+    def _flush_queue(self):
+        """Send the queued messages to the websocket, in one message."""
+        self._flush_timeout = None
+        if self.stream.closed():
+            self._queue = []
+            return
+        if self.stream.writing():
+            # the browser hasn't taken the last batch yet, so wait for it
+            self._schedule_flush()
+            return
+        if self._dropped:
+            notice = self._server_msg('stream', dict(name='stderr',
+                data=u'\n[%i output messages were dropped, because the browser fell behind]\n'
+                    % self._dropped),
+                parent=self._dropped_parent)
+            self._queue.append(notice)
+            self._dropped = 0
+        frames = [
+            self._serialize_msg(item) if isinstance(item, dict) else item
+            for item in self._queue
+        ]
+        self._queue = []
+        if not frames:
+            return
+        if len(frames) == 1:
+            self.write_message(frames[0], binary=self.binary)
+        elif self.binary:
+            self.write_message(serialize_binary_message([b'"batch"'] + frames), binary=True)
+        else:
+            self.write_message(b'[' + b','.join(frames) + b']')
 
     def on_kernel_restarted(self):
         logging.warn("kernel %s restarted", self.kernel_id)
@@ -171,6 +355,31 @@ def on_message(self, msg):
 
 class ShellHandler(ZMQChannelHandler):
     channel = 'shell'
+    
+    def initialize(self, *args, **kwargs):
+        super(ShellHandler, self).initialize(*args, **kwargs)
+        self._executed = False
+    
+    def on_message(self, msg):
+        # a kernel that is being used has its heartbeat checked often
+        self.kernel_manager.record_activity(self.kernel_id)
+        super(ShellHandler, self).on_message(msg)
+    
+    def _on_zmq_reply(self, msg_list):
+        if not self._executed:
+            self._check_first_execute(msg_list)
+        super(ShellHandler, self)._on_zmq_reply(msg_list)
+    
+    def _check_first_execute(self, msg_list):
+        """Tell the kernel manager when the kernel first replies to an execution"""
+        idents, parts = self.session.feed_identities(msg_list)
+        try:
+            header = self.session.unpack(parts[1])
+        except Exception:
+            return
+        if header.get('msg_type') == 'execute_reply':
+            self._executed = True
+            self.kernel_manager.record_first_execute(self.kernel_id)
 
 
 class StdinHandler(ZMQChannelHandler):
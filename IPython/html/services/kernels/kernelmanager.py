@@ -17,12 +17,14 @@
 #-----------------------------------------------------------------------------
 
 import os
+from collections import deque
 
 from tornado import web
 
+from IPython.kernel.ioloop import HeartbeatMonitor
 from IPython.kernel.multikernelmanager import MultiKernelManager
 from IPython.utils.traitlets import (
-    Dict, List, Unicode,
+    Dict, Instance, List, Unicode, Integer, TraitError,
 )
 
 from IPython.html.utils import to_os_path
@@ -33,8 +35,62 @@
 #-----------------------------------------------------------------------------
 
 
+class ReplayBuffer(object):
+    """A buffer of the most recent messages, bounded by count and bytes.
+
+    Messages are stored as they came off the wire, with their msg_ids.
+    """
+
+    def __init__(self, max_count, max_bytes):
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.messages = deque()
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self.messages)
+
+    def append(self, msg_id, msg_list):
+        """Add a message, forgetting the oldest ones if the buffer is full."""
+        nbytes = sum(len(part) for part in msg_list)
+        self.messages.append((msg_id, msg_list, nbytes))
+        self.nbytes += nbytes
+        while self.messages and (len(self.messages) > self.max_count or
+                self.nbytes > self.max_bytes):
+            _, _, dropped = self.messages.popleft()
+            self.nbytes -= dropped
+
+    def since(self, msg_id):
+        """The msg_lists of the messages after msg_id.
+
+        If msg_id is not in the buffer, because it has already been forgotten,
+        or was never recorded, nothing is returned, since there is no telling
+        which of the buffered messages were missed.
+        If msg_id is None, all of the buffered messages are returned.
+        """
+        msg_lists = []
+        for mid, msg_list, nbytes in reversed(self.messages):
+            if mid == msg_id:
+                break
+            msg_lists.append(msg_list)
+        else:
+            if msg_id is not None:
+                return []
+        msg_lists.reverse()
+        return msg_lists
+
+    def clear(self):
+        self.messages.clear()
+        self.nbytes = 0
+
+
+
 class MappingKernelManager(MultiKernelManager):
-    """A KernelManager that handles notebook mapping and HTTP error handling"""
+    """A KernelManager that handles notebook mapping and HTTP error handling
+
+    The kernels' restarters share one HeartbeatMonitor, which pings every kernel
+    from the loop, rather than each polling its kernel on a timer of its own.
+    """
 
     def _kernel_manager_class_default(self):
         return "IPython.kernel.ioloop.IOLoopKernelManager"
@@ -43,6 +99,23 @@ def _kernel_manager_class_default(self):
     
     root_dir = Unicode(getcwd(), config=True)
 
+    iopub_replay_count = Integer(1000, config=True,
+        help="""The number of recent IOPub messages to keep for each kernel,
+        so that they can be replayed to a browser that reconnects.
+        0 disables replay."""
+    )
+    iopub_replay_bytes = Integer(16 * 1024 * 1024, config=True,
+        help="""The most bytes of recent IOPub messages to keep for each kernel."""
+    )
+
+    # the ReplayBuffer and IOPub stream of each kernel, by kernel_id
+    _replay_buffers = Dict()
+    _replay_streams = Dict()
+
+    heartbeat = Instance(HeartbeatMonitor)
+    def _heartbeat_default(self):
+        return HeartbeatMonitor(parent=self, log=self.log)
+
     def _root_dir_changed(self, name, old, new):
         """Do a bit of validation of the root dir."""
         if not os.path.isabs(new):
@@ -61,6 +134,24 @@ def _handle_kernel_died(self, kernel_id):
         self.log.warn("Kernel %s died, removing from map.", kernel_id)
         self.remove_kernel(kernel_id)
     
+    def _launch_kernel(self, kernel_id, **kwargs):
+        """Start a kernel process, watched by the shared heartbeat monitor"""
+        km = self.kernel_manager_factory(connection_file=os.path.join(
+                    self.connection_dir, "kernel-%s.json" % kernel_id),
+                    parent=self, autorestart=True, log=self.log,
+                    heartbeat=self.heartbeat, kernel_id=kernel_id,
+        )
+        km.start_kernel(**kwargs)
+        return km
+
+    def record_activity(self, kernel_id):
+        """Note that a kernel is in use, so its heartbeat is checked often"""
+        self.heartbeat.activity(kernel_id)
+
+    def shutdown_all(self, now=False):
+        super(MappingKernelManager, self).shutdown_all(now=now)
+        self.heartbeat.stop()
+
     def cwd_for_path(self, path):
         """Turn API path into absolute OS path."""
         os_path = to_os_path(path, self.root_dir)
@@ -95,6 +186,7 @@ def start_kernel(self, kernel_id=None, path=None, **kwargs):
                 lambda : self._handle_kernel_died(kernel_id),
                 'dead',
             )
+            self._start_replay(kernel_id)
         else:
             self._check_kernel_id(kernel_id)
             self.log.info("Using existing kernel: %s" % kernel_id)
@@ -105,6 +197,55 @@ def shutdown_kernel(self, kernel_id, now=False):
         self._check_kernel_id(kernel_id)
         super(MappingKernelManager, self).shutdown_kernel(kernel_id, now=now)
 
+    def remove_kernel(self, kernel_id):
+        self._stop_replay(kernel_id)
+        return super(MappingKernelManager, self).remove_kernel(kernel_id)
+
+    #-------------------------------------------------------------------------
+    # IOPub replay
+    #-------------------------------------------------------------------------
+
+    def _start_replay(self, kernel_id):
+        """Start recording the IOPub messages of a kernel"""
+        if not self.iopub_replay_count or not self.iopub_replay_bytes:
+            return
+        session = self.get_kernel(kernel_id).session
+        replay = ReplayBuffer(self.iopub_replay_count, self.iopub_replay_bytes)
+
+        def record(msg_list):
+            try:
+                idents, parts = session.feed_identities(msg_list)
+                msg_id = session.unpack(parts[1])['msg_id']
+            except Exception:
+                self.log.warn("Not recording malformed IOPub message", exc_info=True)
+                return
+            replay.append(msg_id, msg_list)
+
+        stream = self.connect_iopub(kernel_id)
+        stream.on_recv(record)
+        self._replay_buffers[kernel_id] = replay
+        self._replay_streams[kernel_id] = stream
+
+    def _stop_replay(self, kernel_id):
+        stream = self._replay_streams.pop(kernel_id, None)
+        if stream is not None and not stream.closed():
+            stream.on_recv(None)
+            stream.close()
+        self._replay_buffers.pop(kernel_id, None)
+
+    def replay_iopub(self, kernel_id, last_msg_id=None):
+        """Return the recorded IOPub messages of a kernel after last_msg_id.
+
+        Messages are returned as the msg_lists they were received as.
+        If last_msg_id is None, all of the recorded messages are returned,
+        and if it is unknown, none are.
+        """
+        self._check_kernel_id(kernel_id)
+        replay = self._replay_buffers.get(kernel_id)
+        if replay is None:
+            return []
+        return replay.since(last_msg_id)
+
     def kernel_model(self, kernel_id):
         """Return a dictionary of kernel information described in the
         JSON standard model."""
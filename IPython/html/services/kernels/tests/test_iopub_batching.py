@@ -0,0 +1,266 @@
+"""Test the batching of IOPub messages to the websocket"""
+
+import json
+import struct
+from unittest import TestCase
+
+from IPython.kernel.zmq.session import Session
+from IPython.html.base.zmqhandlers import deserialize_binary_message
+from IPython.html.services.kernels.handlers import IOPubHandler
+from IPython.html.services.kernels.kernelmanager import ReplayBuffer
+
+
+def split_binary(bmsg):
+    """Split a binary websocket message into its parts,
+    without deserialize_binary_message's check for the parts of a message"""
+    n, = struct.unpack('!I', bmsg[:4])
+    offsets = list(struct.unpack('!%iI' % n, bmsg[4:4 * (n + 1)])) + [len(bmsg)]
+    return [ bmsg[start:stop] for start, stop in zip(offsets[:-1], offsets[1:]) ]
+
+
+class FakeStream(object):
+    """The websocket's IOStream, which may still be writing"""
+    def __init__(self):
+        self.is_writing = False
+
+    def closed(self):
+        return False
+
+    def writing(self):
+        return self.is_writing
+
+
+class IOPubTestHandler(IOPubHandler):
+    """An IOPubHandler that records what it writes to the websocket,
+    and is flushed by hand."""
+    kernel_manager = None
+
+    def __init__(self, session, binary=False):
+        # skip RequestHandler.__init__, which needs an Application
+        self.session = session
+        self.binary = binary
+        self.stream = FakeStream()
+        self.sent = []
+        self.initialize()
+
+    def write_message(self, message, binary=False):
+        self.sent.append((message, binary))
+
+    def _schedule_flush(self):
+        pass
+
+
+class IOPubBatchingTest(TestCase):
+
+    def setUp(self):
+        self.session = Session(key=b'secret')
+        self.parent = self.session.msg('execute_request')
+        self.handler = IOPubTestHandler(self.session)
+
+    def publish(self, msg_type, content, parent=None):
+        """Send a message from the kernel to the handler"""
+        if parent is None:
+            parent = self.parent
+        msg = self.session.msg(msg_type, content, parent=parent)
+        self.handler._on_zmq_reply(self.session.serialize(msg))
+        return msg
+
+    def stream(self, data, name='stdout', parent=None):
+        return self.publish('stream', dict(name=name, data=data), parent)
+
+    def flush(self):
+        """Flush the handler, and return the messages it wrote"""
+        self.handler._flush_queue()
+        msgs = []
+        for message, binary in self.handler.sent:
+            msg = json.loads(message)
+            msgs.extend(msg if isinstance(msg, list) else [msg])
+        self.handler.sent = []
+        return msgs
+
+    def test_merge_streams(self):
+        for data in ('a', 'b', 'c'):
+            self.stream(data)
+        msgs = self.flush()
+        self.assertEqual(len(msgs), 1)
+        self.assertEqual(msgs[0]['content'], dict(name='stdout', data='abc'))
+
+    def test_no_merge(self):
+        other = self.session.msg('execute_request')
+        self.stream('a')
+        self.stream('b', name='stderr')
+        self.stream('c', name='stderr', parent=other)
+        self.stream('d', name='stderr', parent=other)
+        msgs = self.flush()
+        self.assertEqual([ msg['content']['data'] for msg in msgs ], ['a', 'b', 'cd'])
+        self.assertEqual(msgs[2]['parent_header']['msg_id'], other['header']['msg_id'])
+
+    def test_order(self):
+        self.publish('status', dict(execution_state='busy'))
+        self.stream('a')
+        self.handler._send_status_message('restarting')
+        self.stream('b')
+        self.publish('status', dict(execution_state='idle'))
+        msgs = self.flush()
+        self.assertEqual([ msg['msg_type'] for msg in msgs ],
+            ['status', 'stream', 'status', 'stream', 'status'])
+        self.assertEqual([ msg['content'].get('execution_state') for msg in msgs[::2] ],
+            ['busy', 'restarting', 'idle'])
+        # streams aren't merged across other messages
+        self.assertEqual([ msg['content']['data'] for msg in msgs[1::2] ], ['a', 'b'])
+
+    def test_drop(self):
+        self.handler.max_queue = 2
+        last_parent = None
+        for i in range(5):
+            last_parent = self.session.msg('execute_request')
+            self.stream('%i' % i, parent=last_parent)
+        # status messages are never dropped
+        self.publish('status', dict(execution_state='idle'))
+        msgs = self.flush()
+        self.assertEqual([ msg['msg_type'] for msg in msgs ],
+            ['stream', 'stream', 'status', 'stream'])
+        notice = msgs[-1]
+        self.assertEqual(notice['content']['name'], 'stderr')
+        self.assertTrue('[3 output messages were dropped' in notice['content']['data'])
+        self.assertEqual(notice['parent_header']['msg_id'], last_parent['header']['msg_id'])
+        # the count starts again after the notice
+        self.stream('again')
+        msgs = self.flush()
+        self.assertEqual(len(msgs), 1)
+        self.assertEqual(msgs[0]['content']['data'], 'again')
+
+    def test_drop_only_streams(self):
+        """results, errors and displays are sent even when the queue is full"""
+        self.handler.max_queue = 1
+        self.stream('a')
+        self.publish('pyout', dict(data={'text/plain': '1'}, metadata={}, execution_count=1))
+        self.publish('display_data', dict(data={'text/plain': 'b'}, metadata={}))
+        self.publish('pyerr', dict(ename='E', evalue='e', traceback=[]))
+        self.stream('c')
+        msgs = self.flush()
+        self.assertEqual([ msg['msg_type'] for msg in msgs ],
+            ['stream', 'pyout', 'display_data', 'pyerr', 'stream'])
+        self.assertTrue('[1 output messages were dropped' in msgs[-1]['content']['data'])
+
+    def test_merge_doesnt_count(self):
+        """merged messages don't count towards max_queue"""
+        self.handler.max_queue = 2
+        for data in ('a', 'b', 'c', 'd'):
+            self.stream(data)
+        self.publish('display_data', dict(data={'text/plain': 'e'}, metadata={}))
+        msgs = self.flush()
+        self.assertEqual([ msg['msg_type'] for msg in msgs ], ['stream', 'display_data'])
+        self.assertEqual(msgs[0]['content']['data'], 'abcd')
+
+    def test_full_queue_drops_merges(self):
+        """once the queue is full, output is dropped rather than merged,
+        so that it doesn't grow while the browser is behind"""
+        self.handler.max_queue = 1
+        for data in ('a', 'b', 'c'):
+            self.stream(data)
+        msgs = self.flush()
+        self.assertEqual(len(msgs), 2)
+        self.assertEqual(msgs[0]['content']['data'], 'a')
+        self.assertTrue('[2 output messages were dropped' in msgs[1]['content']['data'])
+
+    def test_single(self):
+        self.stream('a')
+        self.handler._flush_queue()
+        message, binary = self.handler.sent[0]
+        self.assertFalse(binary)
+        self.assertEqual(json.loads(message)['content']['data'], 'a')
+
+    def test_json_batch(self):
+        self.stream('a')
+        self.publish('display_data', dict(data={'text/plain': 'b'}, metadata={}))
+        self.handler._flush_queue()
+        self.assertEqual(len(self.handler.sent), 1)
+        message, binary = self.handler.sent[0]
+        self.assertFalse(binary)
+        msgs = json.loads(message)
+        self.assertEqual([ msg['msg_type'] for msg in msgs ], ['stream', 'display_data'])
+
+    def test_binary_batch(self):
+        self.handler = IOPubTestHandler(self.session, binary=True)
+        self.stream('a')
+        self.publish('display_data', dict(data={'text/plain': 'b'}, metadata={}))
+        self.handler._flush_queue()
+        self.assertEqual(len(self.handler.sent), 1)
+        message, binary = self.handler.sent[0]
+        self.assertTrue(binary)
+        parts = split_binary(message)
+        self.assertEqual(parts[0], b'"batch"')
+        self.assertEqual(len(parts), 3)
+        headers = [ json.loads(deserialize_binary_message(part)[0].decode('utf8'))
+                    for part in parts[1:] ]
+        self.assertEqual([ h['msg_type'] for h in headers ], ['stream', 'display_data'])
+
+    def test_wait_for_writing(self):
+        self.stream('a')
+        self.handler.stream.is_writing = True
+        self.assertEqual(self.flush(), [])
+        self.stream('b')
+        self.handler.stream.is_writing = False
+        msgs = self.flush()
+        self.assertEqual(len(msgs), 1)
+        self.assertEqual(msgs[0]['content']['data'], 'ab')
+
+    def test_replay_dedupe(self):
+        """messages published between subscribing and replaying aren't sent twice"""
+        self.handler.batch_interval = 0
+        published = [ self.session.msg('stream', dict(name='stdout', data=data),
+                                       parent=self.parent)
+                      for data in 'abc' ]
+        msg_lists = [ self.session.serialize(msg) for msg in published ]
+
+        class FakeKernelManager(object):
+            def replay_iopub(self, kernel_id, last_msg_id):
+                return msg_lists
+
+        self.handler.kernel_manager = FakeKernelManager()
+        self.handler.kernel_id = 'kernel'
+        self.handler.replay('last')
+        # 'b' and 'c' were also received by the new stream
+        for msg_list in msg_lists[1:]:
+            self.handler._on_zmq_reply(msg_list)
+        self.stream('d')
+        self.assertEqual(self.handler._replayed, set())
+        msgs = [ json.loads(message) for message, binary in self.handler.sent ]
+        self.assertEqual([ msg['content']['data'] for msg in msgs ], list('abcd'))
+
+    def test_replay_after_merge(self):
+        """a browser that saw a merged message doesn't get its parts again"""
+        replay = ReplayBuffer(100, 10000)
+        for data in 'abc':
+            msg = self.stream(data)
+            replay.append(msg['header']['msg_id'], self.session.serialize(msg))
+        msgs = self.flush()
+        self.assertEqual(len(msgs), 1)
+        self.assertEqual(msgs[0]['header']['msg_id'], msg['header']['msg_id'])
+        # 'd' is published while the browser is away
+        msg = self.session.msg('stream', dict(name='stdout', data='d'), parent=self.parent)
+        replay.append(msg['header']['msg_id'], self.session.serialize(msg))
+
+        class FakeKernelManager(object):
+            def replay_iopub(self, kernel_id, last_msg_id):
+                return replay.since(last_msg_id)
+
+        handler = IOPubTestHandler(self.session)
+        handler.batch_interval = 0
+        handler.kernel_manager = FakeKernelManager()
+        handler.kernel_id = 'kernel'
+        handler.replay(msgs[0]['header']['msg_id'])
+        replayed = [ json.loads(message) for message, binary in handler.sent ]
+        self.assertEqual([ msg['content']['data'] for msg in replayed ], ['d'])
+
+    def test_server_messages_marked(self):
+        """messages made by the server, which can't be replayed, are marked"""
+        self.handler.max_queue = 1
+        self.stream('a')
+        self.stream('b', name='stderr')
+        self.handler._send_status_message('restarting')
+        msgs = self.flush()
+        self.assertEqual([ msg['msg_type'] for msg in msgs ], ['stream', 'status', 'stream'])
+        self.assertEqual([ msg['metadata'].get('from_server') for msg in msgs ],
+            [None, True, True])
@@ -0,0 +1,46 @@
+"""Test the IOPub replay buffer"""
+
+from unittest import TestCase
+
+from IPython.html.services.kernels.kernelmanager import ReplayBuffer
+
+
+def make_msg(i, size=10):
+    return ('msg-%i' % i, [b'topic', b'x' * size])
+
+
+class ReplayBufferTest(TestCase):
+
+    def fill(self, replay, n, size=10):
+        for i in range(n):
+            replay.append(*make_msg(i, size))
+
+    def test_since(self):
+        replay = ReplayBuffer(100, 10000)
+        self.fill(replay, 10)
+        self.assertEqual(replay.since('msg-7'), [make_msg(i)[1] for i in (8, 9)])
+        self.assertEqual(replay.since('msg-9'), [])
+
+    def test_unknown_msg_id(self):
+        replay = ReplayBuffer(100, 10000)
+        self.fill(replay, 3)
+        self.assertEqual(replay.since('forgotten'), [])
+        self.assertEqual(len(replay.since(None)), 3)
+
+    def test_max_count(self):
+        replay = ReplayBuffer(5, 10000)
+        self.fill(replay, 10)
+        self.assertEqual(len(replay), 5)
+        self.assertEqual(replay.since('msg-5'), [make_msg(i)[1] for i in range(6, 10)])
+        # msg-4 has been forgotten
+        self.assertEqual(replay.since('msg-4'), [])
+
+    def test_max_bytes(self):
+        replay = ReplayBuffer(100, 200)
+        # each message is 5 + 50 bytes
+        self.fill(replay, 10, size=50)
+        self.assertEqual(len(replay), 3)
+        self.assertTrue(replay.nbytes <= 200)
+        replay.clear()
+        self.assertEqual(len(replay), 0)
+        self.assertEqual(replay.nbytes, 0)
@@ -31,6 +31,8 @@ var IPython = (function (IPython) {
         this.username = "username";
         this.session_id = utils.uuid();
         this._msg_callbacks = {};
+        // the last IOPub message seen, so missed messages can be replayed on reconnect
+        this.last_iopub_msg_id = null;
 
         if (typeof(WebSocket) !== 'undefined') {
             this.WebSocket = WebSocket;
@@ -127,6 +129,8 @@ var IPython = (function (IPython) {
         // trailing 's' in https will become wss for secure web sockets
         this.ws_host = location.protocol.replace('http', 'ws') + "//" + location.host;
         this.kernel_url = utils.url_path_join(this.kernel_service_url, this.kernel_id);
+        // a new or restarted kernel has nothing to replay
+        this.last_iopub_msg_id = null;
         this.start_channels();
     };
 
@@ -149,14 +153,22 @@ var IPython = (function (IPython) {
         this.stop_channels();
         var ws_host_url = this.ws_host + this.kernel_url;
         console.log("Starting WebSockets:", ws_host_url);
+        // ask for binary messages, which carry buffers, if we can read them
+        var query = (typeof(ArrayBuffer) !== 'undefined') ? '?binary=1' : '';
         this.shell_channel = new this.WebSocket(
-            this.ws_host + utils.url_join_encode(this.kernel_url, "shell")
+            this.ws_host + utils.url_join_encode(this.kernel_url, "shell") + query
         );
         this.stdin_channel = new this.WebSocket(
-            this.ws_host + utils.url_join_encode(this.kernel_url, "stdin")
+            this.ws_host + utils.url_join_encode(this.kernel_url, "stdin") + query
         );
+        var iopub_query = query;
+        if (this.last_iopub_msg_id !== null) {
+            // reconnecting, so ask for the messages we missed
+            iopub_query += (iopub_query ? '&' : '?') +
+                $.param({last_msg_id: this.last_iopub_msg_id});
+        }
         this.iopub_channel = new this.WebSocket(
-            this.ws_host + utils.url_join_encode(this.kernel_url, "iopub")
+            this.ws_host + utils.url_join_encode(this.kernel_url, "iopub") + iopub_query
         );
         
         var already_called_onclose = false; // only alert once
@@ -180,6 +192,7 @@ var IPython = (function (IPython) {
         };
         var channels = [this.shell_channel, this.iopub_channel, this.stdin_channel];
         for (var i=0; i < channels.length; i++) {
+            channels[i].binaryType = 'arraybuffer';
             channels[i].onopen = $.proxy(this._ws_opened, this);
             channels[i].onclose = ws_closed_early;
         }
@@ -484,8 +497,76 @@ var IPython = (function (IPython) {
     };
 
 
+    var decode_utf8 = function (bytes) {
+        if (typeof(TextDecoder) !== 'undefined') {
+            return new TextDecoder('utf-8').decode(bytes);
+        }
+        // build the string in chunks, to stay under the limit on arguments
+        var chunks = [];
+        for (var i=0; i < bytes.length; i += 8192) {
+            chunks.push(String.fromCharCode.apply(null, bytes.subarray(i, i + 8192)));
+        }
+        return decodeURIComponent(escape(chunks.join('')));
+    };
+
+    /**
+     * Unpack a message from a websocket.
+     *
+     * Text messages are JSON.  Binary messages start with the number of
+     * parts, and the offset of each part, as big-endian uint32s.
+     * The first four parts are the header, parent_header, metadata and content
+     * as utf8 JSON, and the rest are the message's buffers, as DataViews.
+     *
+     * IOPub messages may come in batches: a JSON list of messages,
+     * or a binary message whose first part is "batch", and whose
+     * other parts are binary messages.  Batches are returned as lists.
+     *
+     * @method _deserialize_msg
+     * @param data {String|ArrayBuffer}
+     */
+    Kernel.prototype._deserialize_msg = function (data) {
+        if (typeof(data) === 'string') {
+            return $.parseJSON(data);
+        }
+        var view = new DataView(data);
+        var nparts = view.getUint32(0);
+        var offsets = [];
+        for (var i=0; i < nparts; i++) {
+            offsets.push(view.getUint32(4 * (i + 1)));
+        }
+        offsets.push(data.byteLength);
+        var first = $.parseJSON(decode_utf8(new Uint8Array(data, offsets[0], offsets[1] - offsets[0])));
+        if (first === 'batch') {
+            var msgs = [];
+            for (i=1; i < nparts; i++) {
+                msgs.push(this._deserialize_msg(data.slice(offsets[i], offsets[i+1])));
+            }
+            return msgs;
+        }
+        var parts = [first];
+        for (i=1; i < 4; i++) {
+            parts.push($.parseJSON(decode_utf8(
+                new Uint8Array(data, offsets[i], offsets[i+1] - offsets[i])
+            )));
+        }
+        var buffers = [];
+        for (i=4; i < nparts; i++) {
+            buffers.push(new DataView(data, offsets[i], offsets[i+1] - offsets[i]));
+        }
+        return {
+            header : parts[0],
+            parent_header : parts[1],
+            metadata : parts[2],
+            content : parts[3],
+            msg_id : parts[0].msg_id,
+            msg_type : parts[0].msg_type,
+            buffers : buffers
+        };
+    };
+
+
     Kernel.prototype._handle_shell_reply = function (e) {
-        var reply = $.parseJSON(e.data);
+        var reply = this._deserialize_msg(e.data);
         $([IPython.events]).trigger('shell_reply.Kernel', {kernel: this, reply:reply});
         var content = reply.content;
         var metadata = reply.metadata;
@@ -587,17 +668,26 @@ var IPython = (function (IPython) {
     // dispatch IOPub messages to respective handlers.
     // each message type should have a handler.
     Kernel.prototype._handle_iopub_message = function (e) {
-        var msg = $.parseJSON(e.data);
-
-        var handler = this.get_iopub_handler(msg.header.msg_type);
-        if (handler !== undefined) {
-            handler(msg);
+        var msgs = this._deserialize_msg(e.data);
+        if (!$.isArray(msgs)) {
+            msgs = [msgs];
+        }
+        for (var i=0; i < msgs.length; i++) {
+            var msg = msgs[i];
+            // messages made by the server itself are not replayed
+            if (msg.header.msg_id && !(msg.metadata && msg.metadata.from_server)) {
+                this.last_iopub_msg_id = msg.header.msg_id;
+            }
+            var handler = this.get_iopub_handler(msg.header.msg_type);
+            if (handler !== undefined) {
+                handler(msg);
+            }
         }
     };
 
 
     Kernel.prototype._handle_input_request = function (e) {
-        var request = $.parseJSON(e.data);
+        var request = this._deserialize_msg(e.data);
         var header = request.header;
         var content = request.content;
         var metadata = request.metadata;
@@ -0,0 +1,40 @@
+"""Test the binary websocket message format"""
+
+#-----------------------------------------------------------------------------
+#  Copyright (C) 2014 The IPython Development Team
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Imports
+#-----------------------------------------------------------------------------
+
+import struct
+
+import nose.tools as nt
+
+from IPython.html.base.zmqhandlers import (
+    serialize_binary_message, deserialize_binary_message,
+)
+
+#-----------------------------------------------------------------------------
+# Test functions
+#-----------------------------------------------------------------------------
+
+def test_binary_roundtrip():
+    parts = [b'{"msg_id": "a"}', b'{}', b'{}', b'{"data": 1}', b'\x00\x01\x02', b'']
+    bmsg = serialize_binary_message(parts)
+    nt.assert_equal(struct.unpack('!I', bmsg[:4])[0], len(parts))
+    nt.assert_equal(deserialize_binary_message(bmsg), parts)
+
+def test_binary_buffers():
+    parts = [b'{}'] * 4 + [memoryview(b'buffer')]
+    bmsg = serialize_binary_message(parts)
+    nt.assert_equal(deserialize_binary_message(bmsg)[4], b'buffer')
+
+def test_binary_too_short():
+    bmsg = serialize_binary_message([b'{}', b'{}'])
+    with nt.assert_raises(ValueError):
+        deserialize_binary_message(bmsg)
@@ -1,2 +1,4 @@
 from .manager import IOLoopKernelManager
 from .restarter import IOLoopKernelRestarter
+from .client import IOLoopKernelClient
+from .heartbeat import HeartbeatMonitor
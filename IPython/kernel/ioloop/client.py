@@ -0,0 +1,323 @@
+"""A kernel client that runs all of its channels on one IOLoop.
+
+Unlike KernelClient, which runs each channel in its own thread with its own
+IOLoop, an IOLoopKernelClient has no threads.  Its sockets are ZMQStreams
+on a single loop, which may be shared by the clients of many kernels::
+
+    clients = []
+    for connection_file in connection_files:
+        kc = IOLoopKernelClient(connection_file=connection_file)
+        kc.load_connection_file()
+        kc.start_channels()
+        clients.append(kc)
+    futures = [ kc.execute('run_report()') for kc in clients ]
+    ...
+    ioloop.IOLoop.instance().start()
+
+Requests on the shell channel return Futures, which are resolved with
+the reply message when it arrives.  The Futures are tornado Futures,
+if tornado is available, so they can be yielded in coroutines.
+
+The clients have no heartbeat channels of their own.  Instead, they can share
+a :class:`~.HeartbeatMonitor`, which pings all of their kernels from the loop,
+and answers :meth:`IOLoopKernelClient.is_alive`::
+
+    monitor = HeartbeatMonitor()
+    monitor.start()
+    kc = IOLoopKernelClient(connection_file=connection_file, heartbeat=monitor)
+"""
+
+#-----------------------------------------------------------------------------
+#  Copyright (C) 2014  The IPython Development Team
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Imports
+#-----------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+import zmq
+from zmq.eventloop import ioloop
+from zmq.eventloop.zmqstream import ZMQStream
+
+try:
+    from tornado.concurrent import Future
+except ImportError:
+    from concurrent.futures import Future
+
+from IPython.config.configurable import LoggingConfigurable
+from IPython.utils.traitlets import Any, Bool, Dict, Instance, Unicode
+
+from IPython.kernel.zmq.session import Session
+from IPython.kernel.connect import ConnectionFileMixin
+from IPython.kernel.channels import validate_string_list, validate_string_dict
+from IPython.utils.py3compat import string_types
+
+#-----------------------------------------------------------------------------
+# Code
+#-----------------------------------------------------------------------------
+
+class IOLoopKernelClient(LoggingConfigurable, ConnectionFileMixin):
+    """Communicates with a kernel via ZMQStreams on a single IOLoop.
+
+    Everything happens in the loop's thread, so the methods of this client
+    must only be called from that thread, or via loop.add_callback.
+
+    Messages on each channel are passed to the handlers registered with
+    :meth:`add_handler`.  Replies on the shell channel also resolve the
+    Future returned by the method that made the request.
+    """
+
+    # The PyZMQ Context to use for communication with the kernel.
+    context = Instance(zmq.Context)
+    def _context_default(self):
+        return zmq.Context.instance()
+
+    # The Session to use for communication with the kernel.
+    session = Instance(Session)
+    def _session_default(self):
+        return Session(parent=self)
+
+    loop = Instance('zmq.eventloop.ioloop.IOLoop', allow_none=False)
+    def _loop_default(self):
+        return ioloop.IOLoop.instance()
+
+    # The HeartbeatMonitor watching the kernel, which may be shared with other clients.
+    # Without one, is_alive can't tell whether the kernel is alive.
+    heartbeat = Instance('IPython.kernel.ioloop.heartbeat.HeartbeatMonitor')
+
+    # The kernel's name in the heartbeat monitor.
+    # The url of its heartbeat socket, if not given.
+    kernel_id = Unicode()
+
+    # the ZMQStreams of the channels that are running
+    shell_stream = Any()
+    iopub_stream = Any()
+    stdin_stream = Any()
+
+    # flag for whether execute requests should be allowed to call raw_input
+    allow_stdin = True
+
+    # Futures of requests awaiting replies, by msg_id
+    _futures = Dict()
+    # whether start_channels added the kernel to the heartbeat monitor
+    _watching = Bool(False)
+    # handlers for each channel
+    _handlers = Dict()
+
+    def __init__(self, **kwargs):
+        super(IOLoopKernelClient, self).__init__(**kwargs)
+        self._handlers = dict(shell=[], iopub=[], stdin=[])
+
+    #--------------------------------------------------------------------------
+    # Channel management methods
+    #--------------------------------------------------------------------------
+
+    def _connect(self, channel, socket_type):
+        url = self._make_url(channel)
+        self.log.debug("connecting %s channel to %s", channel, url)
+        socket = self.context.socket(socket_type)
+        if socket_type == zmq.DEALER:
+            socket.setsockopt(zmq.IDENTITY, self.session.bsession)
+        elif socket_type == zmq.SUB:
+            socket.setsockopt(zmq.SUBSCRIBE, b'')
+        socket.connect(url)
+        stream = ZMQStream(socket, self.loop)
+        stream.on_recv(lambda msg_list: self._handle_recv(channel, msg_list))
+        return stream
+
+    def start_channels(self, shell=True, iopub=True, stdin=True, hb=True):
+        """Connect the channels to the kernel.
+
+        No threads are started.  Messages are handled when the loop runs.
+        If there is a heartbeat monitor, and hb is True, the kernel is
+        added to it, unless it is already being watched.
+        """
+        if hb and self.heartbeat is not None:
+            kernel_id = self._heartbeat_id()
+            if kernel_id not in self.heartbeat:
+                self.heartbeat.add_kernel(kernel_id, self._make_url('hb'))
+                self._watching = True
+        if shell:
+            self.shell_stream = self._connect('shell', zmq.DEALER)
+        if iopub:
+            self.iopub_stream = self._connect('iopub', zmq.SUB)
+        if stdin:
+            self.stdin_stream = self._connect('stdin', zmq.DEALER)
+        self.allow_stdin = stdin
+
+    def stop_channels(self):
+        """Close the channels.
+
+        Requests that have not been replied to fail with RuntimeError.
+        """
+        for name in ('shell_stream', 'iopub_stream', 'stdin_stream'):
+            stream = getattr(self, name)
+            if stream is not None:
+                stream.on_recv(None)
+                stream.close(linger=0)
+                setattr(self, name, None)
+        if self._watching:
+            self.heartbeat.remove_kernel(self._heartbeat_id())
+            self._watching = False
+        futures = self._futures
+        self._futures = {}
+        for msg_id, future in futures.items():
+            future.set_exception(RuntimeError("Channels stopped before reply to %s" % msg_id))
+
+    @property
+    def channels_running(self):
+        """Are any of the channels connected?"""
+        return any(stream is not None for stream in
+            (self.shell_stream, self.iopub_stream, self.stdin_stream))
+
+    def add_handler(self, callback, channel='iopub'):
+        """Register a callback for messages on a channel.
+
+        The callback is called with each message, as a dict.
+        """
+        self._handlers[channel].append(callback)
+
+    def remove_handler(self, callback, channel='iopub'):
+        """Unregister a callback added with :meth:`add_handler`"""
+        try:
+            self._handlers[channel].remove(callback)
+        except ValueError:
+            pass
+
+    def _handle_recv(self, channel, msg_list):
+        """Unpack a message, resolve its Future, and call its handlers."""
+        idents, msg_list = self.session.feed_identities(msg_list)
+        try:
+            msg = self.session.unserialize(msg_list)
+        except Exception:
+            self.log.error("Invalid message on %s channel", channel, exc_info=True)
+            return
+        if channel == 'shell':
+            parent_id = msg['parent_header'].get('msg_id')
+            future = self._futures.pop(parent_id, None)
+            if future is not None:
+                future.set_result(msg)
+        for callback in self._handlers[channel]:
+            try:
+                callback(msg)
+            except Exception:
+                self.log.error("Exception in %s handler %r", channel, callback, exc_info=True)
+
+    def _heartbeat_id(self):
+        return self.kernel_id or self._make_url('hb')
+
+    def is_alive(self):
+        """Is the kernel answering the pings of the heartbeat monitor?
+
+        Raises RuntimeError if the kernel isn't being watched by a monitor,
+        because this client has no other way to tell.
+        """
+        kernel_id = self._heartbeat_id()
+        if self.heartbeat is None or kernel_id not in self.heartbeat:
+            raise RuntimeError("No heartbeat monitor is watching kernel %s" % kernel_id)
+        return self.heartbeat.is_beating(kernel_id)
+
+    #--------------------------------------------------------------------------
+    # Shell requests
+    #--------------------------------------------------------------------------
+
+    def _request(self, msg_type, content=None):
+        """Send a request on the shell channel, and return a Future for its reply.
+
+        The msg_id of the request is the Future's msg_id attribute.
+        """
+        if self.shell_stream is None:
+            raise RuntimeError("The shell channel is not running")
+        msg = self.session.msg(msg_type, content)
+        msg_id = msg['header']['msg_id']
+        future = Future()
+        future.msg_id = msg_id
+        self._futures[msg_id] = future
+        self.session.send(self.shell_stream, msg)
+        return future
+
+    def execute(self, code, silent=False, store_history=True,
+                user_variables=None, user_expressions=None, allow_stdin=None):
+        """Execute code in the kernel.
+
+        See :meth:`IPython.kernel.channels.ShellChannel.execute` for the arguments.
+
+        Returns
+        -------
+        A Future, for the execute_reply.  Output is published on IOPub,
+        and may still be arriving when the reply does.
+        """
+        if user_variables is None:
+            user_variables = []
+        if user_expressions is None:
+            user_expressions = {}
+        if allow_stdin is None:
+            allow_stdin = self.allow_stdin
+
+        if not isinstance(code, string_types):
+            raise ValueError('code %r must be a string' % code)
+        validate_string_list(user_variables)
+        validate_string_dict(user_expressions)
+
+        content = dict(code=code, silent=silent, store_history=store_history,
+                       user_variables=user_variables,
+                       user_expressions=user_expressions,
+                       allow_stdin=allow_stdin,
+                       )
+        return self._request('execute_request', content)
+
+    def complete(self, text, line, cursor_pos, block=None):
+        """Tab complete text in the kernel's namespace.
+
+        Returns a Future for the complete_reply.
+        """
+        content = dict(text=text, line=line, block=block, cursor_pos=cursor_pos)
+        return self._request('complete_request', content)
+
+    def object_info(self, oname, detail_level=0):
+        """Get metadata information about an object in the kernel's namespace.
+
+        Returns a Future for the object_info_reply.
+        """
+        content = dict(oname=oname, detail_level=detail_level)
+        return self._request('object_info_request', content)
+
+    def history(self, raw=True, output=False, hist_access_type='range', **kwargs):
+        """Get entries from the kernel's history list.
+
+        Returns a Future for the history_reply.
+        """
+        content = dict(raw=raw, output=output, hist_access_type=hist_access_type,
+                                                                    **kwargs)
+        return self._request('history_request', content)
+
+    def kernel_info(self):
+        """Request kernel info.
+
+        Returns a Future for the kernel_info_reply.
+        """
+        return self._request('kernel_info_request')
+
+    def shutdown(self, restart=False):
+        """Request an immediate kernel shutdown.
+
+        Returns a Future for the shutdown_reply.
+        """
+        return self._request('shutdown_request', {'restart': restart})
+
+    #--------------------------------------------------------------------------
+    # Stdin
+    #--------------------------------------------------------------------------
+
+    def input(self, string):
+        """Send a string of raw input to the kernel."""
+        if self.stdin_stream is None:
+            raise RuntimeError("The stdin channel is not running")
+        content = dict(value=string)
+        msg = self.session.msg('input_reply', content)
+        self.session.send(self.stdin_stream, msg)
@@ -0,0 +1,215 @@
+"""A heartbeat monitor for many kernels, on one IOLoop.
+
+Rather than a thread and a REQ socket per kernel, as with HBChannel,
+the HeartbeatMonitor pings every kernel from the loop's single poller,
+and checks them all from one timer.
+"""
+
+#-----------------------------------------------------------------------------
+#  Copyright (C) 2014  The IPython Development Team
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Imports
+#-----------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+import time
+
+import zmq
+from zmq.eventloop import ioloop
+from zmq.eventloop.zmqstream import ZMQStream
+
+from IPython.config.configurable import LoggingConfigurable
+from IPython.utils.traitlets import Dict, Float, Instance
+from IPython.utils.py3compat import cast_bytes
+
+#-----------------------------------------------------------------------------
+# Code
+#-----------------------------------------------------------------------------
+
+class _Heart(object):
+    """The heartbeat state of one kernel"""
+
+    def __init__(self, stream, interval):
+        self.stream = stream
+        self.interval = interval
+        # the payload and send time of the ping awaiting a reply, if any
+        self.ping = None
+        self.ping_time = 0
+        self.next_ping = 0
+        self.beating = True
+        # whether the kernel has answered any ping yet
+        self.answered = False
+        self.pings = 0
+
+
+class HeartbeatMonitor(LoggingConfigurable):
+    """Monitor the heartbeats of many kernels, on one IOLoop.
+
+    Each kernel is pinged with a DEALER socket, so a missed reply doesn't
+    leave the socket stuck, as it would a REQ socket.
+
+    Kernels that have just been added, have missed a beat, or have been
+    marked active with :meth:`activity` are pinged every `min_interval`.
+    The interval doubles with each reply, up to `max_interval`,
+    so idle kernels cost little.
+
+    Changes in liveness are reported to callbacks registered with
+    :meth:`add_callback`, as 'dead' and 'alive' events.  A kernel is
+    reported 'alive' when it first answers, too, so that a kernel that
+    was restarted can be seen to have come up.
+    """
+
+    loop = Instance('zmq.eventloop.ioloop.IOLoop', allow_none=False)
+    def _loop_default(self):
+        return ioloop.IOLoop.instance()
+
+    context = Instance(zmq.Context)
+    def _context_default(self):
+        return zmq.Context.instance()
+
+    time_to_dead = Float(3.0, config=True,
+        help="""The time to wait for a reply to a ping, before a kernel is considered dead."""
+    )
+    min_interval = Float(1.0, config=True,
+        help="""The time between pings for kernels that are active,
+        or have recently missed a beat."""
+    )
+    max_interval = Float(30.0, config=True,
+        help="""The most time between pings, for kernels that are idle."""
+    )
+    resolution = Float(0.5, config=True,
+        help="""How often the monitor checks for pings to send or that have timed out."""
+    )
+
+    _hearts = Dict()
+    callbacks = Dict()
+    def _callbacks_default(self):
+        return dict(dead=[], alive=[])
+
+    _pcallback = None
+
+    def start(self):
+        """Start checking the kernels' heartbeats."""
+        if self._pcallback is None:
+            self._pcallback = ioloop.PeriodicCallback(
+                self.check, 1000 * self.resolution, self.loop
+            )
+            self._pcallback.start()
+
+    def stop(self):
+        """Stop checking, and close all the heartbeat sockets."""
+        if self._pcallback is not None:
+            self._pcallback.stop()
+            self._pcallback = None
+        for kernel_id in list(self._hearts):
+            self.remove_kernel(kernel_id)
+
+    def add_kernel(self, kernel_id, url):
+        """Start monitoring a kernel, by the url of its heartbeat socket."""
+        if kernel_id in self._hearts:
+            self.remove_kernel(kernel_id)
+        socket = self.context.socket(zmq.DEALER)
+        socket.linger = 0
+        socket.connect(url)
+        stream = ZMQStream(socket, self.loop)
+        stream.on_recv(lambda msg: self._on_pong(kernel_id, msg))
+        self._hearts[kernel_id] = _Heart(stream, self.min_interval)
+
+    def remove_kernel(self, kernel_id):
+        """Stop monitoring a kernel."""
+        heart = self._hearts.pop(kernel_id, None)
+        if heart is not None:
+            heart.stream.on_recv(None)
+            heart.stream.close()
+
+    def __contains__(self, kernel_id):
+        return kernel_id in self._hearts
+
+    def is_beating(self, kernel_id):
+        """Whether a kernel is answering its pings."""
+        return self._hearts[kernel_id].beating
+
+    def activity(self, kernel_id):
+        """Note that a kernel is in use, so it is watched closely again."""
+        heart = self._hearts.get(kernel_id)
+        if heart is not None and heart.interval > self.min_interval:
+            heart.interval = self.min_interval
+            heart.next_ping = min(heart.next_ping, time.time() + self.min_interval)
+
+    def add_callback(self, f, event='dead'):
+        """Register a callback for liveness changes.
+
+        The callback is called with the kernel_id.  Possible values for event:
+
+          'dead' (default): the kernel stopped answering pings.
+          'alive': a kernel has answered its first ping,
+                   or a kernel that was dead has answered a ping.
+        """
+        self.callbacks[event].append(f)
+
+    def remove_callback(self, f, event='dead'):
+        """Unregister a callback added with :meth:`add_callback`."""
+        try:
+            self.callbacks[event].remove(f)
+        except ValueError:
+            pass
+
+    def _fire_callbacks(self, event, kernel_id):
+        # callbacks may add or remove callbacks and kernels
+        for callback in list(self.callbacks[event]):
+            try:
+                callback(kernel_id)
+            except Exception:
+                self.log.error("HeartbeatMonitor: %s callback %r failed", event, callback, exc_info=True)
+
+    def _send_ping(self, kernel_id, heart, now):
+        heart.pings += 1
+        heart.ping = cast_bytes('%s-%i' % (kernel_id, heart.pings))
+        heart.ping_time = now
+        # the kernel's heartbeat is a REP socket, which expects an empty delimiter
+        heart.stream.send_multipart([b'', heart.ping])
+
+    def _on_pong(self, kernel_id, msg):
+        heart = self._hearts.get(kernel_id)
+        if heart is None or msg[-1] != heart.ping:
+            # a late reply to a ping that has already timed out
+            return
+        now = time.time()
+        heart.ping = None
+        heart.next_ping = now + heart.interval
+        heart.interval = min(2 * heart.interval, self.max_interval)
+        if not heart.beating:
+            heart.beating = True
+            heart.answered = True
+            self.log.info("HeartbeatMonitor: kernel %s is beating again", kernel_id)
+            self._fire_callbacks('alive', kernel_id)
+        elif not heart.answered:
+            heart.answered = True
+            self._fire_callbacks('alive', kernel_id)
+
+    def check(self):
+        """Send the pings that are due, and notice the ones that have timed out."""
+        now = time.time()
+        for kernel_id, heart in list(self._hearts.items()):
+            if heart.ping is not None:
+                if now - heart.ping_time < self.time_to_dead:
+                    continue
+                # no reply in time
+                heart.ping = None
+                heart.interval = self.min_interval
+                if heart.beating:
+                    heart.beating = False
+                    self.log.warn("HeartbeatMonitor: kernel %s missed a heartbeat", kernel_id)
+                    self._fire_callbacks('dead', kernel_id)
+                    if self._hearts.get(kernel_id) is not heart:
+                        # a callback removed or restarted the kernel
+                        continue
+                self._send_ping(kernel_id, heart, now)
+            elif now >= heart.next_ping:
+                self._send_ping(kernel_id, heart, now)
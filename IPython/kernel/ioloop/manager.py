@@ -17,7 +17,7 @@
 from zmq.eventloop.zmqstream import ZMQStream
 
 from IPython.utils.traitlets import (
-    Instance
+    Instance, Unicode
 )
 
 from IPython.kernel.manager import KernelManager
@@ -42,11 +42,17 @@ def _loop_default(self):
 
     _restarter = Instance('IPython.kernel.ioloop.IOLoopKernelRestarter')
 
+    # A HeartbeatMonitor shared with other kernels, which the restarter uses
+    # instead of a timer of its own, and this kernel's name in it.
+    heartbeat = Instance('IPython.kernel.ioloop.heartbeat.HeartbeatMonitor')
+    kernel_id = Unicode()
+
     def start_restarter(self):
         if self.autorestart and self.has_kernel:
             if self._restarter is None:
                 self._restarter = IOLoopKernelRestarter(
                     kernel_manager=self, loop=self.loop,
+                    heartbeat=self.heartbeat, kernel_id=self.kernel_id,
                     parent=self, log=self.log
                 )
             self._restarter.start()
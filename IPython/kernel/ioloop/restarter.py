@@ -1,7 +1,8 @@
 """A basic in process kernel monitor with autorestarting.
 
 This watches a kernel's state using KernelManager.is_alive and auto
-restarts the kernel if it dies.
+restarts the kernel if it dies.  It checks the kernel on a timer of its own,
+or, given a shared HeartbeatMonitor, whenever the kernel misses a heartbeat.
 """
 
 #-----------------------------------------------------------------------------
@@ -22,7 +23,7 @@
 
 from IPython.kernel.restarter import KernelRestarter
 from IPython.utils.traitlets import (
-    Instance,
+    Instance, Unicode,
 )
 
 #-----------------------------------------------------------------------------
@@ -36,11 +37,36 @@ class IOLoopKernelRestarter(KernelRestarter):
     def _loop_default(self):
         return ioloop.IOLoop.instance()
 
+    # A HeartbeatMonitor shared by many kernels.  If given, the kernel is
+    # polled when it misses a heartbeat, instead of every time_to_dead.
+    heartbeat = Instance('IPython.kernel.ioloop.heartbeat.HeartbeatMonitor')
+    # The kernel's name in the heartbeat monitor
+    kernel_id = Unicode()
+
     _pcallback = None
 
+    def _on_missed_beat(self, kernel_id):
+        if kernel_id == self.kernel_id:
+            self.poll()
+
+    def _on_alive(self, kernel_id):
+        # the first answer of a restarted kernel shows the restart succeeded,
+        # so that a later crash is counted afresh
+        if kernel_id == self.kernel_id and self._restarting:
+            self.poll()
+
     def start(self):
         """Start the polling of the kernel."""
-        if self._pcallback is None:
+        if self.heartbeat is not None:
+            # (re)starting adds the kernel afresh, so that a restarted kernel
+            # that never answers is noticed too
+            self.heartbeat.add_kernel(self.kernel_id, self.kernel_manager._make_url('hb'))
+            self.heartbeat.remove_callback(self._on_missed_beat)
+            self.heartbeat.add_callback(self._on_missed_beat)
+            self.heartbeat.remove_callback(self._on_alive, 'alive')
+            self.heartbeat.add_callback(self._on_alive, 'alive')
+            self.heartbeat.start()
+        elif self._pcallback is None:
             self._pcallback = ioloop.PeriodicCallback(
                 self.poll, 1000*self.time_to_dead, self.loop
             )
@@ -48,6 +74,10 @@ def start(self):
 
     def stop(self):
         """Stop the kernel polling."""
+        if self.heartbeat is not None:
+            self.heartbeat.remove_callback(self._on_missed_beat)
+            self.heartbeat.remove_callback(self._on_alive, 'alive')
+            self.heartbeat.remove_kernel(self.kernel_id)
         if self._pcallback is not None:
             self._pcallback.stop()
             self._pcallback = None
@@ -19,14 +19,17 @@
 from __future__ import absolute_import
 
 import os
+import time
 import uuid
+from collections import OrderedDict, deque
 
 import zmq
+from zmq.eventloop import ioloop
 
 from IPython.config.configurable import LoggingConfigurable
 from IPython.utils.importstring import import_item
 from IPython.utils.traitlets import (
-    Instance, Dict, Unicode, Any, DottedObjectName
+    Instance, Dict, Unicode, Any, DottedObjectName, Integer
 )
 from IPython.utils.py3compat import unicode_type
 
@@ -75,10 +78,39 @@ def _kernel_manager_factory_default(self):
     def _context_default(self):
         return zmq.Context.instance()
 
+    # the loop on which the pools are refilled, after start_kernel returns
+    loop = Instance('zmq.eventloop.ioloop.IOLoop', allow_none=False)
+    def _loop_default(self):
+        return ioloop.IOLoop.instance()
+
     connection_dir = Unicode('')
 
+    pool_size = Integer(0, config=True,
+        help="""The number of idle kernels to keep started, for each combination
+        of kernel arguments and working directory that has been requested.
+        start_kernel hands out one of these, if it can, instead of waiting
+        for a new kernel to start, and starts another to replace it.
+        0 disables the pool.
+        """
+    )
+    pool_max_keys = Integer(4, config=True,
+        help="""The number of combinations of kernel arguments and working directory
+        to keep pools for.  The pools of the least recently used are shut down.
+        """
+    )
+
     _kernels = Dict()
 
+    # pools of idle (kernel_id, KernelManager) pairs, by pool key,
+    # least recently used first
+    _pools = Instance(OrderedDict, ())
+    pool_hits = Integer(0)
+    pool_misses = Integer(0)
+    # when each kernel was handed out, until its first execution
+    _start_times = Dict()
+    # the times from handing out kernels to their first execution
+    _first_execute_times = Instance(deque, (), {'maxlen': 1000})
+
     def list_kernel_ids(self):
         """Return a list of the kernel ids of the active kernels."""
         # Create a copy so we can iterate over kernels in operations
@@ -92,31 +124,147 @@ def __len__(self):
     def __contains__(self, kernel_id):
         return kernel_id in self._kernels
 
+    def _launch_kernel(self, kernel_id, **kwargs):
+        """Start a kernel process, returning its KernelManager"""
+        # kernel_manager_factory is the constructor for the KernelManager
+        # subclass we are using. It can be configured as any Configurable,
+        # including things like its transport and ip.
+        km = self.kernel_manager_factory(connection_file=os.path.join(
+                    self.connection_dir, "kernel-%s.json" % kernel_id),
+                    parent=self, autorestart=True, log=self.log
+        )
+        km.start_kernel(**kwargs)
+        return km
+
     def start_kernel(self, **kwargs):
         """Start a new kernel.
 
         The caller can pick a kernel_id by passing one in as a keyword arg,
         otherwise one will be picked using a uuid.
 
+        If pool_size is set, and no kernel_id is given, an idle kernel
+        started with the same arguments may be handed out instead.
+        The pool is refilled from the loop, once this has returned.
+
         To silence the kernel's stdout/stderr, call this using::
 
             km.start_kernel(stdout=PIPE, stderr=PIPE)
 
         """
-        kernel_id = kwargs.pop('kernel_id', unicode_type(uuid.uuid4()))
+        kernel_id = kwargs.pop('kernel_id', None)
         if kernel_id in self:
             raise DuplicateKernelError('Kernel already exists: %s' % kernel_id)
-        # kernel_manager_factory is the constructor for the KernelManager
-        # subclass we are using. It can be configured as any Configurable,
-        # including things like its transport and ip.
-        km = self.kernel_manager_factory(connection_file=os.path.join(
-                    self.connection_dir, "kernel-%s.json" % kernel_id),
-                    parent=self, autorestart=True, log=self.log
-        )
-        km.start_kernel(**kwargs)
+        key = None
+        km = None
+        if kernel_id is None:
+            key = self._pool_key(kwargs)
+        if key is not None:
+            kernel_id, km = self._take_from_pool(key)
+        if km is None:
+            if kernel_id is None:
+                kernel_id = unicode_type(uuid.uuid4())
+            km = self._launch_kernel(kernel_id, **kwargs)
         self._kernels[kernel_id] = km
+        self._start_times[kernel_id] = time.time()
+        if key is not None:
+            self.loop.add_callback(self._fill_pool, key, kwargs)
         return kernel_id
 
+    #--------------------------------------------------------------------------
+    # Kernel pool
+    #--------------------------------------------------------------------------
+
+    def _pool_key(self, kwargs):
+        """The key of the pool for kernels started with kwargs.
+
+        None if such kernels can't be pooled, because they have arguments
+        other than extra_arguments and cwd, such as their own stdout.
+        """
+        if not self.pool_size or set(kwargs) - set(['extra_arguments', 'cwd']):
+            return None
+        return (tuple(kwargs.get('extra_arguments') or ()), kwargs.get('cwd'))
+
+    def _take_from_pool(self, key):
+        """Take an idle kernel from a pool, returning (kernel_id, km).
+
+        Returns (None, None) if the pool is empty.
+        """
+        pool = self._pools.pop(key, [])
+        # mark the pool as most recently used
+        self._pools[key] = pool
+        while pool:
+            kernel_id, km = pool.pop(0)
+            if km.is_alive():
+                self.pool_hits += 1
+                self.log.debug("Using pooled kernel %s", kernel_id)
+                return kernel_id, km
+            self.log.warn("Pooled kernel %s died, discarding it", kernel_id)
+            km.shutdown_kernel(now=True)
+        self.pool_misses += 1
+        return None, None
+
+    def _fill_pool(self, key, kwargs):
+        """Start kernels for a pool, until it has pool_size of them.
+
+        One kernel is launched per call, and the next call is scheduled
+        on the loop, so that requests are handled in between.
+        The kernels finish starting up in the background.
+        """
+        pool = self._pools.get(key)
+        if pool is None:
+            # the pool has been shut down since this was scheduled
+            return
+        if len(pool) < self.pool_size:
+            kernel_id = unicode_type(uuid.uuid4())
+            self.log.debug("Starting pooled kernel %s", kernel_id)
+            pool.append((kernel_id, self._launch_kernel(kernel_id, **kwargs)))
+            if len(pool) < self.pool_size:
+                self.loop.add_callback(self._fill_pool, key, kwargs)
+        while len(self._pools) > self.pool_max_keys:
+            old_key, old_pool = self._pools.popitem(last=False)
+            self._shutdown_pool(old_pool)
+
+    def _shutdown_pool(self, pool):
+        for kernel_id, km in pool:
+            self.log.debug("Shutting down pooled kernel %s", kernel_id)
+            km.shutdown_kernel(now=True)
+
+    def shutdown_pools(self):
+        """Shut down all of the idle kernels in the pools."""
+        pools = self._pools
+        self._pools = OrderedDict()
+        for pool in pools.values():
+            self._shutdown_pool(pool)
+
+    def record_first_execute(self, kernel_id):
+        """Record that a kernel has finished its first execution.
+
+        The time since it was handed out by start_kernel is
+        included in pool_stats.  Later calls for the same kernel are ignored.
+        """
+        start = self._start_times.pop(kernel_id, None)
+        if start is not None:
+            self._first_execute_times.append(time.time() - start)
+
+    def pool_stats(self):
+        """Statistics about the kernel pool.
+
+        Returns a dict with the number of pool hits and misses, the hit rate,
+        the number of idle kernels, and the mean and max time from handing out
+        a kernel to its first execution, in seconds, of the last 1000 kernels.
+        """
+        requests = self.pool_hits + self.pool_misses
+        times = list(self._first_execute_times)
+        return dict(
+            hits=self.pool_hits,
+            misses=self.pool_misses,
+            hit_rate=float(self.pool_hits) / requests if requests else 0.,
+            idle=sum(len(pool) for pool in self._pools.values()),
+            first_execute_count=len(times),
+            first_execute_mean=sum(times) / len(times) if times else 0.,
+            first_execute_max=max(times) if times else 0.,
+        )
+
     @kernel_method
     def shutdown_kernel(self, kernel_id, now=False):
         """Shutdown a kernel by its kernel uuid.
@@ -139,12 +287,14 @@ def remove_kernel(self, kernel_id):
 
         The kernel object is returned.
         """
+        self._start_times.pop(kernel_id, None)
         return self._kernels.pop(kernel_id)
 
     def shutdown_all(self, now=False):
-        """Shutdown all kernels."""
+        """Shutdown all kernels, including idle ones in the pools."""
         for kid in self.list_kernel_ids():
             self.shutdown_kernel(kid, now=now)
+        self.shutdown_pools()
 
     @kernel_method
     def interrupt_kernel(self, kernel_id):
@@ -0,0 +1,171 @@
+"""Tests for the shared heartbeat monitor"""
+
+#-------------------------------------------------------------------------------
+#  Copyright (C) 2014  The IPython Development Team
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------
+
+from unittest import TestCase
+
+from IPython.kernel.ioloop.heartbeat import HeartbeatMonitor, _Heart
+from IPython.kernel.ioloop.restarter import IOLoopKernelRestarter
+from IPython.kernel.manager import KernelManager
+
+#-------------------------------------------------------------------------------
+# Tests
+#-------------------------------------------------------------------------------
+
+class RecordingStream(object):
+    """Stands in for a ZMQStream, recording what is sent"""
+    def __init__(self):
+        self.sent = []
+
+    def send_multipart(self, msg_list):
+        self.sent.append(msg_list)
+
+    def on_recv(self, callback):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeKernelManager(KernelManager):
+    """A KernelManager without a kernel, which records restarts"""
+    alive = True
+    restarts = 0
+
+    def is_alive(self):
+        return self.alive
+
+    def restart_kernel(self, now=False, **kw):
+        self.restarts += 1
+
+
+class TestHeartbeatMonitor(TestCase):
+
+    def setUp(self):
+        self.monitor = HeartbeatMonitor(min_interval=1., max_interval=8., time_to_dead=3.)
+        self.events = []
+        self.monitor.add_callback(lambda kid: self.events.append(('dead', kid)), 'dead')
+        self.monitor.add_callback(lambda kid: self.events.append(('alive', kid)), 'alive')
+        self.streams = {}
+        for kid in ('a', 'b'):
+            self.streams[kid] = RecordingStream()
+            self.monitor._hearts[kid] = _Heart(self.streams[kid], self.monitor.min_interval)
+
+    def pong(self, kid):
+        self.monitor._on_pong(kid, self.streams[kid].sent[-1])
+
+    def test_ping_all(self):
+        self.monitor.check()
+        for kid, stream in self.streams.items():
+            self.assertEqual(len(stream.sent), 1)
+            self.assertEqual(stream.sent[0][0], b'')
+        # nothing more is sent while the pings are outstanding
+        self.monitor.check()
+        self.assertEqual(len(self.streams['a'].sent), 1)
+
+    def test_backoff(self):
+        heart = self.monitor._hearts['a']
+        for i in range(5):
+            self.monitor.check()
+            self.pong('a')
+            heart.next_ping = 0
+        self.assertEqual(heart.interval, 8.)
+        self.monitor.activity('a')
+        self.assertEqual(heart.interval, 1.)
+
+    def test_first_answer(self):
+        """a kernel is alive when it first answers, and not again after that"""
+        heart = self.monitor._hearts['a']
+        for i in range(3):
+            self.monitor.check()
+            self.pong('a')
+            heart.next_ping = 0
+        self.assertEqual(self.events, [('alive', 'a')])
+
+    def test_dead_and_alive(self):
+        self.monitor.check()
+        self.pong('b')
+        self.events = []
+        # a doesn't answer in time
+        self.monitor._hearts['a'].ping_time -= 10
+        self.monitor.check()
+        self.assertEqual(self.events, [('dead', 'a')])
+        self.assertFalse(self.monitor.is_beating('a'))
+        self.assertTrue(self.monitor.is_beating('b'))
+        # a is pinged again
+        self.assertEqual(len(self.streams['a'].sent), 2)
+        # a late reply to the first ping is ignored
+        self.monitor._on_pong('a', self.streams['a'].sent[0])
+        self.assertFalse(self.monitor.is_beating('a'))
+        self.pong('a')
+        self.assertEqual(self.events, [('dead', 'a'), ('alive', 'a')])
+        self.assertTrue(self.monitor.is_beating('a'))
+
+    def test_remove(self):
+        self.monitor.remove_kernel('a')
+        self.assertFalse('a' in self.monitor)
+        self.monitor.check()
+        self.assertEqual(len(self.streams['a'].sent), 0)
+
+    def test_callback_removes_kernel(self):
+        """a kernel removed by a dead callback isn't pinged again"""
+        self.monitor.add_callback(self.monitor.remove_kernel, 'dead')
+        self.monitor.check()
+        self.monitor._hearts['a'].ping_time -= 10
+        self.monitor.check()
+        self.assertFalse('a' in self.monitor)
+        self.assertEqual(len(self.streams['a'].sent), 1)
+
+
+class TestHeartbeatRestarter(TestCase):
+
+    def setUp(self):
+        self.monitor = HeartbeatMonitor()
+        self.km = FakeKernelManager()
+        self.restarter = IOLoopKernelRestarter(kernel_manager=self.km,
+            heartbeat=self.monitor, kernel_id='k', restart_limit=2)
+        self.restarter.start()
+
+    def tearDown(self):
+        self.monitor.stop()
+
+    def test_missed_beat_polls(self):
+        self.assertTrue('k' in self.monitor)
+        # a busy kernel misses a beat, but its process is alive
+        self.monitor._fire_callbacks('dead', 'k')
+        self.assertEqual(self.km.restarts, 0)
+        self.km.alive = False
+        self.monitor._fire_callbacks('dead', 'other')
+        self.assertEqual(self.km.restarts, 0)
+        self.monitor._fire_callbacks('dead', 'k')
+        self.assertEqual(self.km.restarts, 1)
+
+    def test_separate_crashes(self):
+        """crashes after a successful restart don't count towards restart_limit"""
+        dead = []
+        self.restarter.add_callback(lambda : dead.append(True), 'dead')
+        for i in range(3):
+            self.km.alive = False
+            self.monitor._fire_callbacks('dead', 'k')
+            self.assertEqual(self.km.restarts, i + 1)
+            # the restarted kernel is added afresh, and answers its first ping
+            self.km.alive = True
+            self.restarter.start()
+            self.monitor.check()
+            self.monitor._on_pong('k', [self.monitor._hearts['k'].ping])
+        self.assertEqual(dead, [])
+
+    def test_stop(self):
+        self.restarter.stop()
+        self.assertFalse('k' in self.monitor)
+        self.assertEqual(self.monitor.callbacks['dead'], [])
+        self.assertEqual(self.monitor.callbacks['alive'], [])
@@ -0,0 +1,110 @@
+"""Tests for the single-loop kernel client"""
+
+#-------------------------------------------------------------------------------
+#  Copyright (C) 2014  The IPython Development Team
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------
+
+from unittest import TestCase
+
+from IPython.kernel.ioloop import IOLoopKernelClient, HeartbeatMonitor
+from IPython.kernel.zmq.session import Session
+
+#-------------------------------------------------------------------------------
+# Tests
+#-------------------------------------------------------------------------------
+
+class RecordingStream(object):
+    """Stands in for a ZMQStream, recording what is sent"""
+    def __init__(self):
+        self.sent = []
+
+    def send_multipart(self, msg_list, flags=0, copy=True, track=False):
+        self.sent.append(msg_list)
+
+    def on_recv(self, callback):
+        pass
+
+    def close(self, linger=None):
+        pass
+
+
+class TestIOLoopKernelClient(TestCase):
+
+    def setUp(self):
+        self.session = Session(key=b'secret')
+        # the kernel's end of the connection
+        self.kernel_session = Session(key=b'secret')
+        self.kc = IOLoopKernelClient(session=self.session)
+        self.kc.shell_stream = RecordingStream()
+
+    def reply(self, msg_type, content, channel='shell'):
+        """Send a reply to the last request, as the kernel would"""
+        request_list = self.kc.shell_stream.sent[-1]
+        idents, request_list = self.kernel_session.feed_identities(request_list)
+        request = self.kernel_session.unserialize(request_list, verify=False)
+        reply = self.kernel_session.msg(msg_type, content, parent=request)
+        self.kc._handle_recv(channel, self.kernel_session.serialize(reply))
+        return request
+
+    def test_execute_future(self):
+        future = self.kc.execute('a = 1')
+        self.assertFalse(future.done())
+        request = self.reply('execute_reply', {'status': 'ok'})
+        self.assertEqual(request['msg_type'], 'execute_request')
+        self.assertEqual(request['content']['code'], 'a = 1')
+        self.assertEqual(future.msg_id, request['header']['msg_id'])
+        self.assertTrue(future.done())
+        self.assertEqual(future.result()['content'], {'status': 'ok'})
+
+    def test_handlers(self):
+        seen = []
+        self.kc.add_handler(seen.append, 'iopub')
+        future = self.kc.complete('a', 'a', 1)
+        self.reply('stream', {'name': 'stdout', 'data': 'hi'}, channel='iopub')
+        self.assertEqual([msg['msg_type'] for msg in seen], ['stream'])
+        # iopub messages don't resolve shell requests
+        self.assertFalse(future.done())
+        self.kc.remove_handler(seen.append, 'iopub')
+        self.reply('stream', {'name': 'stdout', 'data': 'hi'}, channel='iopub')
+        self.assertEqual(len(seen), 1)
+
+    def test_stop_fails_pending(self):
+        future = self.kc.object_info('a')
+        self.kc.stop_channels()
+        self.assertTrue(future.done())
+        self.assertRaises(RuntimeError, future.result)
+        self.assertFalse(self.kc.channels_running)
+
+    def test_is_alive(self):
+        # without a monitor, the client can't tell
+        self.assertRaises(RuntimeError, self.kc.is_alive)
+        monitor = HeartbeatMonitor()
+        self.kc.heartbeat = monitor
+        self.kc.hb_port = 5555
+        self.kc.start_channels(shell=False, iopub=False, stdin=False)
+        url = self.kc._make_url('hb')
+        self.assertTrue(url in monitor)
+        self.assertTrue(self.kc.is_alive())
+        monitor._hearts[url].beating = False
+        self.assertFalse(self.kc.is_alive())
+        self.kc.stop_channels()
+        self.assertFalse(url in monitor)
+
+    def test_shared_monitor(self):
+        """a kernel that is already watched is left in the monitor"""
+        monitor = HeartbeatMonitor()
+        monitor.add_kernel('k', 'tcp://127.0.0.1:5555')
+        self.kc.heartbeat = monitor
+        self.kc.kernel_id = 'k'
+        self.kc.start_channels(shell=False, iopub=False, stdin=False)
+        self.assertTrue(self.kc.is_alive())
+        self.kc.stop_channels()
+        self.assertTrue('k' in monitor)
+        monitor.stop()
@@ -4,6 +4,8 @@
 import time
 from unittest import TestCase
 
+from zmq.eventloop import ioloop
+
 from IPython.testing import decorators as dec
 
 from IPython.config.loader import Config
@@ -76,3 +78,134 @@ def test_ipc_cinfo(self):
         km = self._get_ipc_km()
         self._run_cinfo(km, 'ipc', 'test')
 
+
+
+class FakeKernelManager(object):
+    """A kernel manager that only records whether its kernel was started"""
+    def __init__(self, **kwargs):
+        self.started_with = None
+        self.alive = False
+
+    def start_kernel(self, **kwargs):
+        self.started_with = kwargs
+        self.alive = True
+
+    def shutdown_kernel(self, now=False, restart=False):
+        self.alive = False
+
+    def is_alive(self):
+        return self.alive
+
+    def cleanup(self, connection_file=True):
+        pass
+
+
+class TestKernelPool(TestCase):
+
+    def _get_pool_km(self, size=2):
+        km = MultiKernelManager(pool_size=size, loop=ioloop.IOLoop())
+        km.kernel_manager_factory = FakeKernelManager
+        return km
+
+    def fill_pools(self, km):
+        """Run the loop until the pools have been refilled"""
+        idle = None
+        while km.pool_stats()['idle'] != idle:
+            idle = km.pool_stats()['idle']
+            km.loop.add_callback(km.loop.stop)
+            km.loop.start()
+
+    def test_fill_later(self):
+        """start_kernel returns before the pool is refilled"""
+        km = self._get_pool_km()
+        km.start_kernel()
+        self.assertEqual(km.pool_stats()['idle'], 0)
+        self.fill_pools(km)
+        self.assertEqual(km.pool_stats()['idle'], 2)
+
+    def test_fill_after_shutdown(self):
+        """a refill scheduled before shutdown_all starts no kernels"""
+        km = self._get_pool_km()
+        km.start_kernel()
+        km.shutdown_all(now=True)
+        self.fill_pools(km)
+        self.assertEqual(km.pool_stats()['idle'], 0)
+
+    def test_no_pool(self):
+        km = self._get_pool_km(0)
+        km.start_kernel(extra_arguments=['--foo'])
+        self.assertEqual(km.pool_stats()['idle'], 0)
+        self.assertEqual(km.pool_misses, 0)
+
+    def test_pool_hit(self):
+        km = self._get_pool_km()
+        kid = km.start_kernel(extra_arguments=['--foo'], cwd='/a')
+        self.fill_pools(km)
+        self.assertEqual(km.pool_misses, 1)
+        self.assertEqual(km.pool_stats()['idle'], 2)
+        kid2 = km.start_kernel(extra_arguments=['--foo'], cwd='/a')
+        self.assertNotEqual(kid, kid2)
+        self.assertEqual(km.pool_hits, 1)
+        self.assertEqual(km.pool_stats()['idle'], 1)
+        self.fill_pools(km)
+        self.assertEqual(km.pool_stats()['idle'], 2)
+        k = km.get_kernel(kid2)
+        self.assertEqual(k.started_with, dict(extra_arguments=['--foo'], cwd='/a'))
+        self.assertEqual(len(km), 2)
+        # a different cwd gets its own pool
+        km.start_kernel(extra_arguments=['--foo'], cwd='/b')
+        self.fill_pools(km)
+        self.assertEqual(km.pool_misses, 2)
+        self.assertEqual(km.pool_stats()['idle'], 4)
+        self.assertAlmostEqual(km.pool_stats()['hit_rate'], 1./3)
+
+    def test_unpooled_arguments(self):
+        km = self._get_pool_km()
+        km.start_kernel(stdout=PIPE, stderr=PIPE)
+        km.start_kernel(kernel_id='abc')
+        self.fill_pools(km)
+        self.assertEqual(km.pool_stats()['idle'], 0)
+        self.assertEqual(km.pool_hits + km.pool_misses, 0)
+
+    def test_dead_pooled_kernel(self):
+        km = self._get_pool_km(1)
+        km.start_kernel()
+        self.fill_pools(km)
+        (pool,) = km._pools.values()
+        kid, k = pool[0]
+        k.alive = False
+        kid2 = km.start_kernel()
+        self.assertNotEqual(kid, kid2)
+        self.assertEqual(km.pool_misses, 2)
+
+    def test_lru_pools(self):
+        km = self._get_pool_km(1)
+        km.pool_max_keys = 2
+        km.start_kernel(cwd='/a')
+        self.fill_pools(km)
+        (kid, first), = km._pools[((), '/a')]
+        for cwd in ('/b', '/a', '/c'):
+            km.start_kernel(cwd=cwd)
+            self.fill_pools(km)
+        self.assertEqual(list(km._pools), [((), '/a'), ((), '/c')])
+        self.assertTrue(first.is_alive())
+        self.assertEqual(km.pool_stats()['idle'], 2)
+
+    def test_shutdown_all(self):
+        km = self._get_pool_km()
+        km.start_kernel()
+        self.fill_pools(km)
+        pooled = [k for kid, k in list(km._pools.values())[0]]
+        km.shutdown_all(now=True)
+        self.assertEqual(len(km), 0)
+        self.assertEqual(km.pool_stats()['idle'], 0)
+        self.assertFalse(any(k.is_alive() for k in pooled))
+
+    def test_first_execute(self):
+        km = self._get_pool_km()
+        kid = km.start_kernel()
+        km.record_first_execute(kid)
+        km.record_first_execute(kid)
+        stats = km.pool_stats()
+        self.assertEqual(stats['first_execute_count'], 1)
+        self.assertTrue(stats['first_execute_max'] >= 0)
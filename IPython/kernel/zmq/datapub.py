@@ -48,6 +48,8 @@ def publish_data(self, data):
         buffers = serialize_object(data,
             buffer_threshold=session.buffer_threshold,
             item_threshold=session.item_threshold,
+            container_depth=session.container_depth,
+            item_budget=session.item_budget,
         )
         content = json_clean(dict(keys=data.keys()))
         session.send(self.pub_socket, 'data_message', content=content,
@@ -7,6 +7,7 @@
 import threading
 import time
 import uuid
+from collections import OrderedDict
 from io import StringIO, UnsupportedOperation
 
 import zmq
@@ -35,6 +36,20 @@ class OutStream(object):
     # The time interval between automatic flushes, in seconds.
     _subprocess_flush_limit = 256
     flush_interval = 0.05
+    # Output is flushed as soon as this many characters are pending,
+    # without waiting for flush_interval.
+    max_message_size = 2**16
+    # The maximum number of automatic flushes per second, for each parent.
+    # Faster output is merged into fewer, larger messages. 0 means no limit.
+    max_message_rate = 50
+    # The most output to hold while flushes are being throttled, in characters.
+    # Further output is dropped, and replaced with a notice. 0 means no limit.
+    max_buffer_size = 2**20
+    # Whether subprocesses wait for each flush to leave the process.
+    # Waiting ensures that output written just before a subprocess exits
+    # is not lost, but makes busy subprocesses block on their own output.
+    # Without it, subprocesses send their output and move on.
+    subprocess_wait = True
     topic=None
 
     def __init__(self, session, pub_socket, name, pipe=True):
@@ -45,6 +60,8 @@ def __init__(self, session, pub_socket, name, pipe=True):
         self.topic = b'stream.' + py3compat.cast_bytes(name)
         self.parent_header = {}
         self._new_buffer()
+        self._dropped = 0
+        self._reset_rate()
         self._buffer_lock = threading.Lock()
         self._master_pid = os.getpid()
         self._master_thread = threading.current_thread().ident
@@ -72,8 +89,6 @@ def _setup_pipe_in(self):
             self._pipe_in.close()
             del self._pipe_in
             return
-        self._pipe_poller = zmq.Poller()
-        self._pipe_poller.register(self._pipe_in, zmq.POLLIN)
     
     def _setup_pipe_out(self):
         # must be new context after fork
@@ -105,26 +120,66 @@ def _check_mp_mode(self):
 
     def set_parent(self, parent):
         self.parent_header = extract_header(parent)
+        # each parent gets its own allowance of messages
+        self._reset_rate()
+
+    def _reset_rate(self):
+        self._allowance = self.max_message_rate
+        self._last_allowance = time.time()
+        self._throttled = False
+
+    def _can_flush(self):
+        """Whether an automatic flush is allowed now by max_message_rate
+
+        This is a token bucket, which allows bursts of up to
+        max_message_rate messages, refilling at max_message_rate per second.
+        """
+        if not self.max_message_rate:
+            return True
+        now = time.time()
+        self._allowance = min(self.max_message_rate,
+            self._allowance + (now - self._last_allowance) * self.max_message_rate)
+        self._last_allowance = now
+        return self._allowance >= 1
+
+    def _write_buffer(self, string):
+        """Add output to the buffer, dropping what doesn't fit while throttled"""
+        if self._throttled and self.max_buffer_size:
+            room = max(0, self.max_buffer_size - self._buffer.tell())
+            if len(string) > room:
+                self._dropped += len(string) - room
+                string = string[:room]
+        self._buffer.write(string)
 
     def close(self):
         self.pub_socket = None
 
     def _flush_from_subprocesses(self):
-        """flush possible pub data from subprocesses into my buffer"""
+        """flush possible pub data from subprocesses into my buffer
+        
+        Everything the subprocesses have sent is received in one pass.
+        The output of each subprocess is kept together, in the order
+        in which it was sent, so that the output of different
+        subprocesses is not interleaved within a flush.
+        """
         if not self._pipe_flag or not self._is_master_process():
             return
+        chunks = OrderedDict()
         for i in range(self._subprocess_flush_limit):
-            if self._pipe_poller.poll(0):
-                msg = self._pipe_in.recv_multipart()
-                if msg[0] != self._pipe_uuid:
-                    continue
-                else:
-                    self._buffer.write(msg[1].decode(self.encoding, 'replace'))
-                    # this always means a flush,
-                    # so reset our timer
-                    self._start = 0
-            else:
+            try:
+                msg = self._pipe_in.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
                 break
+            if len(msg) != 3 or msg[0] != self._pipe_uuid:
+                continue
+            pid = msg[1]
+            chunks.setdefault(pid, []).append(msg[2].decode(self.encoding, 'replace'))
+        for pid, strings in chunks.items():
+            self._write_buffer(u''.join(strings))
+        if chunks:
+            # this always means a flush,
+            # so reset our timer
+            self._start = 0
     
     def _schedule_flush(self):
         """schedule a flush in the main thread
@@ -154,8 +209,13 @@ def flush(self):
             
             self._flush_from_subprocesses()
             data = self._flush_buffer()
+            if self._dropped:
+                data += u'\n[Output throttled: %i characters dropped]\n' % self._dropped
+                self._dropped = 0
+            self._throttled = False
             
             if data:
+                self._allowance -= 1
                 content = {u'name':self.name, u'data':data}
                 msg = self.session.send(self.pub_socket, u'stream', content=content,
                                        parent=self.parent_header, ident=self.topic)
@@ -166,10 +226,19 @@ def flush(self):
         else:
             with self._pipe_out_lock:
                 string = self._flush_buffer()
-                tracker = self._pipe_out.send_multipart([
+                if not string:
+                    return
+                msg = [
                     self._pipe_uuid,
+                    py3compat.cast_bytes(str(self._pipe_pid)),
                     string.encode(self.encoding, 'replace'),
-                ], copy=False, track=True)
+                ]
+                if self.subprocess_wait:
+                    tracker = self._pipe_out.send_multipart(msg, copy=False, track=True)
+                else:
+                    self._pipe_out.send_multipart(msg)
+            if self.subprocess_wait:
+                # wait outside the lock, so other threads can keep writing
                 try:
                     tracker.wait(1)
                 except:
@@ -202,20 +271,27 @@ def write(self, string):
                 string = string.decode(self.encoding, 'replace')
             
             is_child = (self._check_mp_mode() == CHILD)
-            self._buffer.write(string)
             if is_child:
+                self._buffer.write(string)
                 # newlines imply flush in subprocesses
                 # mp.Pool cannot be trusted to flush promptly (or ever),
                 # and this helps.
                 if '\n' in string:
                     self.flush()
+            else:
+                self._write_buffer(string)
             # do we want to check subprocess flushes on write?
             # self._flush_from_subprocesses()
             current_time = time.time()
             if self._start < 0:
                 self._start = current_time
-            elif current_time - self._start > self.flush_interval:
-                self.flush()
+            elif current_time - self._start > self.flush_interval or \
+                    self._buffer.tell() >= self.max_message_size:
+                if is_child or self._can_flush():
+                    self.flush()
+                else:
+                    # keep merging output until the rate allows another message
+                    self._throttled = True
 
     def writelines(self, sequence):
         if self.pub_socket is None:
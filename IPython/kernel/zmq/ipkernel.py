@@ -133,6 +133,28 @@ def _ident_default(self):
     # set of aborted msg_ids
     aborted = Set()
 
+    # Coalescing of apply replies.
+    apply_batch_window = Float(0, config=True,
+        help="""The maximum time (in seconds) to hold apply_replies, so that
+        several of them can be sent in a single batch message.
+
+        Replies are only held while more requests are waiting to be handled,
+        so an idle engine always sends its replies right away.
+        A window of a few milliseconds greatly reduces the per-message overhead
+        of workloads with many small tasks.
+        0 disables batching.
+        """
+    )
+    apply_batch_bytes = Integer(1024*1024, config=True,
+        help="""The size (in bytes) of held apply_replies above which they are sent
+        immediately, regardless of apply_batch_window."""
+    )
+    # held apply_reply messages, keyed by (stream, ident)
+    _apply_replies = Dict()
+    _apply_replies_bytes = Integer(0)
+    _apply_replies_started = Float(0)
+    _apply_replies_timeout = Any(None)
+
 
     def __init__(self, **kwargs):
         super(Kernel, self).__init__(**kwargs)
@@ -179,6 +201,8 @@ def __init__(self, **kwargs):
 
     def dispatch_control(self, msg):
         """dispatch control requests"""
+        # send held replies before anything else (e.g. shutdown) happens
+        self.flush_apply_replies()
         idents,msg = self.session.feed_identities(msg, copy=False)
         try:
             msg = self.session.unserialize(msg, content=True, copy=False)
@@ -217,6 +241,9 @@ def dispatch_shell(self, stream, msg):
         header = msg['header']
         msg_id = header['msg_id']
         msg_type = msg['header']['msg_type']
+        if msg_type != 'apply_request':
+            # preserve the order of replies
+            self.flush_apply_replies()
         
         # Print some info about this message and leave a '--->' marker, so it's
         # easier to trace visually the message chain when debugging.  Each
@@ -616,6 +643,8 @@ def apply_request(self, stream, ident, parent):
             result_buf = serialize_object(result,
                 buffer_threshold=self.session.buffer_threshold,
                 item_threshold=self.session.item_threshold,
+                container_depth=self.session.container_depth,
+                item_budget=self.session.item_budget,
             )
         
         except:
@@ -648,11 +677,64 @@ def apply_request(self, stream, ident, parent):
         sys.stdout.flush()
         sys.stderr.flush()
         
-        reply_msg = self.session.send(stream, u'apply_reply', reply_content,
-                    parent=parent, ident=ident,buffers=result_buf, metadata=md)
+        self._send_apply_reply(stream, ident, reply_content, parent, result_buf, md)
 
         self._publish_status(u'idle', parent)
 
+    def _send_apply_reply(self, stream, ident, content, parent, buffers, md):
+        """Send an apply_reply, or hold it to be sent in a batch.
+
+        See apply_batch_window.
+        """
+        if self.apply_batch_window <= 0 or stream not in self.shell_streams:
+            return self.session.send(stream, u'apply_reply', content,
+                    parent=parent, ident=ident, buffers=buffers, metadata=md)
+
+        msg = self.session.msg(u'apply_reply', content, parent=parent, metadata=md)
+        msg['buffers'] = buffers
+        now = time.time()
+        if not self._apply_replies:
+            self._apply_replies_started = now
+            loop = ioloop.IOLoop.instance()
+            self._apply_replies_timeout = loop.add_timeout(
+                now + self.apply_batch_window, self.flush_apply_replies)
+        key = (stream, tuple(ident))
+        self._apply_replies.setdefault(key, []).append(msg)
+        for buf in buffers:
+            self._apply_replies_bytes += getattr(buf, 'nbytes', None) or len(buf)
+
+        if (self._apply_replies_bytes >= self.apply_batch_bytes
+            or now - self._apply_replies_started >= self.apply_batch_window
+            or not self._shell_requests_waiting()):
+            self.flush_apply_replies()
+
+    def _shell_requests_waiting(self):
+        """Whether there are requests waiting to be handled on the shell streams."""
+        for stream in self.shell_streams:
+            if stream.socket.getsockopt(zmq.EVENTS) & zmq.POLLIN:
+                return True
+        return False
+
+    def flush_apply_replies(self):
+        """Send any held apply_replies.
+
+        Replies to the same destination are sent as a single batch message.
+        """
+        if self._apply_replies_timeout is not None:
+            ioloop.IOLoop.instance().remove_timeout(self._apply_replies_timeout)
+            self._apply_replies_timeout = None
+        if not self._apply_replies:
+            return
+        replies = self._apply_replies
+        self._apply_replies = {}
+        self._apply_replies_bytes = 0
+        for (stream, ident), msgs in replies.items():
+            if len(msgs) == 1:
+                msg = msgs[0]
+                self.session.send(stream, msg, ident=list(ident), buffers=msg['buffers'])
+            else:
+                self.session.send_batch(stream, msgs, ident=list(ident))
+
     #---------------------------------------------------------------------------
     # Control messages
     #---------------------------------------------------------------------------
@@ -10,8 +10,11 @@
     cPickle = None
     import pickle
 
+from zmq import Frame
+
 # IPython imports
 from IPython.utils import py3compat
+from IPython.utils.py3compat import buffer_to_bytes
 from IPython.utils.data import flatten
 from IPython.utils.pickleutil import (
     can, uncan, can_sequence, uncan_sequence, CannedObject,
@@ -28,13 +31,42 @@
 # default values for the thresholds:
 MAX_ITEMS = 64
 MAX_BYTES = 1024
+# default total number of items introspected in nested containers
+MAX_ITEM_BUDGET = 4096
+
+class CannedContainer(object):
+    """A list, tuple, or dict whose items have been canned individually.
+
+    Used by serialize_object with container_depth > 0,
+    so that unserialize_object knows which containers to look into.
+    """
+    def __init__(self, obj, items, keys=None):
+        self.type = type(obj)
+        self.items = items
+        self.keys = keys
+
+def _nbytes(buf):
+    """the size of a buffer in bytes
+
+    The len of a memoryview is its number of items, not of bytes.
+    """
+    if isinstance(buf, memoryview):
+        if py3compat.PY3:
+            return buf.nbytes
+        # py2 memoryviews have no nbytes
+        size = buf.itemsize
+        for dim in buf.shape:
+            size *= dim
+        return size
+    # bytes, or a py2 buffer
+    return len(buf)
 
 def _extract_buffers(obj, threshold=MAX_BYTES):
     """extract buffers larger than a certain threshold"""
     buffers = []
     if isinstance(obj, CannedObject) and obj.buffers:
         for i,buf in enumerate(obj.buffers):
-            if len(buf) > threshold:
+            if _nbytes(buf) > threshold:
                 # buffer larger than threshold, prevent pickling
                 obj.buffers[i] = None
                 buffers.append(buf)
@@ -51,7 +83,59 @@ def _restore_buffers(obj, buffers):
             if buf is None:
                 obj.buffers[i] = buffers.pop(0)
 
-def serialize_object(obj, buffer_threshold=MAX_BYTES, item_threshold=MAX_ITEMS):
+def _can_nested(obj, depth, budget, threshold, buffers):
+    """can an object, looking into lists, tuples, and dicts down to `depth` levels.
+
+    The large buffers of the canned objects are extracted into `buffers`,
+    in depth-first order.  `budget` is a one-element list holding the number
+    of items that may still be introspected.  Containers beyond the depth
+    or budget are left to be pickled whole.
+    """
+    if depth > 0:
+        keys = values = None
+        if istype(obj, (list, tuple)):
+            values = obj
+        elif istype(obj, dict):
+            try:
+                # sorted, so that the order of the buffers is well defined
+                keys = sorted(obj)
+            except TypeError:
+                pass
+            else:
+                values = [ obj[key] for key in keys ]
+        if values is not None and len(values) <= budget[0]:
+            budget[0] -= len(values)
+            items = [ _can_nested(value, depth-1, budget, threshold, buffers)
+                      for value in values ]
+            return CannedContainer(obj, items, keys)
+    cobj = can(obj)
+    buffers.extend(_extract_buffers(cobj, threshold))
+    return cobj
+
+def _uncan_nested(cobj, buffers, g=None):
+    """inverse of _can_nested, restoring buffers in the same order"""
+    if isinstance(cobj, CannedContainer):
+        items = [ _uncan_nested(item, buffers, g) for item in cobj.items ]
+        if cobj.keys is not None:
+            return dict(zip(cobj.keys, items))
+        return cobj.type(items)
+    _restore_buffers(cobj, buffers)
+    return uncan(cobj, g)
+
+def _frame_buffer(buf):
+    """view a zmq Frame as a buffer, without copying it
+
+    This is a memoryview on py3, and an old-style buffer on py2,
+    where numpy.frombuffer doesn't accept memoryviews.
+    """
+    if isinstance(buf, Frame):
+        if py3compat.PY3:
+            return buf.buffer
+        return buffer(buf)
+    return buf
+
+def serialize_object(obj, buffer_threshold=MAX_BYTES, item_threshold=MAX_ITEMS,
+                     container_depth=0, item_budget=MAX_ITEM_BUDGET):
     """Serialize an object into a list of sendable buffers.
     
     Parameters
@@ -66,13 +150,24 @@ def serialize_object(obj, buffer_threshold=MAX_BYTES, item_threshold=MAX_ITEMS):
         The maximum number of items over which canning will iterate.
         Containers (lists, dicts) larger than this will be pickled without
         introspection.
+        Only used if container_depth is 0.
+    container_depth : int
+        If greater than 0, the depth to which nested lists, tuples, and dicts
+        are introspected, regardless of item_threshold, so that the buffers
+        of any objects inside them (e.g. numpy arrays) are sent separately.
+        If 0 (default), only the items of obj itself are canned.
+    item_budget : int
+        The total number of items to introspect with container_depth > 0.
+        Containers that would exceed it are pickled without introspection.
     
     Returns
     -------
     [bufs] : list of buffers representing the serialized object.
     """
     buffers = []
-    if istype(obj, sequence_types) and len(obj) < item_threshold:
+    if container_depth > 0:
+        cobj = _can_nested(obj, container_depth, [item_budget], buffer_threshold, buffers)
+    elif istype(obj, sequence_types) and len(obj) < item_threshold:
         cobj = can_sequence(obj)
         for c in cobj:
             buffers.extend(_extract_buffers(c, buffer_threshold))
@@ -96,6 +191,8 @@ def unserialize_object(buffers, g=None):
     ----------
     
     bufs : list of buffers/bytes
+        zmq Frames are viewed as buffers, so that arrays are
+        reconstructed without copying their data.
     
     g : globals to be used when uncanning
     
@@ -104,13 +201,12 @@ def unserialize_object(buffers, g=None):
     
     (newobj, bufs) : unpacked object, and the list of remaining unused buffers.
     """
-    bufs = list(buffers)
-    pobj = bufs.pop(0)
-    if not isinstance(pobj, bytes):
-        # a zmq message
-        pobj = bytes(pobj)
+    bufs = [ _frame_buffer(buf) for buf in buffers ]
+    pobj = buffer_to_bytes(bufs.pop(0))
     canned = pickle.loads(pobj)
-    if istype(canned, sequence_types) and len(canned) < MAX_ITEMS:
+    if isinstance(canned, CannedContainer):
+        newobj = _uncan_nested(canned, bufs, g)
+    elif istype(canned, sequence_types) and len(canned) < MAX_ITEMS:
         for c in canned:
             _restore_buffers(c, bufs)
         newobj = uncan_sequence(canned, g)
@@ -126,11 +222,13 @@ def unserialize_object(buffers, g=None):
     
     return newobj, bufs
 
-def pack_apply_message(f, args, kwargs, buffer_threshold=MAX_BYTES, item_threshold=MAX_ITEMS):
+def pack_apply_message(f, args, kwargs, buffer_threshold=MAX_BYTES, item_threshold=MAX_ITEMS,
+                       container_depth=0, item_budget=MAX_ITEM_BUDGET):
     """pack up a function, args, and kwargs to be sent over the wire
     
     Each element of args/kwargs will be canned for special treatment,
-    but inspection will not go any deeper than that.
+    but inspection will not go any deeper than that,
+    unless container_depth > 0 (see serialize_object).
     
     Any object whose data is larger than `threshold`  will not have their data copied
     (only numpy arrays and bytes/buffers support zero-copy)
@@ -142,10 +240,14 @@ def pack_apply_message(f, args, kwargs, buffer_threshold=MAX_BYTES, item_thresho
     With length at least two + len(args) + len(kwargs)
     """
     
-    arg_bufs = flatten(serialize_object(arg, buffer_threshold, item_threshold) for arg in args)
+    def _serialize(obj):
+        return serialize_object(obj, buffer_threshold, item_threshold,
+                                container_depth, item_budget)
+    
+    arg_bufs = flatten(_serialize(arg) for arg in args)
     
     kw_keys = sorted(kwargs.keys())
-    kwarg_bufs = flatten(serialize_object(kwargs[key], buffer_threshold, item_threshold) for key in kw_keys)
+    kwarg_bufs = flatten(_serialize(kwargs[key]) for key in kw_keys)
     
     info = dict(nargs=len(args), narg_bufs=len(arg_bufs), kw_keys=kw_keys)
     
@@ -29,9 +29,11 @@
 import logging
 import os
 import pprint
-import random
+import struct
 import uuid
-from datetime import datetime
+import zlib
+from collections import deque
+from datetime import datetime, timedelta
 
 try:
     import cPickle
@@ -48,6 +50,11 @@
     # limiting the surface of attack
     def compare_digest(a,b): return a == b
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 import zmq
 from zmq.utils import jsonapi
 from zmq.eventloop.ioloop import IOLoop
@@ -58,13 +65,13 @@ def compare_digest(a,b): return a == b
 from IPython.utils.importstring import import_item
 from IPython.utils.jsonutil import extract_dates, squash_dates, date_default
 from IPython.utils.py3compat import (str_to_bytes, str_to_unicode, unicode_type,
-                                     iteritems)
+                                     iteritems, cast_bytes, PY3)
 from IPython.utils.traitlets import (CBytes, Unicode, Bool, Any, Instance, Set,
                                         DottedObjectName, CUnicode, Dict, Integer,
-                                        TraitError,
+                                        Float, TraitError,
 )
 from IPython.utils.pickleutil import PICKLE_PROTOCOL
-from IPython.kernel.zmq.serialize import MAX_ITEMS, MAX_BYTES
+from IPython.kernel.zmq.serialize import MAX_ITEMS, MAX_BYTES, MAX_ITEM_BUDGET
 
 #-----------------------------------------------------------------------------
 # utility functions
@@ -95,6 +102,48 @@ def squash_unicode(obj):
 pickle_packer = lambda o: pickle.dumps(squash_dates(o), PICKLE_PROTOCOL)
 pickle_unpacker = pickle.loads
 
+# msgpack, with datetimes encoded natively as an extension type
+# of the seconds and microseconds since the epoch
+MSGPACK_DATETIME = 1
+_EPOCH = datetime(1970, 1, 1)
+
+def _msgpack_default(obj):
+    if isinstance(obj, datetime):
+        if obj.tzinfo is not None:
+            # as with json, aware datetimes are sent as ISO8601 strings
+            return obj.isoformat()
+        delta = obj - _EPOCH
+        return msgpack.ExtType(MSGPACK_DATETIME, struct.pack('!qI',
+            delta.days * 86400 + delta.seconds, delta.microseconds))
+    raise TypeError("%r is not msgpack serializable" % obj)
+
+def _msgpack_ext_hook(code, data):
+    if code == MSGPACK_DATETIME:
+        seconds, microseconds = struct.unpack('!qI', data)
+        return _EPOCH + timedelta(seconds=seconds, microseconds=microseconds)
+    return msgpack.ExtType(code, data)
+
+if msgpack is not None and msgpack.version >= (0, 5, 2):
+    _msgpack_unpack_kwargs = dict(raw=False)
+else:
+    _msgpack_unpack_kwargs = dict(encoding='utf-8')
+
+msgpack_packer = lambda o: msgpack.packb(o, default=_msgpack_default, use_bin_type=True)
+msgpack_unpacker = lambda s: msgpack.unpackb(s, ext_hook=_msgpack_ext_hook,
+                                             **_msgpack_unpack_kwargs)
+
+def _builtin_packers(name):
+    """The (pack, unpack) functions for a builtin packer name, or None"""
+    name = name.lower()
+    if name == 'json':
+        return json_packer, json_unpacker
+    elif name == 'pickle':
+        return pickle_packer, pickle_unpacker
+    elif name == 'msgpack':
+        if msgpack is None:
+            raise ImportError("The msgpack packer requires msgpack-python")
+        return msgpack_packer, msgpack_unpacker
+
 default_packer = json_packer
 default_unpacker = json_unpacker
 
@@ -102,6 +151,51 @@ def squash_unicode(obj):
 # singleton dummy tracker, which will always report as done
 DONE = zmq.MessageTracker()
 
+#-----------------------------------------------------------------------------
+# buffer compression
+#-----------------------------------------------------------------------------
+
+# the metadata key describing the compressed buffers of a message
+COMPRESSION_KEY = 'buffer_compression'
+# the number of bytes compressed to estimate the compression ratio of a buffer
+COMPRESSION_SAMPLE = 2**16
+
+# codec name : (compress, decompress), for the codecs that are importable
+compressors = {
+    'zlib' : (lambda data: zlib.compress(data, 1), zlib.decompress),
+}
+
+try:
+    import lz4.block
+except ImportError:
+    try:
+        import lz4
+    except ImportError:
+        pass
+    else:
+        # lz4 < 0.10
+        compressors['lz4'] = (lz4.compress, lz4.decompress)
+else:
+    compressors['lz4'] = (lz4.block.compress, lz4.block.decompress)
+
+try:
+    import blosc
+except ImportError:
+    pass
+else:
+    compressors['blosc'] = (lambda data: blosc.compress(data, typesize=8), blosc.decompress)
+
+def _byte_view(buf):
+    """A view of buf's bytes, which can be sliced by byte"""
+    if PY3:
+        view = memoryview(buf)
+        if view.ndim != 1 or view.itemsize != 1:
+            view = view.cast('B')
+        return view
+    else:
+        # str or buffer
+        return buf
+
 #-----------------------------------------------------------------------------
 # Mixin tools for apps that use Sessions
 #-----------------------------------------------------------------------------
@@ -266,16 +360,15 @@ class Session(Configurable):
 
     packer = DottedObjectName('json',config=True,
             help="""The name of the packer for serializing messages.
-            Should be one of 'json', 'pickle', or an import name
-            for a custom callable serializer.""")
+            Should be one of 'json', 'pickle', 'msgpack', or an import name
+            for a custom callable serializer.
+
+            The msgpack packer (which requires msgpack-python) is faster than json,
+            and sends datetimes natively.  All peers must use the same packer.""")
     def _packer_changed(self, name, old, new):
-        if new.lower() == 'json':
-            self.pack = json_packer
-            self.unpack = json_unpacker
-            self.unpacker = new
-        elif new.lower() == 'pickle':
-            self.pack = pickle_packer
-            self.unpack = pickle_unpacker
+        builtin = _builtin_packers(new)
+        if builtin is not None:
+            self.pack, self.unpack = builtin
             self.unpacker = new
         else:
             self.pack = import_item(str(new))
@@ -284,13 +377,9 @@ def _packer_changed(self, name, old, new):
         help="""The name of the unpacker for unserializing messages.
         Only used with custom functions for `packer`.""")
     def _unpacker_changed(self, name, old, new):
-        if new.lower() == 'json':
-            self.pack = json_packer
-            self.unpack = json_unpacker
-            self.packer = new
-        elif new.lower() == 'pickle':
-            self.pack = pickle_packer
-            self.unpack = pickle_unpacker
+        builtin = _builtin_packers(new)
+        if builtin is not None:
+            self.pack, self.unpack = builtin
             self.packer = new
         else:
             self.unpack = import_item(str(new))
@@ -304,6 +393,7 @@ def _session_default(self):
 
     def _session_changed(self, name, old, new):
         self.bsession = self.session.encode('ascii')
+        self._header_template = None
 
     # bsession is the session as bytes
     bsession = CBytes(b'')
@@ -311,6 +401,12 @@ def _session_changed(self, name, old, new):
     username = Unicode(str_to_unicode(os.environ.get('USER', 'username')),
         help="""Username for the Session. Default is your system username.""",
         config=True)
+    def _username_changed(self, name, old, new):
+        self._header_template = None
+
+    # the fields of msg_header that are constant for this session,
+    # built on first use
+    _header_template = None
 
     metadata = Dict({}, config=True,
         help="""Metadata dictionary, which serves as the default top-level metadata dict for each message.""")
@@ -347,9 +443,12 @@ def _digest_mod_default(self):
     digest_history_size = Integer(2**16, config=True,
         help="""The maximum number of digests to remember.
         
-        The digest history will be culled when it exceeds this value.
+        Once the history is full, the oldest digest is forgotten
+        as each new one is added.
         """
     )
+    # the digests in digest_history, oldest first
+    _digest_queue = Instance(deque, ())
 
     keyfile = Unicode('', config=True,
         help="""path to file containing execution key.""")
@@ -381,6 +480,45 @@ def _unpack_changed(self, name, old, new):
     item_threshold = Integer(MAX_ITEMS, config=True,
         help="""The maximum number of items for a container to be introspected for custom serialization.
         Containers larger than this are pickled outright.
+        Only used if container_depth is 0.
+        """
+    )
+    container_depth = Integer(0, config=True,
+        help="""The depth to which nested containers (lists, tuples, dicts) are introspected
+        for custom serialization, so that large buffers inside them,
+        such as those of numpy arrays, are sent without pickling.
+        0 (the default) only introspects the items of top-level containers,
+        with fewer than item_threshold items.
+        Peers must be at least as recent as this version of IPython to receive
+        objects serialized with container_depth > 0.
+        """
+    )
+    item_budget = Integer(MAX_ITEM_BUDGET, config=True,
+        help="""The total number of items to introspect in nested containers,
+        when container_depth > 0.
+        Containers beyond this budget are pickled outright.
+        """
+    )
+
+    # compression of buffers:
+    compression = Unicode('', config=True,
+        help="""The codec with which to compress large message buffers:
+        'zlib', or 'lz4' or 'blosc' if they are installed. '' disables compression.
+
+        Compressed buffers are described in the message metadata,
+        and decompressed by the receiving Session, which must have the codec.
+        This can speed up sending data over slow links, such as ssh tunnels.
+        """
+    )
+    def _compression_changed(self, name, old, new):
+        if new and new not in compressors:
+            raise TraitError("No such compression codec: %r (available: %s)" % (
+                new, ', '.join(sorted(compressors))))
+    compression_threshold = Integer(2**16, config=True,
+        help="Threshold (in bytes) beyond which buffers are compressed.")
+    compression_min_ratio = Float(1.25, config=True,
+        help="""The minimum compression ratio for a buffer to be sent compressed.
+        The ratio is estimated by compressing the first 64kB of the buffer.
         """
     )
 
@@ -424,6 +562,9 @@ def __init__(self, **kwargs):
         keyfile : filepath
             The file containing a key.  If this is set, `key` will be
             initialized to the contents of the file.
+        compression : str
+            The codec with which to compress large buffers ('zlib', 'lz4', 'blosc'),
+            or '' for no compression.
         """
         super(Session, self).__init__(**kwargs)
         self._check_packers()
@@ -474,6 +615,10 @@ def _check_packers(self):
                 msg.format(packer=self.packer, unpacker=self.unpacker, e=e, jsonmsg=jsonmsg)
             )
 
+        if pack is msgpack_packer and unpack is msgpack_unpacker:
+            # datetimes are handled natively
+            return
+
         # check datetime support
         msg = dict(t=datetime.now())
         try:
@@ -485,7 +630,15 @@ def _check_packers(self):
             self.unpack = lambda s: unpack(s)
 
     def msg_header(self, msg_type):
-        return msg_header(self.msg_id, msg_type, self.username, self.session)
+        # only the per-message fields are set,
+        # on a copy of the session's constant fields
+        if self._header_template is None:
+            self._header_template = dict(username=self.username, session=self.session)
+        header = self._header_template.copy()
+        header['msg_id'] = self.msg_id
+        header['msg_type'] = msg_type
+        header['date'] = datetime.now()
+        return header
 
     def msg(self, msg_type, content=None, parent=None, header=None, metadata=None):
         """Return the nested message dict.
@@ -509,18 +662,89 @@ def msg(self, msg_type, content=None, parent=None, header=None, metadata=None):
     def sign(self, msg_list):
         """Sign a message with HMAC digest. If no auth, return b''.
 
+        The parts are hashed one at a time, so they are never joined
+        into a single bytes object.
+
         Parameters
         ----------
         msg_list : list
             The [p_header,p_parent,p_content] part of the message list.
+            The parts may be bytes, buffers, or zmq Frames.
         """
         if self.auth is None:
             return b''
         h = self.auth.copy()
         for m in msg_list:
+            if isinstance(m, zmq.Frame):
+                # hash the frame's memory in place
+                m = m.buffer
             h.update(m)
         return str_to_bytes(h.hexdigest())
 
+    def compress_buffers(self, msg, buffers):
+        """Compress the large buffers of a message, if compression is enabled.
+
+        The codec and a signature of each compressed buffer are recorded
+        in msg['metadata'], so that the message signature covers
+        the compressed bytes.
+
+        Returns
+        -------
+        buffers : list
+            The buffers to send, compressed or not.
+        """
+        if not self.compression or not buffers or COMPRESSION_KEY in msg['metadata']:
+            # nothing to do, or already compressed, as in a relayed message
+            return buffers
+        compress = compressors[self.compression][0]
+        codecs = []
+        signatures = []
+        to_send = []
+        for buf in buffers:
+            codec = signature = None
+            view = _byte_view(buf)
+            if len(view) >= self.compression_threshold:
+                sample = view[:COMPRESSION_SAMPLE]
+                if len(sample) >= self.compression_min_ratio * len(compress(sample)):
+                    buf = compress(view)
+                    codec = self.compression
+                    signature = self.sign([buf]).decode('ascii')
+            to_send.append(buf)
+            codecs.append(codec)
+            signatures.append(signature)
+        if any(codecs):
+            msg['metadata'] = dict(msg['metadata'])
+            msg['metadata'][COMPRESSION_KEY] = dict(codecs=codecs, signatures=signatures)
+        return to_send
+
+    def decompress_buffers(self, buffers, info):
+        """Decompress buffers compressed by compress_buffers.
+
+        Parameters
+        ----------
+        buffers : list of bytes or Frames
+        info : dict
+            The compression info from the message metadata.
+        """
+        codecs = info['codecs']
+        if len(codecs) != len(buffers):
+            raise ValueError("Expected %i buffers, got %i" % (len(codecs), len(buffers)))
+        buffers = list(buffers)
+        for i, (codec, signature) in enumerate(zip(codecs, info['signatures'])):
+            if not codec:
+                continue
+            buf = buffers[i]
+            if isinstance(buf, zmq.Frame):
+                # zlib doesn't accept memoryviews on py2
+                buf = buf.buffer if PY3 else buffer(buf)
+            if self.auth is not None and not compare_digest(
+                    self.sign([buf]), cast_bytes(signature)):
+                raise ValueError("Invalid Signature for buffer %i" % i)
+            if codec not in compressors:
+                raise ValueError("Can't decompress buffer with %r, which is not installed" % codec)
+            buffers[i] = compressors[codec][1](buf)
+        return buffers
+
     def serialize(self, msg, ident=None):
         """Serialize the message components to bytes.
 
@@ -615,6 +839,7 @@ def send(self, stream, msg_or_type, content=None, parent=None, ident=None,
             The metadata describing the message
         buffers : list or None
             The already-serialized buffers to be appended to the message.
+            Large buffers are compressed if self.compression is set.
         track : bool
             Whether to track.  Only for use with Sockets, because ZMQStream
             objects cannot track messages.
@@ -641,6 +866,7 @@ def send(self, stream, msg_or_type, content=None, parent=None, ident=None,
             io.rprint(msg)
             return
         buffers = [] if buffers is None else buffers
+        buffers = self.compress_buffers(msg, buffers)
         to_send = self.serialize(msg, ident)
         to_send.extend(buffers)
         longest = max([ len(s) for s in to_send ])
@@ -663,6 +889,131 @@ def send(self, stream, msg_or_type, content=None, parent=None, ident=None,
 
         return msg
 
+    def serialize_batch(self, msgs, ident=None):
+        """Serialize several messages into a single 'batch' message.
+
+        Each message is serialized and signed on its own, so that it can
+        later be relayed by itself.  The resulting frames (and each message's
+        ``buffers``) are appended as the buffers of a 'batch' message, whose
+        content lists the msg_ids, signatures, and number of frames of its parts.
+        A receiver checks the batch, and then the signature of each part,
+        with split_batch.
+
+        Parameters
+        ----------
+        msgs : list of dicts
+            The messages, as returned by the self.msg method, with optional
+            'buffers' lists.
+        ident : bytes or list of bytes
+            The zmq.IDENTITY routing path of the batch.
+
+        Returns
+        -------
+        (batch, msg_list) : the batch message dict and its serialized list,
+            with the same format as the output of self.serialize, followed
+            by the frames of each message.
+        """
+        frames = []
+        content = dict(msg_ids=[], signatures=[], nframes=[])
+        for msg in msgs:
+            buffers = self.compress_buffers(msg, msg.get('buffers') or [])
+            parts = self.serialize(msg)[1:] # skip DELIM
+            parts.extend(buffers)
+            content['msg_ids'].append(msg['header']['msg_id'])
+            content['signatures'].append(parts[0].decode('ascii'))
+            content['nframes'].append(len(parts))
+            frames.extend(parts)
+        batch = self.msg('batch', content=content)
+        msg_list = self.serialize(batch, ident)
+        msg_list.extend(frames)
+        return batch, msg_list
+
+    def send_batch(self, stream, msgs, ident=None, track=False):
+        """Send several messages at once, as a single 'batch' message.
+
+        See serialize_batch for the message format.  Each message dict gets the
+        'tracker' of the batch.
+
+        Returns
+        -------
+        batch : dict
+            The constructed batch message.
+        """
+        if not isinstance(stream, zmq.Socket):
+            # ZMQStreams and dummy sockets do not support tracking.
+            track = False
+
+        if not os.getpid() == self.pid:
+            io.rprint("WARNING: attempted to send message from fork")
+            return
+        batch, to_send = self.serialize_batch(msgs, ident)
+        longest = max([ len(s) for s in to_send ])
+        copy = (longest < self.copy_threshold)
+
+        if track and not copy:
+            tracker = stream.send_multipart(to_send, copy=False, track=True)
+        else:
+            tracker = DONE
+            stream.send_multipart(to_send, copy=copy)
+
+        if self.debug:
+            pprint.pprint(batch)
+            pprint.pprint(to_send)
+
+        batch['tracker'] = tracker
+        for msg in msgs:
+            msg['tracker'] = tracker
+        return batch
+
+    def split_batch(self, batch, copy=True):
+        """Split an unserialized 'batch' message into the msg_lists of its parts.
+
+        Each msg_list has the form [HMAC,p_header,p_parent,p_metadata,p_content,
+        buffer1,buffer2,...], and can be relayed as-is, or unserialized with
+        ``verify=False``, since the signature of each part is checked here:
+        it must be the one listed in the (already verified) content of the batch,
+        and match the part's own frames.
+
+        Parameters
+        ----------
+        batch : dict
+            The batch message, as returned by self.unserialize.
+            Its content may still be packed.
+        copy : bool (True)
+            Whether the buffers of the batch are bytes (True), or Messages (False).
+        """
+        content = batch['content']
+        if isinstance(content, bytes):
+            content = self.unpack(content)
+        frames = batch['buffers']
+        msg_lists = []
+        start = 0
+        for signature, n in zip(content['signatures'], content['nframes']):
+            msg_list = frames[start:start+n]
+            start += n
+            if len(msg_list) < 5:
+                raise ValueError("Truncated batch message")
+            sig = msg_list[0] if copy else msg_list[0].bytes
+            if not compare_digest(sig, cast_bytes(signature)):
+                raise ValueError("Invalid Signature in batch: %r" % sig)
+            if self.auth is not None and not compare_digest(sig, self.sign(msg_list[1:5])):
+                raise ValueError("Invalid Signature for batch part: %r" % sig)
+            msg_lists.append(msg_list)
+        return msg_lists
+
+    def unserialize_batch(self, batch, content=True, copy=True):
+        """Split a 'batch' message, and unserialize each of its parts.
+
+        The parts are checked against the signatures in the batch content,
+        rather than being verified individually.
+
+        Returns
+        -------
+        msgs : list of message dicts, as returned by self.unserialize.
+        """
+        return [ self.unserialize(list(msg_list), content=content, copy=copy, verify=False)
+                for msg_list in self.split_batch(batch, copy=copy) ]
+
     def send_raw(self, stream, msg_list, flags=0, copy=True, ident=None):
         """Send a raw message via ident path.
 
@@ -686,7 +1037,8 @@ def send_raw(self, stream, msg_list, flags=0, copy=True, ident=None):
             to_send.extend(ident)
 
         to_send.append(DELIM)
-        to_send.append(self.sign(msg_list))
+        # the signature covers only the message parts, not the buffers
+        to_send.append(self.sign(msg_list[:4]))
         to_send.extend(msg_list)
         stream.send_multipart(to_send, flags, copy=copy)
 
@@ -768,24 +1120,49 @@ def _add_digest(self, signature):
             return
         
         self.digest_history.add(signature)
-        if len(self.digest_history) > self.digest_history_size:
-            # threshold reached, cull 10%
-            self._cull_digest_history()
+        self._digest_queue.append(signature)
+        self._cull_digest_history()
     
     def _cull_digest_history(self):
         """cull the digest history
         
-        Removes a randomly selected 10% of the digest history
+        Forgets the oldest digests, until the history fits in digest_history_size.
+        This is O(1) per digest added.
         """
-        current = len(self.digest_history)
-        n_to_cull = max(int(current // 10), current - self.digest_history_size)
-        if n_to_cull >= current:
-            self.digest_history = set()
-            return
-        to_cull = random.sample(self.digest_history, n_to_cull)
-        self.digest_history.difference_update(to_cull)
+        queue = self._digest_queue
+        while len(queue) > self.digest_history_size:
+            # digest_history may have been cleared, so discard, not remove
+            self.digest_history.discard(queue.popleft())
     
-    def unserialize(self, msg_list, content=True, copy=True):
+    def check_signature(self, msg_list):
+        """Check the signature of a msg_list, without unpacking it.
+
+        The signature is also recorded, to protect against replay attacks.
+        Does nothing if there is no key.
+
+        Parameters
+        ----------
+        msg_list : list of bytes
+            The list of message parts of the form [HMAC,p_header,p_parent,
+            p_metadata,p_content,buffer1,buffer2,...].
+
+        Raises
+        ------
+        ValueError if the message is unsigned, replayed, or the signature is invalid.
+        """
+        if self.auth is None:
+            return
+        signature = msg_list[0]
+        if not signature:
+            raise ValueError("Unsigned Message")
+        if signature in self.digest_history:
+            raise ValueError("Duplicate Signature: %r" % signature)
+        self._add_digest(signature)
+        check = self.sign(msg_list[1:5])
+        if not compare_digest(signature, check):
+            raise ValueError("Invalid Signature: %r" % signature)
+
+    def unserialize(self, msg_list, content=True, copy=True, verify=True):
         """Unserialize a msg_list to a nested message dict.
 
         This is roughly the inverse of serialize. The serialize/unserialize
@@ -799,10 +1176,14 @@ def unserialize(self, msg_list, content=True, copy=True):
             p_metadata,p_content,buffer1,buffer2,...].
         content : bool (True)
             Whether to unpack the content dict (True), or leave it packed
-            (False).
+            (False).  Compressed buffers are only decompressed with content=True,
+            so that messages can be relayed without decompressing them.
         copy : bool (True)
             Whether to return the bytes (True), or the non-copying Message
             object in each place (False).
+        verify : bool (True)
+            Whether to check the signature.  Only skip this for messages that
+            have already been authenticated, such as the parts of a batch.
 
         Returns
         -------
@@ -815,16 +1196,8 @@ def unserialize(self, msg_list, content=True, copy=True):
         if not copy:
             for i in range(minlen):
                 msg_list[i] = msg_list[i].bytes
-        if self.auth is not None:
-            signature = msg_list[0]
-            if not signature:
-                raise ValueError("Unsigned Message")
-            if signature in self.digest_history:
-                raise ValueError("Duplicate Signature: %r" % signature)
-            self._add_digest(signature)
-            check = self.sign(msg_list[1:5])
-            if not compare_digest(signature, check):
-                raise ValueError("Invalid Signature: %r" % signature)
+        if verify:
+            self.check_signature(msg_list)
         if not len(msg_list) >= minlen:
             raise TypeError("malformed message, must have at least %i elements"%minlen)
         header = self.unpack(msg_list[1])
@@ -839,6 +1212,9 @@ def unserialize(self, msg_list, content=True, copy=True):
             message['content'] = msg_list[4]
 
         message['buffers'] = msg_list[5:]
+        if content and COMPRESSION_KEY in message['metadata']:
+            compression = message['metadata'].pop(COMPRESSION_KEY)
+            message['buffers'] = self.decompress_buffers(message['buffers'], compression)
         return message
 
 def test_msg2obj():
@@ -0,0 +1,123 @@
+"""test the rate limiting of OutStream"""
+
+# Copyright (c) IPython Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+#-------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------
+
+from unittest import TestCase
+
+import zmq
+
+from IPython.kernel.zmq.iostream import OutStream
+from IPython.kernel.zmq.session import Session
+
+#-------------------------------------------------------------------------------
+# Utilities
+#-------------------------------------------------------------------------------
+
+class RecordingSocket(object):
+    """A socket that records the messages sent on it"""
+    def __init__(self):
+        self.sent = []
+
+    def send_multipart(self, msg_list, flags=0, copy=True, track=False):
+        self.sent.append(msg_list)
+
+
+class QueueSocket(object):
+    """A socket from which queued messages are received"""
+    def __init__(self, msgs):
+        self.msgs = list(msgs)
+
+    def recv_multipart(self, flags=0, copy=True, track=False):
+        if not self.msgs:
+            raise zmq.Again()
+        return self.msgs.pop(0)
+
+#-------------------------------------------------------------------------------
+# Tests
+#-------------------------------------------------------------------------------
+
+class TestOutStream(TestCase):
+
+    def setUp(self):
+        self.session = Session()
+        self.socket = RecordingSocket()
+        self.stream = OutStream(self.session, self.socket, u'stdout', pipe=False)
+        # flush on every write, unless the rate is limited
+        self.stream.flush_interval = 0
+
+    def published(self):
+        """the data of the stream messages sent so far"""
+        data = []
+        for msg_list in self.socket.sent:
+            idents, msg_list = self.session.feed_identities(msg_list)
+            msg = self.session.unserialize(msg_list)
+            self.assertEqual(msg['msg_type'], 'stream')
+            data.append(msg['content']['data'])
+        return data
+
+    def test_unlimited(self):
+        self.stream.max_message_rate = 0
+        for i in range(10):
+            self.stream.write(u'%i\n' % i)
+        self.stream.flush()
+        # the first write after each flush only starts the timer
+        self.assertEqual(len(self.published()), 5)
+
+    def test_coalesce(self):
+        self.stream.max_message_rate = 2
+        self.stream.set_parent({})
+        expected = u''.join(u'%i\n' % i for i in range(100))
+        for i in range(100):
+            self.stream.write(u'%i\n' % i)
+        self.stream.flush()
+        data = self.published()
+        # two automatic flushes, and the explicit one
+        self.assertEqual(len(data), 3)
+        self.assertEqual(u''.join(data), expected)
+
+    def test_new_parent_resets_rate(self):
+        self.stream.max_message_rate = 1
+        self.stream.set_parent({})
+        for i in range(3):
+            self.stream.write(u'x')
+        self.assertEqual(len(self.socket.sent), 1)
+        self.stream.set_parent({})
+        self.stream.write(u'y')
+        self.assertEqual(len(self.socket.sent), 2)
+
+    def test_throttled_notice(self):
+        self.stream.max_message_rate = 1
+        self.stream.max_buffer_size = 100
+        self.stream.set_parent({})
+        self.stream.write(u'first')
+        self.stream.write(u'x')
+        # the second write is throttled, and fills the buffer past its limit,
+        # so the rest are dropped
+        for i in range(10):
+            self.stream.write(u'y' * 100)
+        self.stream.flush()
+        data = self.published()
+        self.assertEqual(len(data), 2)
+        self.assertEqual(data[0], u'firstx')
+        self.assertTrue(data[1].startswith(u'y' * 200 + u'\n'))
+        self.assertIn(u'Output throttled: 800 characters dropped', data[1])
+
+    def test_subprocess_output_grouped(self):
+        stream = self.stream
+        uid = b'uuid'
+        stream._pipe_flag = True
+        stream._pipe_uuid = uid
+        stream._pipe_in = QueueSocket([
+            [uid, b'10', b'a1'],
+            [uid, b'20', b'b1'],
+            [b'wrong', b'10', b'bad'],
+            [uid, b'10', b'a2'],
+            [uid, b'20', b'b2'],
+        ])
+        stream.flush()
+        self.assertEqual(self.published(), [u'a1a2b1b2'])
@@ -15,14 +15,19 @@
 from collections import namedtuple
 
 import nose.tools as nt
+import zmq
 
 # from unittest import TestCaes
-from IPython.kernel.zmq.serialize import serialize_object, unserialize_object
+from IPython.kernel.zmq.serialize import serialize_object, unserialize_object, _frame_buffer
 from IPython.testing import decorators as dec
 from IPython.utils.pickleutil import CannedArray, CannedClass
-from IPython.utils.py3compat import iteritems
+from IPython.utils import py3compat
+from IPython.utils.py3compat import iteritems, buffer_to_bytes
 from IPython.parallel import interactive
 
+if py3compat.PY3:
+    buffer = memoryview
+
 #-------------------------------------------------------------------------------
 # Globals and Utilities
 #-------------------------------------------------------------------------------
@@ -227,3 +232,80 @@ class D(C):
     D2 = d['D']
     nt.assert_equal(D2.a, D.a)
     nt.assert_equal(D2.b, D.b)
+
+@dec.skip_without('numpy')
+def test_numpy_frames_zero_copy():
+    """arrays unserialized from zmq Frames share memory with them"""
+    import numpy
+    from numpy.testing.utils import assert_array_equal
+    A = numpy.arange(1024, dtype='float64').reshape(32, 32)
+    frames = [ zmq.Frame(buf) for buf in serialize_object(A) ]
+    B, r = unserialize_object(frames)
+    nt.assert_equal(r, [])
+    assert_array_equal(A, B)
+    nt.assert_equal(B.__array_interface__['data'][0],
+        numpy.frombuffer(_frame_buffer(frames[1]), dtype='uint8').__array_interface__['data'][0])
+
+def test_bytes_frames():
+    """bytes and buffers are reconstructed from zmq Frames"""
+    data = b'x' * 2048
+    frames = [ zmq.Frame(buf) for buf in serialize_object([data, buffer(data)]) ]
+    (b, m), r = unserialize_object(frames)
+    nt.assert_equal(r, [])
+    nt.assert_is_instance(b, bytes)
+    nt.assert_equal(b, data)
+    nt.assert_equal(bytes(m), data)
+
+def test_nested_buffers():
+    """container_depth extracts buffers from nested containers"""
+    x = b'x' * 2048
+    obj = dict(a=[x, (x + b'y', 1)], b={'c' : [x + b'z']}, d=5)
+    bufs = serialize_object(obj)
+    nt.assert_equal(len(bufs), 1)
+    bufs = serialize_object(obj, container_depth=3)
+    nt.assert_equal(len(bufs), 4)
+    obj2, r = unserialize_object(bufs)
+    nt.assert_equal(r, [])
+    nt.assert_equal(obj2, obj)
+    nt.assert_is_instance(obj2['a'][1], tuple)
+    # deep enough for a[0], but not a[1][0] or b['c'][0]
+    bufs = serialize_object(obj, container_depth=2)
+    nt.assert_equal(len(bufs), 2)
+    nt.assert_equal(unserialize_object(bufs)[0], obj)
+
+def test_nested_budget():
+    """containers beyond item_budget are pickled whole"""
+    x = b'x' * 2048
+    obj = [[x, x], [x, x, x]]
+    bufs = serialize_object(obj, container_depth=2, item_budget=4)
+    # the top level and the first list fit in the budget
+    nt.assert_equal(len(bufs), 3)
+    obj2, r = unserialize_object(bufs)
+    nt.assert_equal(r, [])
+    nt.assert_equal(obj2, obj)
+
+def test_nested_buffers_nbytes():
+    """buffers in nested containers are extracted by their size in bytes,
+    not by their number of items"""
+    from array import array
+    # 256 items, 2048 bytes
+    A = buffer(array('d', range(256)))
+    bufs = serialize_object(dict(arrays=[A, A]), container_depth=2)
+    nt.assert_equal(len(bufs), 3)
+    d2, r = unserialize_object(bufs)
+    nt.assert_equal(r, [])
+    for B in d2['arrays']:
+        nt.assert_equal(buffer_to_bytes(B), buffer_to_bytes(A))
+
+@dec.skip_without('numpy')
+def test_numpy_in_large_dict():
+    """arrays in containers larger than item_threshold are sent separately"""
+    import numpy
+    from numpy.testing.utils import assert_array_equal
+    d = dict(('a%i' % i, numpy.random.random(256)) for i in range(500))
+    bufs = serialize_object(dict(arrays=d), container_depth=2)
+    nt.assert_equal(len(bufs), 501)
+    d2, r = unserialize_object(bufs)
+    nt.assert_equal(r, [])
+    for key, A in iteritems(d):
+        assert_array_equal(A, d2['arrays'][key])
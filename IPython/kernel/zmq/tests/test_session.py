@@ -25,6 +25,7 @@
 from IPython.testing.decorators import skipif, module_not_available
 from IPython.utils.py3compat import string_types
 from IPython.utils import jsonutil
+from IPython.utils.traitlets import TraitError
 
 def _bad_packer(obj):
     raise TypeError("I don't work")
@@ -206,16 +207,44 @@ def test_zero_digest_history(self):
 
     def test_cull_digest_history(self):
         session = ss.Session(digest_history_size=100)
-        for i in range(100):
-            session._add_digest(uuid.uuid4().bytes)
-        self.assertTrue(len(session.digest_history) == 100)
-        session._add_digest(uuid.uuid4().bytes)
-        self.assertTrue(len(session.digest_history) == 91)
-        for i in range(9):
+        digests = [uuid.uuid4().bytes for i in range(110)]
+        for digest in digests[:100]:
+            session._add_digest(digest)
+        self.assertEqual(len(session.digest_history), 100)
+        for digest in digests[100:]:
+            session._add_digest(digest)
+        # the oldest digests are forgotten first
+        self.assertEqual(len(session.digest_history), 100)
+        self.assertEqual(session.digest_history, set(digests[10:]))
+    
+    def test_cleared_digest_history(self):
+        session = ss.Session(digest_history_size=10)
+        for i in range(10):
             session._add_digest(uuid.uuid4().bytes)
-        self.assertTrue(len(session.digest_history) == 100)
-        session._add_digest(uuid.uuid4().bytes)
-        self.assertTrue(len(session.digest_history) == 91)
+        session.digest_history.clear()
+        digests = [uuid.uuid4().bytes for i in range(10)]
+        for digest in digests:
+            session._add_digest(digest)
+        self.assertEqual(session.digest_history, set(digests))
+    
+    def test_check_signature(self):
+        session = ss.Session(key=b'secret')
+        msg_list = session.feed_identities(session.serialize(session.msg('msg')))[1]
+        session.check_signature(msg_list)
+        with self.assertRaises(ValueError):
+            # replayed
+            session.check_signature(msg_list)
+        msg_list = session.feed_identities(session.serialize(session.msg('msg')))[1]
+        msg_list[4] = b'{"tampered": true}'
+        with self.assertRaises(ValueError):
+            session.check_signature(msg_list)
+    
+    def test_sign_frames(self):
+        session = ss.Session(key=b'secret')
+        parts = [b'header', b'parent', b'metadata', b'content']
+        frames = [zmq.Frame(part) for part in parts]
+        self.assertEqual(session.sign(frames), session.sign(parts))
+        self.assertEqual(session.sign([memoryview(p) for p in parts]), session.sign(parts))
     
     def test_bad_pack(self):
         try:
@@ -292,6 +321,32 @@ def test_datetimes_msgpack(self):
         )
         self._datetime_test(session)
     
+    @skipif(module_not_available('msgpack'))
+    def test_msgpack_packer(self):
+        session = ss.Session(packer='msgpack')
+        self.assertEqual(session.unpacker, 'msgpack')
+        content = dict(t=datetime.now(), b=b'bytes', u=u'unicode', l=[1, 2.5, None])
+        msg = session.msg('msg', content=content)
+        msg2 = session.unserialize(session.feed_identities(session.serialize(msg))[1])
+        self.assertEqual(msg['header'], msg2['header'])
+        # datetimes survive the round trip without extract_dates
+        self.assertEqual(msg2['content'], content)
+    
+    def test_header_template(self):
+        session = ss.Session(session=u'first', username=u'alice')
+        header = session.msg_header('msg')
+        self.assertEqual(header['session'], u'first')
+        self.assertEqual(header['username'], u'alice')
+        session.session = u'second'
+        session.username = u'bob'
+        header2 = session.msg_header('msg')
+        self.assertEqual(header2['session'], u'second')
+        self.assertEqual(header2['username'], u'bob')
+        self.assertNotEqual(header['msg_id'], header2['msg_id'])
+        # headers don't share state
+        header2['extra'] = 5
+        self.assertNotIn('extra', session.msg_header('msg'))
+    
     def test_send_raw(self):
         ctx = zmq.Context.instance()
         A = ctx.socket(zmq.PAIR)
@@ -316,3 +371,117 @@ def test_send_raw(self):
         A.close()
         B.close()
         ctx.term()
+
+    def test_serialize_batch(self):
+        msgs = []
+        for i in range(3):
+            msg = self.session.msg('apply_request', content=dict(a=i))
+            msg['buffers'] = [b'buf%i' % i] * i
+            msgs.append(msg)
+        batch, msg_list = self.session.serialize_batch(msgs, ident=b'foo')
+        ident, msg_list = self.session.feed_identities(msg_list)
+        self.assertEqual(ident[0], b'foo')
+        new_batch = self.session.unserialize(msg_list)
+        self.assertEqual(new_batch['msg_type'], 'batch')
+        self.assertEqual(new_batch['content']['msg_ids'],
+            [ msg['msg_id'] for msg in msgs ])
+        parts = self.session.split_batch(new_batch)
+        self.assertEqual(len(parts), 3)
+        for msg, part in zip(msgs, parts):
+            # each part is a valid message on its own
+            new_msg = self.session.unserialize(part)
+            self.assertEqual(new_msg['header'], msg['header'])
+            self.assertEqual(new_msg['content'], msg['content'])
+            self.assertEqual(new_msg['buffers'], msg['buffers'])
+
+    def test_split_batch_bad_signature(self):
+        # parts are only signed with a key
+        session = ss.Session(key=b'secret')
+        msgs = [ session.msg('apply_request') for i in range(2) ]
+        batch, msg_list = session.serialize_batch(msgs)
+        ident, msg_list = session.feed_identities(msg_list)
+        batch = session.unserialize(msg_list)
+        # swap the two parts
+        n = batch['content']['nframes'][0]
+        batch['buffers'] = batch['buffers'][n:] + batch['buffers'][:n]
+        self.assertRaises(ValueError, session.split_batch, batch)
+
+    def test_split_batch_tampered_part(self):
+        """a part whose frames were changed after signing is rejected"""
+        session = ss.Session(key=b'secret')
+        msgs = [ session.msg('apply_request', content=dict(a=i)) for i in range(2) ]
+        batch, msg_list = session.serialize_batch(msgs)
+        ident, msg_list = session.feed_identities(msg_list)
+        batch = session.unserialize(msg_list)
+        n = batch['content']['nframes'][0]
+        # the content frame of the second part, keeping its signature frame
+        tampered = dict(batch, buffers=list(batch['buffers']))
+        tampered['buffers'][n + 4] = session.pack(dict(a=666))
+        self.assertRaises(ValueError, session.split_batch, tampered)
+        # the untouched batch still splits
+        self.assertEqual(len(session.split_batch(batch)), 2)
+
+    def test_unserialize_batch(self):
+        msgs = [ self.session.msg('apply_reply', content=dict(a=i)) for i in range(3) ]
+        for msg in msgs:
+            msg['buffers'] = [b'result']
+        batch, msg_list = self.session.serialize_batch(msgs)
+        ident, msg_list = self.session.feed_identities(msg_list)
+        batch = self.session.unserialize(msg_list)
+        new_msgs = self.session.unserialize_batch(batch)
+        self.assertEqual([ m['content'] for m in new_msgs ], [ m['content'] for m in msgs ])
+        self.assertEqual([ m['buffers'] for m in new_msgs ], [ [b'result'] ] * 3)
+
+    def _compressed_roundtrip(self, session, buffers):
+        msg = session.msg('apply_request', content=dict(a=5))
+        to_send = session.compress_buffers(msg, buffers)
+        msg_list = session.serialize(msg) + to_send
+        ident, msg_list = session.feed_identities(msg_list)
+        return to_send, msg_list
+
+    def test_compression(self):
+        session = ss.Session(key=b'secret', compression='zlib')
+        data = b'x' * 2**17
+        small = b'y' * 100
+        sent, msg_list = self._compressed_roundtrip(session, [data, small])
+        self.assertTrue(len(sent[0]) < len(data))
+        self.assertEqual(sent[1], small)
+        new_msg = session.unserialize(msg_list)
+        self.assertEqual(new_msg['buffers'], [data, small])
+        self.assertFalse(ss.COMPRESSION_KEY in new_msg['metadata'])
+
+    def test_compression_frames(self):
+        """compressed buffers are decompressed from zmq Frames"""
+        session = ss.Session(key=b'secret', compression='zlib')
+        data = b'x' * 2**17
+        sent, msg_list = self._compressed_roundtrip(session, [data])
+        frames = [ zmq.Frame(m) for m in msg_list ]
+        new_msg = session.unserialize(frames, copy=False)
+        self.assertEqual(new_msg['buffers'], [data])
+
+    def test_compression_relay(self):
+        """content=False leaves buffers compressed, for relaying"""
+        session = ss.Session(key=b'secret', compression='zlib')
+        data = b'x' * 2**17
+        sent, msg_list = self._compressed_roundtrip(session, [data])
+        new_msg = session.unserialize(msg_list, content=False)
+        self.assertEqual(new_msg['buffers'], sent)
+        self.assertTrue(ss.COMPRESSION_KEY in new_msg['metadata'])
+
+    def test_compression_ratio(self):
+        """incompressible buffers are sent as-is"""
+        session = ss.Session(compression='zlib')
+        data = os.urandom(2**17)
+        sent, msg_list = self._compressed_roundtrip(session, [data])
+        self.assertEqual(sent, [data])
+
+    def test_compression_bad_signature(self):
+        """compressed buffers are covered by the message signature"""
+        import zlib
+        session = ss.Session(key=b'secret', compression='zlib')
+        sent, msg_list = self._compressed_roundtrip(session, [b'x' * 2**17])
+        msg_list[5] = zlib.compress(b'z' * 2**17)
+        self.assertRaises(ValueError, session.unserialize, msg_list)
+
+    def test_bad_compression(self):
+        self.assertRaises(TraitError, ss.Session, compression='not-a-codec')
@@ -54,7 +54,9 @@
 from IPython.parallel.controller.heartmonitor import HeartMonitor
 from IPython.parallel.controller.hub import HubFactory
 from IPython.parallel.controller.scheduler import TaskScheduler,launch_scheduler
+from IPython.parallel.controller.broadcast import launch_broadcast_scheduler
 from IPython.parallel.controller.dictdb import DictDB
+from IPython.parallel.controller.blobstore import BlobStore
 
 from IPython.parallel.util import split_url, disambiguate_url, set_hwm
 
@@ -152,7 +154,7 @@ class IPControllerApp(BaseParallelApplication):
     name = u'ipcontroller'
     description = _description
     examples = _examples
-    classes = [ProfileDir, Session, HubFactory, TaskScheduler, HeartMonitor, DictDB] + real_dbs
+    classes = [ProfileDir, Session, HubFactory, TaskScheduler, HeartMonitor, DictDB, BlobStore] + real_dbs
     
     # change default to True
     auto_create = Bool(True, config=True,
@@ -285,6 +287,9 @@ def load_config_from_json(self):
         c.HubFactory.control = (ccfg['control'], ecfg['control'])
         c.HubFactory.mux = (ccfg['mux'], ecfg['mux'])
         c.HubFactory.task = (ccfg['task'], ecfg['task'])
+        if 'broadcast' in ccfg:
+            # not in connection files from older controllers
+            c.HubFactory.broadcast = (ccfg['broadcast'], ecfg['broadcast'])
         c.HubFactory.iopub = (ccfg['iopub'], ecfg['iopub'])
         c.HubFactory.notifier_port = ccfg['notification']
     
@@ -435,6 +440,21 @@ def init_schedulers(self):
                 # single-threaded Controller
                 kwargs['in_thread'] = True
                 launch_scheduler(*sargs, **kwargs)
+
+        # Broadcast scheduler
+        self.log.info("broadcast::using Python Broadcast scheduler")
+        bargs = (f.client_url('broadcast'), f.engine_url('broadcast'), monitor_url)
+        kwargs = dict(logname='broadcast', loglevel=self.log_level,
+                        log_url = self.log_url, config=dict(self.config))
+        if 'Process' in self.mq_class:
+            # run the Broadcast scheduler in a Process
+            q = Process(target=launch_broadcast_scheduler, args=bargs, kwargs=kwargs)
+            q.daemon=True
+            children.append(q)
+        else:
+            # single-threaded Controller
+            kwargs['in_thread'] = True
+            launch_broadcast_scheduler(*bargs, **kwargs)
         
         # set unlimited HWM for all relay devices
         if hasattr(zmq, 'SNDHWM'):
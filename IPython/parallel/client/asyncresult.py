@@ -19,6 +19,7 @@
 
 import sys
 import time
+import traceback
 from datetime import datetime
 
 from zmq import MessageTracker
@@ -62,6 +63,7 @@ class AsyncResult(object):
     _single_result = False
 
     def __init__(self, client, msg_ids, fname='unknown', targets=None, tracker=None):
+        self._done_callbacks = []
         if isinstance(msg_ids, string_types):
             # always a list
             msg_ids = [msg_ids]
@@ -143,26 +145,35 @@ def wait(self, timeout=-1):
         self._ready = self._client.wait(self.msg_ids, timeout)
         if self._ready:
             try:
-                results = list(map(self._client.results.get, self.msg_ids))
-                self._result = results
-                if self._single_result:
-                    r = results[0]
-                    if isinstance(r, Exception):
-                        raise r
-                else:
-                    results = error.collect_exceptions(results, self._fname)
-                self._result = self._reconstruct_result(results)
-            except Exception as e:
-                self._exception = e
-                self._success = False
-            else:
-                self._success = True
+                self._collect_results()
             finally:
                 if timeout is None or timeout < 0:
                     # cutoff infinite wait at 10s
                     timeout = 10
                 self._wait_for_outputs(timeout)
 
+    def _collect_results(self):
+        """Collect our results from the Client, once they have all arrived."""
+        if self._success is not None:
+            # already collected, by a done callback
+            return
+        try:
+            results = list(map(self._client.results.get, self.msg_ids))
+            self._result = results
+            if self._single_result:
+                r = results[0]
+                if isinstance(r, Exception):
+                    raise r
+            else:
+                results = error.collect_exceptions(results, self._fname)
+            self._result = self._reconstruct_result(results)
+        except Exception as e:
+            self._exception = e
+            self._success = False
+        else:
+            self._success = True
+        self._fire_done_callbacks()
+
 
     def successful(self):
         """Return whether the call completed without raising an exception.
@@ -172,6 +183,109 @@ def successful(self):
         assert self.ready()
         return self._success
 
+    #----------------------------------------------------------------
+    # concurrent.futures.Future interface
+    #----------------------------------------------------------------
+
+    def add_done_callback(self, fn):
+        """Call `fn(self)` when the result is available.
+
+        If the result is already available, `fn` is called immediately.
+        Otherwise it is called when the Client receives the last reply,
+        which happens when the Client spins: in `wait`, in a `spin_thread`,
+        or from an event loop to which the Client has been attached
+        with :meth:`Client.attach_loop`.
+        """
+        if self._success is not None:
+            self._run_callback(fn)
+            return
+        self._done_callbacks.append(fn)
+        if len(self._done_callbacks) == 1:
+            self._client._add_done_callback(self.msg_ids, self._on_done)
+
+    def _on_done(self):
+        """Called by the Client when all of our replies have arrived."""
+        self._ready = True
+        self._collect_results()
+
+    def _run_callback(self, fn):
+        try:
+            fn(self)
+        except Exception:
+            print("Exception in done callback %r of %r" % (fn, self), file=sys.stderr)
+            traceback.print_exc()
+
+    def _fire_done_callbacks(self):
+        callbacks = self._done_callbacks
+        self._done_callbacks = []
+        for fn in callbacks:
+            self._run_callback(fn)
+
+    def done(self):
+        """Return whether the call has completed."""
+        return self.ready()
+
+    def running(self):
+        """Return whether the call is still in progress."""
+        return not self.ready()
+
+    def cancelled(self):
+        """Tasks are not cancelled, only aborted, so this is always False."""
+        return False
+
+    def cancel(self):
+        """Tasks that have been submitted can't be cancelled.
+
+        Use :meth:`abort` instead.  This always returns False.
+        """
+        return False
+
+    def exception(self, timeout=None):
+        """Return the exception raised by the call, or None if it succeeded.
+
+        Waits for up to `timeout` seconds, forever if it is None,
+        and raises ``TimeoutError`` if the result is not ready by then.
+        """
+        self.wait(-1 if timeout is None else timeout)
+        if not self._ready:
+            raise error.TimeoutError("Result not ready.")
+        if self._success:
+            return None
+        return self._exception
+
+    def as_future(self):
+        """Return a :class:`concurrent.futures.Future` for the result.
+
+        The Future is resolved with the value that :meth:`get` returns,
+        or the exception it raises.  It can be passed to
+        ``asyncio.wrap_future``, or yielded in a tornado coroutine.
+
+        `result` is a property of AsyncResult, rather than a method,
+        which is why the AsyncResult itself is not a Future.
+
+        Requires :mod:`concurrent.futures`, which is in the standard library
+        on Python >= 3.2, and is the ``futures`` package on Python 2.
+        """
+        try:
+            from concurrent.futures import Future
+        except ImportError:
+            raise ImportError("AsyncResult.as_future requires concurrent.futures "
+                "(on Python 2, install the `futures` package)")
+        f = Future()
+        f.set_running_or_notify_cancel()
+        def resolve(ar):
+            if ar._success:
+                f.set_result(ar._result)
+            else:
+                f.set_exception(ar._exception)
+        self.add_done_callback(resolve)
+        return f
+
+    def __await__(self):
+        """Allow ``await ar`` in asyncio coroutines"""
+        import asyncio
+        return asyncio.wrap_future(self.as_future()).__await__()
+
     #----------------------------------------------------------------
     # Extra methods not in mp.pool.AsyncResult
     #----------------------------------------------------------------
@@ -686,22 +800,36 @@ def wait(self, timeout=-1):
                 if not pending:
                     self._ready = True
         if self._ready:
-            try:
-                results = list(map(self._client.results.get, self.msg_ids))
-                self._result = results
-                if self._single_result:
-                    r = results[0]
-                    if isinstance(r, Exception):
-                        raise r
-                else:
-                    results = error.collect_exceptions(results, self._fname)
-                self._result = self._reconstruct_result(results)
-            except Exception as e:
-                self._exception = e
-                self._success = False
-            else:
-                self._success = True
-            finally:
-                self._metadata = [self._client.metadata[mid] for mid in self.msg_ids]
+            self._metadata = [self._client.metadata[mid] for mid in self.msg_ids]
+            self._collect_results()
+
+    def add_done_callback(self, fn):
+        """Call `fn(self)` when the result is available.
+
+        Results that are not local are requested from the Hub, once.
+        If any of them are still pending, they could only be waited for
+        by polling the Hub, so RuntimeError is raised instead.
+        Use :meth:`wait` for those.
+        """
+        if self._success is None:
+            client = self._client
+            remote_ids = [ m for m in self.msg_ids
+                if m not in client.outstanding and m not in client.results ]
+            if remote_ids:
+                pending = client.result_status(remote_ids)['pending']
+                if pending:
+                    raise RuntimeError("%i results are pending on the Hub, "
+                        "and can't be waited for without polling it" % len(pending))
+                try:
+                    # fetch them into client.results
+                    client.result_status(remote_ids, status_only=False)
+                except error.RemoteError:
+                    # failures are raised by get, once they are collected
+                    pass
+        super(AsyncHubResult, self).add_done_callback(fn)
+
+    def _on_done(self):
+        self._metadata = [self._client.metadata[mid] for mid in self.msg_ids]
+        super(AsyncHubResult, self)._on_done()
 
 __all__ = ['AsyncResult', 'AsyncMapResult', 'AsyncHubResult']
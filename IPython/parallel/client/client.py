@@ -19,7 +19,7 @@
 import os
 import json
 import sys
-from threading import Thread, Event
+from threading import Thread, Event, Lock
 import time
 import warnings
 from datetime import datetime
@@ -215,6 +215,15 @@ def __setitem__(self, key, value):
             raise KeyError(key)
 
 
+class _Wait(object):
+    """The number of results a call to Client.wait is still waiting for,
+    and an optional callback for when they have all arrived.
+    """
+    def __init__(self, remaining, callback=None):
+        self.remaining = remaining
+        self.callback = callback
+
+
 class Client(HasTraits):
     """A semi-synchronous client to the IPython ZMQ cluster
 
@@ -334,6 +343,9 @@ class Client(HasTraits):
     debug = Bool(False)
     _spin_thread = Any()
     _stop_spinning = Any()
+    # the event loop the sockets are attached to, if any, and the sockets
+    _loop = Any()
+    _loop_sockets = List()
 
     profile=Unicode()
     def _profile_default(self):
@@ -350,6 +362,12 @@ def _profile_default(self):
 
 
     _outstanding_dict = Instance('collections.defaultdict', (set,))
+    # the _Waits of the calls to wait() in progress, by the msg_ids they wait on
+    _waits = Instance('collections.defaultdict', (list,))
+    # held while registering a _Wait or counting results against them,
+    # so that a spin_thread can't handle a result in between
+    # the check of outstanding and the registration
+    _waits_lock = Any()
     _ids = List()
     _connected=Bool(False)
     _ssh=Bool(False)
@@ -363,6 +381,7 @@ def _profile_default(self):
     _notification_socket=Instance('zmq.Socket')
     _mux_socket=Instance('zmq.Socket')
     _task_socket=Instance('zmq.Socket')
+    _broadcast_socket=Instance('zmq.Socket')
     _task_scheme=Unicode()
     _closed = False
     _ignored_control_replies=Integer(0)
@@ -385,6 +404,7 @@ def __init__(self, url_file=None, profile=None, profile_dir=None, ipython_dir=No
             context = zmq.Context.instance()
         self._context = context
         self._stop_spinning = Event()
+        self._waits_lock = Lock()
         
         if 'url_or_file' in extra_args:
             url_file = extra_args['url_or_file']
@@ -426,6 +446,9 @@ def __init__(self, url_file=None, profile=None, profile_dir=None, ipython_dir=No
         # turn interface,port into full urls:
         for key in ('control', 'task', 'mux', 'iopub', 'notification', 'registration'):
             cfg[key] = cfg['interface'] + ':%i' % cfg[key]
+        if 'broadcast' in cfg:
+            # not in connection files from older controllers
+            cfg['broadcast'] = cfg['interface'] + ':%i' % cfg['broadcast']
         
         url = cfg['registration']
         
@@ -490,7 +513,8 @@ def __init__(self, url_file=None, profile=None, profile_dir=None, ipython_dir=No
                                     'shutdown_notification' : lambda msg: self.close(),
                                     }
         self._queue_handlers = {'execute_reply' : self._handle_execute_reply,
-                                'apply_reply' : self._handle_apply_reply}
+                                'apply_reply' : self._handle_apply_reply,
+                                'batch' : self._handle_batch}
         
         try:
             self._connect(sshserver, ssh_kwargs, timeout)
@@ -548,6 +572,7 @@ def _stop_scheduling_tasks(self):
         """Stop scheduling tasks because an engine has been unregistered
         from a pure ZMQ scheduler.
         """
+        self._stop_watching(self._task_socket)
         self._task_socket.close()
         self._task_socket = None
         msg = "An engine has been unregistered, and we are using pure " +\
@@ -626,6 +651,10 @@ def connect_socket(s, url):
             self._task_socket = self._context.socket(zmq.DEALER)
             connect_socket(self._task_socket, cfg['task'])
 
+            if 'broadcast' in cfg:
+                self._broadcast_socket = self._context.socket(zmq.DEALER)
+                connect_socket(self._broadcast_socket, cfg['broadcast'])
+
             self._notification_socket = self._context.socket(zmq.SUB)
             self._notification_socket.setsockopt(zmq.SUBSCRIBE, b'')
             connect_socket(self._notification_socket, cfg['notification'])
@@ -763,6 +792,7 @@ def _handle_execute_reply(self, msg):
             pass
         else:
             self.results[msg_id] = self._unwrap_exception(content)
+        self._notify_waits(msg_id)
 
     def _handle_apply_reply(self, msg):
         """Save the reply to an apply_request into our results."""
@@ -800,6 +830,54 @@ def _handle_apply_reply(self, msg):
             pass
         else:
             self.results[msg_id] = self._unwrap_exception(content)
+        self._notify_waits(msg_id)
+
+    def _notify_waits(self, msg_id):
+        """Count a result against the calls to wait() that are waiting for it."""
+        done = []
+        with self._waits_lock:
+            for w in self._waits.pop(msg_id, None) or []:
+                w.remaining -= 1
+                if w.remaining == 0 and w.callback is not None:
+                    done.append(w.callback)
+        for callback in done:
+            callback()
+
+    def _register_wait(self, msg_ids, callback=None):
+        """Register a _Wait for those of msg_ids that are outstanding.
+
+        Returns the _Wait, and the set of msg_ids it waits for.
+        """
+        with self._waits_lock:
+            pending = self.outstanding.intersection(msg_ids)
+            w = _Wait(len(pending), callback)
+            for msg_id in pending:
+                self._waits[msg_id].append(w)
+        return w, pending
+
+    def _unregister_wait(self, w, msg_ids):
+        """Remove a _Wait that is given up on."""
+        with self._waits_lock:
+            for msg_id in msg_ids:
+                waits = self._waits.get(msg_id)
+                if waits and w in waits:
+                    waits.remove(w)
+                    if not waits:
+                        del self._waits[msg_id]
+
+    def _add_done_callback(self, msg_ids, callback):
+        """Call `callback()` once results for all of msg_ids have arrived.
+
+        If none of them are outstanding, it is called immediately.
+        """
+        w, pending = self._register_wait(msg_ids, callback)
+        if not pending:
+            callback()
+            return
+        if self._loop is not None and hasattr(self._loop, 'add_reader'):
+            # A send may have consumed the edge of a socket's FD,
+            # so check the sockets once more.
+            self._loop.call_soon_threadsafe(self._loop_spin)
 
     def _flush_notifications(self):
         """Flush notifications of engine registrations waiting
@@ -816,9 +894,22 @@ def _flush_notifications(self):
                 handler(msg)
             idents,msg = self.session.recv(self._notification_socket, mode=zmq.NOBLOCK)
 
+    def _handle_batch(self, batch):
+        """Handle a batch of replies, such as apply_replies coalesced by an engine."""
+        for msg in self.session.unserialize_batch(batch, copy=False):
+            msg_type = msg['header']['msg_type']
+            handler = self._queue_handlers.get(msg_type, None)
+            if handler is None or msg_type == 'batch':
+                raise Exception("Unhandled message type in batch: %s" % msg_type)
+            handler(msg)
+
     def _flush_results(self, sock):
-        """Flush task or queue results waiting in ZMQ queue."""
-        idents,msg = self.session.recv(sock, mode=zmq.NOBLOCK)
+        """Flush task or queue results waiting in ZMQ queue.
+
+        Results are received without copying, so that their buffers
+        (e.g. the data of numpy arrays) are used in place.
+        """
+        idents,msg = self.session.recv(sock, mode=zmq.NOBLOCK, copy=False)
         while msg is not None:
             if self.debug:
                 pprint(msg)
@@ -828,7 +919,7 @@ def _flush_results(self, sock):
                 raise Exception("Unhandled message type: %s" % msg_type)
             else:
                 handler(msg)
-            idents,msg = self.session.recv(sock, mode=zmq.NOBLOCK)
+            idents,msg = self.session.recv(sock, mode=zmq.NOBLOCK, copy=False)
 
     def _flush_control(self, sock):
         """Flush replies from the control channel waiting
@@ -974,6 +1065,7 @@ def close(self, linger=None):
         if self._closed:
             return
         self.stop_spin_thread()
+        self.detach_loop()
         snames = [ trait for trait in self.trait_names() if trait.endswith("socket") ]
         for name in snames:
             socket = getattr(self, name)
@@ -1030,6 +1122,74 @@ def stop_spin_thread(self):
             self._spin_thread.join()
             self._spin_thread = None
 
+    def attach_loop(self, loop=None):
+        """Receive results from an event loop, instead of by calling spin().
+
+        The Client's sockets are watched by `loop`, and flushed when
+        there are messages waiting, so AsyncResults are resolved,
+        and their done callbacks called, without spinning or polling threads.
+        AsyncResults can then be awaited in asyncio coroutines,
+        or turned into Futures with :meth:`AsyncResult.as_future`.
+
+        The Client must then only be used from the loop's thread.
+
+        Parameters
+        ----------
+
+        loop : IOLoop or asyncio event loop, optional
+            The loop to attach to.  Default: the zmq IOLoop instance.
+        """
+        if self._loop is not None:
+            self.detach_loop()
+        if loop is None:
+            from zmq.eventloop import ioloop
+            loop = ioloop.IOLoop.instance()
+        self._loop = loop
+        for sock in (self._notification_socket, self._iopub_socket, self._mux_socket,
+                self._task_socket, self._broadcast_socket, self._control_socket,
+                self._query_socket):
+            if sock is None:
+                continue
+            if hasattr(loop, 'add_reader'):
+                # asyncio loops watch the socket's file descriptor,
+                # which is edge-triggered
+                loop.add_reader(sock.getsockopt(zmq.FD), self._loop_spin)
+            else:
+                loop.add_handler(sock, self._loop_handler, loop.READ)
+            self._loop_sockets.append(sock)
+        if hasattr(loop, 'add_reader'):
+            # flush anything that arrived before the FDs were watched
+            loop.call_soon(self._loop_spin)
+
+    def detach_loop(self):
+        """Stop receiving results from the loop given to attach_loop, if any."""
+        for sock in list(self._loop_sockets):
+            self._stop_watching(sock)
+        self._loop = None
+
+    def _stop_watching(self, sock):
+        if sock not in self._loop_sockets:
+            return
+        self._loop_sockets.remove(sock)
+        if hasattr(self._loop, 'remove_reader'):
+            self._loop.remove_reader(sock.getsockopt(zmq.FD))
+        else:
+            self._loop.remove_handler(sock)
+
+    def _loop_handler(self, sock, events):
+        self.spin()
+
+    def _loop_spin(self):
+        if self._loop is None:
+            return
+        self.spin()
+        # Reading EVENTS re-arms the edge-triggered FDs.  If messages arrived
+        # while spinning, their edge has already passed, so spin again.
+        for sock in self._loop_sockets:
+            if sock.getsockopt(zmq.EVENTS) & zmq.POLLIN:
+                self._loop.call_soon(self._loop_spin)
+                break
+
     def spin(self):
         """Flush any registration notifications and execution results
         waiting in the ZMQ queue.
@@ -1042,6 +1202,8 @@ def spin(self):
             self._flush_results(self._mux_socket)
         if self._task_socket:
             self._flush_results(self._task_socket)
+        if self._broadcast_socket:
+            self._flush_results(self._broadcast_socket)
         if self._control_socket:
             self._flush_control(self._control_socket)
         if self._query_socket:
@@ -1082,15 +1244,42 @@ def wait(self, jobs=None, timeout=-1):
                     theids.update(job.msg_ids)
                     continue
                 theids.add(job)
-        if not theids.intersection(self.outstanding):
+        # Count the results as they arrive, rather than checking every msg_id
+        # against outstanding each time around.
+        w, pending = self._register_wait(theids)
+        if not pending:
             return True
-        self.spin()
-        while theids.intersection(self.outstanding):
-            if timeout >= 0 and ( time.time()-tic ) > timeout:
-                break
-            time.sleep(1e-3)
+        try:
             self.spin()
-        return len(theids.intersection(self.outstanding)) == 0
+            while w.remaining > 0:
+                if timeout >= 0:
+                    remaining_time = timeout - (time.time() - tic)
+                    if remaining_time <= 0:
+                        break
+                else:
+                    remaining_time = None
+                self._poll_results(remaining_time)
+                self.spin()
+        finally:
+            if w.remaining > 0:
+                self._unregister_wait(w, pending)
+        return w.remaining == 0
+
+    def _poll_results(self, timeout=None):
+        """Block until there may be results to flush, or timeout (in seconds) passes.
+
+        If a spin_thread is running, it may receive the results first,
+        so the poll is cut short to notice that.
+        """
+        poller = zmq.Poller()
+        for sock in (self._mux_socket, self._task_socket, self._broadcast_socket,
+                self._notification_socket):
+            if sock is not None:
+                poller.register(sock, zmq.POLLIN)
+        if self._spin_thread is not None:
+            timeout = 0.05 if timeout is None else min(timeout, 0.05)
+        # poll expects milliseconds, timeout is seconds
+        poller.poll(None if timeout is None else 1000 * timeout)
 
     #--------------------------------------------------------------------------
     # Control methods
@@ -1233,20 +1422,11 @@ def _maybe_raise(self, result):
 
         return result
 
-    def send_apply_request(self, socket, f, args=None, kwargs=None, metadata=None, track=False,
-                            ident=None):
-        """construct and send an apply message via a socket.
-
-        This is the principal method with which all engine execution is performed by views.
-        """
-
-        if self._closed:
-            raise RuntimeError("Client cannot be used after its sockets have been closed")
-        
+    def _pack_apply_request(self, f, args=None, kwargs=None):
+        """validate the arguments of an apply request, and serialize them."""
         # defaults:
         args = args if args is not None else []
         kwargs = kwargs if kwargs is not None else {}
-        metadata = metadata if metadata is not None else {}
 
         # validate arguments
         if not callable(f) and not isinstance(f, Reference):
@@ -1255,17 +1435,22 @@ def send_apply_request(self, socket, f, args=None, kwargs=None, metadata=None, t
             raise TypeError("args must be tuple or list, not %s"%type(args))
         if not isinstance(kwargs, dict):
             raise TypeError("kwargs must be dict, not %s"%type(kwargs))
-        if not isinstance(metadata, dict):
-            raise TypeError("metadata must be dict, not %s"%type(metadata))
 
-        bufs = serialize.pack_apply_message(f, args, kwargs,
+        return serialize.pack_apply_message(f, args, kwargs,
             buffer_threshold=self.session.buffer_threshold,
             item_threshold=self.session.item_threshold,
+            container_depth=self.session.container_depth,
+            item_budget=self.session.item_budget,
         )
 
-        msg = self.session.send(socket, "apply_request", buffers=bufs, ident=ident,
-                            metadata=metadata, track=track)
+    def _pack_execute_request(self, code, silent=True):
+        """validate the code of an execute request, and build its content."""
+        if not isinstance(code, string_types):
+            raise TypeError("code must be text, not %s" % type(code))
+        return dict(code=code, silent=bool(silent), user_variables=[], user_expressions={})
 
+    def _register_request(self, msg, ident=None):
+        """record a request that has just been sent"""
         msg_id = msg['header']['msg_id']
         self.outstanding.add(msg_id)
         if ident:
@@ -1278,8 +1463,66 @@ def send_apply_request(self, socket, f, args=None, kwargs=None, metadata=None, t
         self.history.append(msg_id)
         self.metadata[msg_id]['submitted'] = datetime.now()
 
+    def send_apply_request(self, socket, f, args=None, kwargs=None, metadata=None, track=False,
+                            ident=None):
+        """construct and send an apply message via a socket.
+
+        This is the principal method with which all engine execution is performed by views.
+        """
+
+        if self._closed:
+            raise RuntimeError("Client cannot be used after its sockets have been closed")
+        
+        metadata = metadata if metadata is not None else {}
+        if not isinstance(metadata, dict):
+            raise TypeError("metadata must be dict, not %s"%type(metadata))
+
+        bufs = self._pack_apply_request(f, args, kwargs)
+
+        msg = self.session.send(socket, "apply_request", buffers=bufs, ident=ident,
+                            metadata=metadata, track=track)
+
+        self._register_request(msg, ident)
         return msg
 
+    def send_apply_batch(self, socket, calls, metadata=None, track=False, ident=None):
+        """construct several apply messages, and send them in a single batch.
+
+        The Schedulers split batches into their individual apply_requests,
+        so this is equivalent to calling send_apply_request for each call,
+        with a single message on the wire.
+
+        Parameters
+        ----------
+        socket : the socket on which to send the batch
+        calls : list of (f, args, kwargs) tuples
+        metadata : dict
+            metadata shared by every request in the batch.
+
+        Returns
+        -------
+        msgs : list of the apply_request message dicts.
+        """
+
+        if self._closed:
+            raise RuntimeError("Client cannot be used after its sockets have been closed")
+
+        metadata = metadata if metadata is not None else {}
+        if not isinstance(metadata, dict):
+            raise TypeError("metadata must be dict, not %s"%type(metadata))
+
+        msgs = []
+        for f, args, kwargs in calls:
+            msg = self.session.msg("apply_request", metadata=metadata)
+            msg['buffers'] = self._pack_apply_request(f, args, kwargs)
+            msgs.append(msg)
+
+        self.session.send_batch(socket, msgs, ident=ident, track=track)
+
+        for msg in msgs:
+            self._register_request(msg, ident)
+        return msgs
+
     def send_execute_request(self, socket, code, silent=True, metadata=None, ident=None):
         """construct and send an execute request via a socket.
 
@@ -1292,12 +1535,9 @@ def send_execute_request(self, socket, code, silent=True, metadata=None, ident=N
         metadata = metadata if metadata is not None else {}
 
         # validate arguments
-        if not isinstance(code, string_types):
-            raise TypeError("code must be text, not %s" % type(code))
+        content = self._pack_execute_request(code, silent)
         if not isinstance(metadata, dict):
             raise TypeError("metadata must be dict, not %s" % type(metadata))
-        
-        content = dict(code=code, silent=bool(silent), user_variables=[], user_expressions={})
 
 
         msg = self.session.send(socket, "execute_request", content=content, ident=ident,
@@ -1317,6 +1557,50 @@ def send_execute_request(self, socket, code, silent=True, metadata=None, ident=N
 
         return msg
 
+    def send_broadcast_request(self, msg_type, idents, content=None, buffers=None,
+                                metadata=None, track=False):
+        """construct a request, and send it once, for several engines.
+
+        The request goes to the broadcast scheduler, which sends each engine
+        a copy with its own msg_id.  This is equivalent to sending the request
+        to each engine via the MUX queue, but the request and its buffers
+        only cross the client's link once.
+
+        Parameters
+        ----------
+        msg_type : str
+            'apply_request' or 'execute_request'
+        idents : list of bytes
+            the identities of the engines
+        content, buffers, metadata :
+            the content, buffers and metadata of the request
+
+        Returns
+        -------
+        msgs : list of the message dicts of the request for each engine,
+            which differ only in their msg_ids.
+        """
+
+        if self._closed:
+            raise RuntimeError("Client cannot be used after its sockets have been closed")
+        if self._broadcast_socket is None:
+            raise RuntimeError("The controller has no broadcast scheduler")
+
+        metadata = dict(metadata) if metadata is not None else {}
+        msg_ids = [ self.session.msg_id for ident in idents ]
+        metadata['broadcast'] = [ [ident.decode('ascii'), msg_id]
+                                    for ident, msg_id in zip(idents, msg_ids) ]
+        msg = self.session.msg(msg_type, content=content, metadata=metadata)
+        msg['header']['msg_id'] = msg_ids[0]
+        msg = self.session.send(self._broadcast_socket, msg, buffers=buffers, track=track)
+
+        msgs = []
+        for ident, msg_id in zip(idents, msg_ids):
+            engine_msg = dict(msg, header=dict(msg['header'], msg_id=msg_id))
+            self._register_request(engine_msg, ident)
+            msgs.append(engine_msg)
+        return msgs
+
     #--------------------------------------------------------------------------
     # construct a View object
     #--------------------------------------------------------------------------
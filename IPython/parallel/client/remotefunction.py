@@ -148,6 +148,8 @@ class ParallelFunction(RemoteFunction):
         to use the current `block` attribute of `view`
     chunksize : int or None
         The size of chunk to use when breaking up sequences in a load-balanced manner
+    batchsize : int or None
+        The number of chunks to submit in each message, when load-balancing.
     ordered : bool [default: True]
         Whether the result should be kept in order. If False,
         results become available as they arrive, regardless of submission order.
@@ -156,13 +158,16 @@ class ParallelFunction(RemoteFunction):
     """
 
     chunksize = None
+    batchsize = None
     ordered = None
     mapObject = None
     _mapping = False
 
-    def __init__(self, view, f, dist='b', block=None, chunksize=None, ordered=True, **flags):
+    def __init__(self, view, f, dist='b', block=None, chunksize=None, batchsize=None,
+                 ordered=True, **flags):
         super(ParallelFunction, self).__init__(view, f, block=block, **flags)
         self.chunksize = chunksize
+        self.batchsize = batchsize
         self.ordered = ordered
 
         mapClass = Map.dists[dist]
@@ -209,6 +214,8 @@ def __call__(self, *sequences):
         else:
             if self.chunksize:
                 warnings.warn("`chunksize` is ignored unless load balancing", UserWarning)
+            if self.batchsize and self.batchsize > 1:
+                warnings.warn("`batchsize` is ignored unless load balancing", UserWarning)
             # multiplexed:
             targets = self.view.targets
             # 'all' is lazily evaluated at execution time, which is now:
@@ -219,6 +226,8 @@ def __call__(self, *sequences):
                 targets = [targets]
             nparts = len(targets)
 
+        batchsize = self.batchsize if balanced else None
+        batch = []
         msg_ids = []
         for index, t in enumerate(targets):
             args = []
@@ -238,12 +247,22 @@ def __call__(self, *sequences):
             else:
                 f=self.func
 
+            if batchsize and batchsize > 1:
+                batch.append((f, args, {}))
+                if len(batch) >= batchsize:
+                    msg_ids.extend(self._submit_batch(batch))
+                    batch = []
+                continue
+
             view = self.view if balanced else client[t]
             with view.temp_flags(block=False, **self.flags):
                 ar = view.apply(f, *args)
 
             msg_ids.extend(ar.msg_ids)
 
+        if batch:
+            msg_ids.extend(self._submit_batch(batch))
+
         r = AsyncMapResult(self.view.client, msg_ids, self.mapObject,
                             fname=getname(self.func),
                             ordered=self.ordered
@@ -257,6 +276,15 @@ def __call__(self, *sequences):
         else:
             return r
 
+    def _submit_batch(self, calls):
+        """submit a batch of (f, args, kwargs) calls to the load-balanced view.
+
+        Returns the msg_ids of the submitted tasks.
+        """
+        with self.view.temp_flags(block=False, **self.flags):
+            ar = self.view._really_apply_batch(calls)
+        return ar.msg_ids
+
     def map(self, *sequences):
         """call a function on each element of one or more sequence(s) remotely.
         This should behave very much like the builtin map, but return an AsyncMapResult
@@ -18,8 +18,11 @@
 
 import imp
 import sys
+import time
 import warnings
+from collections import deque
 from contextlib import contextmanager
+from itertools import islice
 from types import ModuleType
 
 import zmq
@@ -31,7 +34,7 @@
 )
 from IPython.external.decorator import decorator
 
-from IPython.parallel import util
+from IPython.parallel import error, util
 from IPython.parallel.controller.dependency import Dependency, dependent
 from IPython.utils.py3compat import string_types, iteritems, PY3
 
@@ -408,9 +411,20 @@ class DirectView(View):
 
     """
 
+    # Send requests for several engines once, via the broadcast scheduler,
+    # rather than once for each engine, via the MUX queue.
+    # Ignored if the controller has no broadcast scheduler.
+    broadcast = Bool(False)
+    _flag_names = List(['targets', 'block', 'track', 'broadcast'])
+
     def __init__(self, client=None, socket=None, targets=None):
         super(DirectView, self).__init__(client=client, socket=socket, targets=targets)
 
+    def _use_broadcast(self, idents):
+        """whether to send a request for idents via the broadcast scheduler"""
+        return self.broadcast and len(idents) > 1 and \
+            self.client._broadcast_socket is not None
+
     @property
     def importer(self):
         """sync_imports(local=True) as a property.
@@ -562,12 +576,20 @@ def _really_apply(self, f, args=None, kwargs=None, targets=None, block=None, tra
         _idents, _targets = self.client._build_targets(targets)
         msg_ids = []
         trackers = []
-        for ident in _idents:
-            msg = self.client.send_apply_request(self._socket, f, args, kwargs, track=track,
-                                    ident=ident)
+        if self._use_broadcast(_idents):
+            bufs = self.client._pack_apply_request(f, args, kwargs)
+            msgs = self.client.send_broadcast_request('apply_request', _idents,
+                                    buffers=bufs, track=track)
             if track:
-                trackers.append(msg['tracker'])
-            msg_ids.append(msg['header']['msg_id'])
+                trackers.append(msgs[0]['tracker'])
+            msg_ids = [ msg['header']['msg_id'] for msg in msgs ]
+        else:
+            for ident in _idents:
+                msg = self.client.send_apply_request(self._socket, f, args, kwargs, track=track,
+                                        ident=ident)
+                if track:
+                    trackers.append(msg['tracker'])
+                msg_ids.append(msg['header']['msg_id'])
         if isinstance(targets, int):
             msg_ids = msg_ids[0]
         tracker = None if track is False else zmq.MessageTracker(*trackers)
@@ -645,9 +667,15 @@ def execute(self, code, silent=True, targets=None, block=None):
         _idents, _targets = self.client._build_targets(targets)
         msg_ids = []
         trackers = []
-        for ident in _idents:
-            msg = self.client.send_execute_request(self._socket, code, silent=silent, ident=ident)
-            msg_ids.append(msg['header']['msg_id'])
+        if self._use_broadcast(_idents):
+            content = self.client._pack_execute_request(code, silent)
+            msgs = self.client.send_broadcast_request('execute_request', _idents,
+                                    content=content)
+            msg_ids = [ msg['header']['msg_id'] for msg in msgs ]
+        else:
+            for ident in _idents:
+                msg = self.client.send_execute_request(self._socket, code, silent=silent, ident=ident)
+                msg_ids.append(msg['header']['msg_id'])
         if isinstance(targets, int):
             msg_ids = msg_ids[0]
         ar = AsyncResult(self.client, msg_ids, fname='execute', targets=_targets)
@@ -1003,6 +1031,81 @@ def _really_apply(self, f, args=None, kwargs=None, block=None, track=None,
             the single result if self.targets is an integer engine id
         """
 
+        block = self.block if block is None else block
+        track = self.track if track is None else track
+        metadata = self._task_metadata(f, after=after, follow=follow,
+                        timeout=timeout, targets=targets, retries=retries)
+
+        msg = self.client.send_apply_request(self._socket, f, args, kwargs, track=track,
+                                metadata=metadata)
+        tracker = None if track is False else msg['tracker']
+
+        ar = AsyncResult(self.client, msg['header']['msg_id'], fname=getname(f), targets=None, tracker=tracker)
+
+        if block:
+            try:
+                return ar.get()
+            except KeyboardInterrupt:
+                pass
+        return ar
+
+    @sync_results
+    @save_ids
+    def _really_apply_batch(self, calls, block=None, track=None,
+                                        after=None, follow=None, timeout=None,
+                                        targets=None, retries=None):
+        """submit several tasks at once, in a single batch message.
+
+        Each task is scheduled independently, exactly as if it had been
+        submitted with `apply`, but the client and Hub only handle one
+        message for the whole batch.
+
+        Parameters
+        ----------
+
+        calls : list of (f, args, kwargs) tuples
+
+        The remaining arguments are the same as for `_really_apply`,
+        and apply to every task in the batch.
+
+        Returns
+        -------
+
+        if block is False:
+            returns an AsyncResult of all the tasks
+        else:
+            returns the list of results
+        """
+        block = self.block if block is None else block
+        track = self.track if track is None else track
+        calls = list(calls)
+        if not calls:
+            raise ValueError("Cannot submit an empty batch")
+        metadata = self._task_metadata(calls[0][0], after=after, follow=follow,
+                        timeout=timeout, targets=targets, retries=retries)
+
+        if self._task_scheme == 'pure':
+            # the pure zmq scheduler would deliver the batch to a single engine
+            msgs = [ self.client.send_apply_request(self._socket, f, args, kwargs,
+                        track=track, metadata=metadata) for f, args, kwargs in calls ]
+        else:
+            msgs = self.client.send_apply_batch(self._socket, calls, track=track,
+                                metadata=metadata)
+        tracker = None if track is False else msgs[0]['tracker']
+
+        msg_ids = [ msg['header']['msg_id'] for msg in msgs ]
+        ar = AsyncResult(self.client, msg_ids, fname=getname(calls[0][0]), targets=None, tracker=tracker)
+
+        if block:
+            try:
+                return ar.get()
+            except KeyboardInterrupt:
+                pass
+        return ar
+
+    def _task_metadata(self, f, after=None, follow=None, timeout=None,
+                                targets=None, retries=None):
+        """validate the scheduler flags of a task, and build its metadata."""
         # validate whether we can run
         if self._socket.closed:
             msg = "Task farming is disabled"
@@ -1023,10 +1126,6 @@ def _really_apply(self, f, args=None, kwargs=None, block=None, track=None,
                 warnings.warn(msg, RuntimeWarning)
 
         # build args
-        args = [] if args is None else args
-        kwargs = {} if kwargs is None else kwargs
-        block = self.block if block is None else block
-        track = self.track if track is None else track
         after = self.after if after is None else after
         retries = self.retries if retries is None else retries
         follow = self.follow if follow is None else follow
@@ -1045,20 +1144,7 @@ def _really_apply(self, f, args=None, kwargs=None, block=None, track=None,
 
         after = self._render_dependency(after)
         follow = self._render_dependency(follow)
-        metadata = dict(after=after, follow=follow, timeout=timeout, targets=idents, retries=retries)
-
-        msg = self.client.send_apply_request(self._socket, f, args, kwargs, track=track,
-                                metadata=metadata)
-        tracker = None if track is False else msg['tracker']
-
-        ar = AsyncResult(self.client, msg['header']['msg_id'], fname=getname(f), targets=None, tracker=tracker)
-
-        if block:
-            try:
-                return ar.get()
-            except KeyboardInterrupt:
-                pass
-        return ar
+        return dict(after=after, follow=follow, timeout=timeout, targets=idents, retries=retries)
 
     @sync_results
     @save_ids
@@ -1086,8 +1172,22 @@ def map(self, f, *sequences, **kwargs):
             whether to create a MessageTracker to allow the user to
             safely edit after arrays and buffers during non-copying
             sends.
-        chunksize : int [default 1]
+        chunksize : int or 'auto' [default 1]
             how many elements should be in each task.
+            With 'auto', chunks are sized to take about `target_duration`
+            each, from the run times of the chunks that have come back,
+            and shrink towards the end of the map.  Chunks are then submitted
+            as results come back, which only happens while the map blocks,
+            so 'auto' requires block=True.  Use :meth:`imap` to consume
+            the results of an 'auto' map as they arrive.
+            'auto' can't be combined with `track` or `batchsize`.
+        target_duration : float [default 0.1]
+            the run time to aim for with chunksize='auto', in seconds.
+        batchsize : int [default 1]
+            how many tasks to submit in each message.
+            Larger batches greatly reduce the submission overhead of maps
+            with many small tasks, without changing how the tasks are
+            load-balanced.
         ordered : bool [default True]
             Whether the results should be gathered as they arrive, or enforce
             the order of submission.
@@ -1110,16 +1210,286 @@ def map(self, f, *sequences, **kwargs):
         # default
         block = kwargs.get('block', self.block)
         chunksize = kwargs.get('chunksize', 1)
+        batchsize = kwargs.get('batchsize', 1)
         ordered = kwargs.get('ordered', True)
 
-        keyset = set(kwargs.keys())
-        extra_keys = keyset.difference_update(set(['block', 'chunksize']))
+        extra_keys = set(kwargs).difference(['block', 'chunksize', 'batchsize',
+            'ordered', 'track', 'target_duration'])
         if extra_keys:
             raise TypeError("Invalid kwargs: %s"%list(extra_keys))
 
         assert len(sequences) > 0, "must have some sequences to map onto!"
 
-        pf = ParallelFunction(self, f, block=block, chunksize=chunksize, ordered=ordered)
+        if chunksize == 'auto':
+            if kwargs.get('track'):
+                raise ValueError("chunksize='auto' doesn't support track=True")
+            if batchsize != 1:
+                raise ValueError("chunksize='auto' doesn't support batchsize")
+            if not block:
+                raise ValueError("chunksize='auto' requires block=True, "
+                    "use imap to iterate over the results as they arrive")
+            smap = self._streaming_map(f, sequences, chunksize,
+                kwargs.get('target_duration', 0.1), ordered)
+            return smap.collect()
+
+        pf = ParallelFunction(self, f, block=block, chunksize=chunksize,
+                                batchsize=batchsize, ordered=ordered)
         return pf.map(*sequences)
 
+    def imap(self, f, *sequences, **kwargs):
+        """``view.imap(f, *sequences, chunksize=1, ordered=True, max_outstanding=None)`` => iterator
+
+        Parallel version of :func:`itertools.imap`, load-balanced by this View.
+
+        Unlike `map`, the sequences may be any iterables, including
+        endless generators.  They are consumed as results come back,
+        so that at most `max_outstanding` tasks are submitted and waiting
+        at any time, and memory use does not grow with their length.
+        As with :func:`itertools.imap`, mapping stops at the end of
+        the shortest iterable.
+
+        The results are removed from the Client's cache as they are yielded.
+
+        Parameters
+        ----------
+
+        f : callable
+            function to be mapped
+        *sequences: one or more iterables
+            the iterables whose elements are passed to `f`
+        chunksize : int or 'auto' [default 1]
+            how many elements should be in each task.
+            With 'auto', chunks are sized to take about `target_duration`
+            each, from the run times of the chunks that have come back.
+            If the sequences have a length, chunks also shrink towards
+            the end of the map, so that it doesn't wait on a few large ones.
+        target_duration : float [default 0.1]
+            the run time to aim for with chunksize='auto', in seconds.
+        ordered : bool [default True]
+            Whether to yield results in the order of their elements,
+            or as they arrive.
+        max_outstanding : int [default: 4 per engine]
+            The most tasks to have in flight at once.
+
+        Returns
+        -------
+
+        An iterator of the results of `f`.
+        """
+        chunksize = kwargs.pop('chunksize', 1)
+        target_duration = kwargs.pop('target_duration', 0.1)
+        ordered = kwargs.pop('ordered', True)
+        max_outstanding = kwargs.pop('max_outstanding', None)
+        if kwargs:
+            raise TypeError("Invalid kwargs: %s"%list(kwargs))
+
+        assert len(sequences) > 0, "must have some sequences to map onto!"
+        smap = self._streaming_map(f, sequences, chunksize, target_duration,
+            ordered, max_outstanding)
+        return self._imap(smap)
+
+    def _streaming_map(self, f, sequences, chunksize, target_duration, ordered,
+                       max_outstanding=None):
+        """Check the arguments of a streaming map, and return its _StreamingMap.
+
+        No chunks are submitted until its `submit` is called.
+        """
+        nengines = len(self.client.ids)
+        if chunksize == 'auto':
+            try:
+                total = min(len(seq) for seq in sequences)
+            except TypeError:
+                # some are iterators
+                total = None
+            chunksize = _AdaptiveChunks(target_duration, nengines, total)
+        elif chunksize < 1:
+            raise ValueError("chunksize must be at least 1, not %r" % chunksize)
+        if max_outstanding is None:
+            max_outstanding = 4 * max(nengines, 1)
+        if max_outstanding < 1:
+            raise ValueError("max_outstanding must be at least 1, not %r" % max_outstanding)
+
+        iterators = [ iter(seq) for seq in sequences ]
+        return _StreamingMap(self, f, iterators, chunksize, ordered, max_outstanding)
+
+    def _imap(self, smap):
+        """The generator behind imap.
+
+        The first chunks are submitted when it is first advanced.
+        """
+        smap.submit()
+        while not smap.done:
+            start, results = smap.next_results()
+            for r in results:
+                yield r
+
+
+class _StreamingMap(object):
+    """The chunks of a streaming map, submitted as results come back.
+
+    At most max_outstanding chunks are in flight at once, and more are
+    submitted as each one is collected, so the iterators are consumed
+    no faster than results come back.
+
+    chunksize is an int, or an _AdaptiveChunks.
+    """
+
+    def __init__(self, view, f, iterators, chunksize, ordered, max_outstanding):
+        self.view = view
+        self.client = view.client
+        self.f = f
+        self.iterators = iterators
+        self.chunksize = chunksize
+        self.adaptive = isinstance(chunksize, _AdaptiveChunks)
+        self.ordered = ordered
+        self.max_outstanding = max_outstanding
+        # the msg_ids of the chunks submitted so far
+        self.msg_ids = []
+        # the AsyncResults of the chunks in flight, in order of submission
+        self.pending = deque()
+        # those that have finished, for unordered iteration
+        self.finished = deque()
+        # the index of the first element of each chunk in flight, by msg_id
+        self.starts = {}
+        self.submitted = 0
+        self.exhausted = False
+
+    @property
+    def done(self):
+        """Whether every chunk has been collected"""
+        return self.exhausted and not self.pending
+
+    def submit(self):
+        """Submit chunks, until max_outstanding are in flight"""
+        while not self.exhausted and len(self.pending) < self.max_outstanding:
+            size = self.chunksize.next_size() if self.adaptive else self.chunksize
+            args = [ list(islice(it, size)) for it in self.iterators ]
+            n = min(len(arg) for arg in args)
+            if n == 0:
+                self.exhausted = True
+                return
+            args = [ arg[:n] for arg in args ]
+            if self.adaptive:
+                self.chunksize.submitted += n
+            with self.view.temp_flags(block=False):
+                ar = self.view.apply(_map_chunk, self.f, *args)
+            msg_id = ar.msg_ids[0]
+            self.msg_ids.append(msg_id)
+            self.starts[msg_id] = self.submitted
+            self.submitted += n
+            self.pending.append(ar)
+            if not self.ordered:
+                ar.add_done_callback(self.finished.append)
+
+    def _wait_finished(self, timeout):
+        """Wait until a chunk has finished, for unordered iteration"""
+        deadline = None if timeout is None or timeout < 0 else time.time() + timeout
+        client = self.client
+        while not self.finished:
+            client.spin()
+            if self.finished:
+                break
+            if deadline is None:
+                client._poll_results()
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise error.TimeoutError("Result not ready.")
+                client._poll_results(remaining)
+
+    def next_results(self, timeout=-1):
+        """Collect the next chunk, and return ``(start, results)``.
+
+        The next chunk is the next one submitted if ordered, otherwise the
+        next one to finish.  `start` is the index of its first element.
+        Raises TimeoutError if it hasn't finished within `timeout` seconds,
+        and the chunk's RemoteError if it failed.
+        """
+        if self.ordered:
+            ar = self.pending[0]
+            ar.wait(timeout)
+            if not ar.ready():
+                raise error.TimeoutError("Result not ready.")
+            self.pending.popleft()
+        else:
+            self._wait_finished(timeout)
+            ar = self.finished.popleft()
+            self.pending.remove(ar)
+        start = self.starts.pop(ar.msg_ids[0])
+        results = ar.get(0)
+        if self.adaptive:
+            md = ar.metadata
+            self.chunksize.record(len(results), md['started'], md['completed'])
+        self.client.purge_local_results(ar)
+        # keep the engines busy while the results are consumed
+        self.submit()
+        return start, results
+
+    def collect(self):
+        """Submit and collect every chunk, and return all of the results in order."""
+        self.submit()
+        chunks = []
+        while not self.done:
+            chunks.append(self.next_results())
+        results = []
+        for start, chunk in sorted(chunks, key=lambda c: c[0]):
+            results.extend(chunk)
+        return results
+
+
+class _AdaptiveChunks(object):
+    """The sizes of the chunks of a map, adapted to how long chunks take.
+
+    Chunks are sized to run for about target_duration, at the average
+    run time per element of the chunks so far.  Until a chunk has come back,
+    they have one element.
+
+    If the total number of elements is known, chunks are also limited to
+    half of an even share of the remaining elements between the engines,
+    so they shrink towards the end of the map, and it doesn't end up
+    waiting on a few large chunks.
+    """
+
+    # the weight of the latest chunk in the average run time per element
+    smoothing = 0.3
+    max_chunksize = 10000
+
+    def __init__(self, target_duration, nengines, total=None):
+        self.target_duration = target_duration
+        self.nengines = max(nengines, 1)
+        self.total = total
+        # the number of elements submitted so far
+        self.submitted = 0
+        # the moving average of the run time per element, in seconds
+        self.per_element = None
+
+    def next_size(self):
+        """The size of the next chunk"""
+        if self.per_element is None:
+            size = 1
+        elif self.per_element <= 0:
+            size = self.max_chunksize
+        else:
+            size = int(self.target_duration / self.per_element)
+        if self.total is not None:
+            remaining = self.total - self.submitted
+            # ceil(remaining / (2 * nengines))
+            size = min(size, -(-remaining // (2 * self.nengines)))
+        return max(1, min(size, self.max_chunksize))
+
+    def record(self, n, started, completed):
+        """Record that a chunk of n elements ran from started to completed"""
+        if not n or started is None or completed is None:
+            return
+        per_element = (completed - started).total_seconds() / n
+        if self.per_element is None:
+            self.per_element = per_element
+        else:
+            self.per_element += self.smoothing * (per_element - self.per_element)
+
+
+def _map_chunk(f, *sequences):
+    """Call f on the elements of a chunk of sequences, on an engine."""
+    return list(map(f, *sequences))
+
 __all__ = ['LoadBalancedView', 'DirectView']
@@ -0,0 +1,225 @@
+"""A content-addressed store for the buffers of task records.
+
+Large buffers are written to files named by the hash of their content,
+and records hold only a BlobRef to them.  Reading a blob maps its file
+into memory, so it can be sent with zmq without being copied into Python.
+
+Authors:
+
+* Min RK
+"""
+#-----------------------------------------------------------------------------
+#  Copyright (C) 2014  The IPython Development Team
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+import atexit
+import errno
+import hashlib
+import mmap
+import os
+import shutil
+import tempfile
+
+from IPython.config.configurable import LoggingConfigurable
+from IPython.utils.traitlets import Bool, Dict, Integer, Unicode
+
+try:
+    buffer
+except NameError:
+    # py3k
+    buffer = memoryview
+
+#-----------------------------------------------------------------------------
+# Classes
+#-----------------------------------------------------------------------------
+
+class BlobRef(object):
+    """A reference to a buffer in a BlobStore.
+
+    These are what records hold in place of the buffers themselves.
+    """
+    __slots__ = ('key', 'size')
+
+    def __init__(self, key, size):
+        self.key = key
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __eq__(self, other):
+        return isinstance(other, BlobRef) and self.key == other.key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __getstate__(self):
+        return (self.key, self.size)
+
+    def __setstate__(self, state):
+        self.key, self.size = state
+
+    def __repr__(self):
+        return "BlobRef(%r, %i)" % (self.key, self.size)
+
+
+class BlobStore(LoggingConfigurable):
+    """Content-addressed, file-backed storage of buffers.
+
+    Each distinct buffer is stored once, in a file named by its sha1.
+    The store counts the references to each blob, and deletes a blob's file
+    when its last reference is released.  When a db is loaded, it adopts
+    the references its records still hold.
+
+    Each db has a directory of its own, so the store only ever deletes
+    blobs that it wrote, or that the records of its db referred to.
+    """
+
+    location = Unicode(u'', config=True,
+        help="""The directory in which to store blobs.
+        The default is a directory named for the cluster and the db,
+        in the 'db/blobs' directory of the current profile.""")
+
+    name = Unicode(u'',
+        help="""The name of the default location's directory, set by the db.""")
+
+    temporary = Bool(False,
+        help="""Whether to remove location when the store is closed, or at exit,
+        for a db whose records don't outlive it.""")
+
+    # the number of references to each blob
+    _refs = Dict()
+    # the keys of the blobs this store has written, which collect may delete
+    _written = Dict()
+    # bytes in the blobs referenced this session
+    size = Integer(0)
+
+    def __init__(self, **kwargs):
+        super(BlobStore, self).__init__(**kwargs)
+        if not self.location:
+            from IPython.core.application import BaseIPythonApplication
+            if BaseIPythonApplication.initialized() and \
+                    BaseIPythonApplication.instance().profile_dir is not None:
+                app = BaseIPythonApplication.instance()
+                cluster_id = getattr(app, 'cluster_id', u'')
+                name = u'-'.join(filter(None, [cluster_id, self.name])) or u'default'
+                self.location = os.path.join(app.profile_dir.location, u'db', u'blobs', name)
+            else:
+                self.location = tempfile.mkdtemp(prefix='ipython-blobs-')
+                self.temporary = True
+        if self.temporary:
+            atexit.register(self.close)
+        try:
+            os.makedirs(self.location)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def _path(self, key):
+        return os.path.join(self.location, key)
+
+    def put(self, buf):
+        """Store a buffer, returning a BlobRef to it."""
+        key = hashlib.sha1(buf).hexdigest()
+        if hasattr(buf, 'nbytes'):
+            size = buf.nbytes
+        elif isinstance(buf, memoryview):
+            # py2 memoryviews don't have nbytes
+            size = len(buf) * buf.itemsize
+        else:
+            size = len(buf)
+        if key not in self._refs:
+            path = self._path(key)
+            if not os.path.exists(path):
+                # write to a temporary file first, so that a partial blob
+                # never appears under its key
+                fd, tmp = tempfile.mkstemp(dir=self.location, prefix='.tmp-')
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        f.write(buf)
+                    os.rename(tmp, path)
+                except Exception:
+                    os.remove(tmp)
+                    raise
+            self._refs[key] = 0
+            self._written[key] = True
+            self.size += size
+        self._refs[key] += 1
+        return BlobRef(key, size)
+
+    def adopt(self, ref):
+        """Count a reference held by a record stored in an earlier session.
+
+        References to blobs that are missing from the store are not counted.
+        """
+        if ref.key not in self._refs:
+            if not os.path.exists(self._path(ref.key)):
+                self.log.warn("Blob %s is missing", ref.key)
+                return
+            self._refs[ref.key] = 0
+            self.size += ref.size
+        self._refs[ref.key] += 1
+
+    def collect(self):
+        """Delete the files of blobs this store wrote that nothing refers to.
+
+        Files the store did not write are left alone, even if nothing
+        in this session refers to them.
+        Returns the number of files deleted.
+        """
+        removed = 0
+        for key in list(self._written):
+            if key in self._refs:
+                continue
+            del self._written[key]
+            try:
+                os.remove(self._path(key))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    self.log.warn("Could not remove blob %s", key, exc_info=True)
+            else:
+                removed += 1
+        if removed:
+            self.log.info("Removed %i unreferenced blobs from %s", removed, self.location)
+        return removed
+
+    def close(self):
+        """Collect unreferenced blobs, and remove the blobs' directory
+        if it is a temporary one."""
+        self.collect()
+        if self.temporary and os.path.exists(self.location):
+            shutil.rmtree(self.location, ignore_errors=True)
+
+    def get(self, ref):
+        """Get the contents of a blob, as a read-only buffer of its mapped file."""
+        if not ref.size:
+            return buffer(b'')
+        with open(self._path(ref.key), 'rb') as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return buffer(m)
+
+    def release(self, ref):
+        """Release a reference to a blob, deleting it if it was the last one."""
+        count = self._refs.get(ref.key, 0)
+        if count > 1:
+            self._refs[ref.key] = count - 1
+        elif count == 1:
+            del self._refs[ref.key]
+            self._written.pop(ref.key, None)
+            self.size -= ref.size
+            try:
+                os.remove(self._path(ref.key))
+            except OSError:
+                self.log.warn("Could not remove blob %s", ref.key, exc_info=True)
+
+    def __contains__(self, key):
+        return key in self._refs
+
+
+__all__ = ['BlobRef', 'BlobStore']
@@ -0,0 +1,169 @@
+"""The broadcast scheduler, which sends one request to many engines.
+
+A client sends a request, with its buffers, to the broadcast scheduler once,
+listing the engines it is for, and the msg_id of the request for each engine.
+The scheduler sends each engine a copy, with its own msg_id and signature,
+sharing the buffers between the copies rather than copying them,
+so the client only sends a large payload over its link once,
+however many engines it is for.
+
+Replies are relayed back to the client as they are from the MUX queue.
+"""
+
+#-----------------------------------------------------------------------------
+#  Copyright (C) 2014  The IPython Development Team
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+#----------------------------------------------------------------------
+# Imports
+#----------------------------------------------------------------------
+
+import logging
+
+import zmq
+from zmq.eventloop import ioloop, zmqstream
+
+from IPython.config.application import Application
+from IPython.config.loader import Config
+from IPython.kernel.zmq.session import DELIM
+from IPython.utils.traitlets import Instance
+from IPython.utils.py3compat import cast_bytes
+
+from IPython.parallel import util
+from IPython.parallel.factory import SessionFactory
+from IPython.parallel.util import connect_logger, local_logger
+
+#----------------------------------------------------------------------
+# The Broadcast Scheduler
+#----------------------------------------------------------------------
+
+class BroadcastScheduler(SessionFactory):
+    """Relay each request from a client to several engines.
+
+    The metadata of a broadcast request has a 'broadcast' key: a list of
+    [engine_ident, msg_id] pairs.  Each engine gets the request with that
+    key removed, and with the msg_id in its header replaced by its own.
+
+    The Hub is sent each engine's request and reply on the monitor stream,
+    as if they had gone through the MUX queue.  Only the first engine's
+    request carries the buffers, so they are not sent to the Hub once for
+    every engine.  The others have a 'buffers_from' key in their metadata,
+    with the msg_id of the first, where the Hub finds their buffers.
+    """
+
+    client_stream = Instance(zmqstream.ZMQStream) # client-facing stream
+    engine_stream = Instance(zmqstream.ZMQStream) # engine-facing stream
+    mon_stream = Instance(zmqstream.ZMQStream) # hub-facing pub stream
+
+    def start(self):
+        self.client_stream.on_recv(self.dispatch_submission, copy=False)
+        self.engine_stream.on_recv(self.dispatch_result, copy=False)
+        self.log.info("Broadcast scheduler started")
+
+    def dispatch_submission(self, raw_msg):
+        """Send a copy of a request to each of the engines it lists."""
+        try:
+            idents, msg_list = self.session.feed_identities(raw_msg, copy=False)
+            msg = self.session.unserialize(msg_list, content=False, copy=False)
+        except Exception:
+            self.log.error("broadcast::Invalid msg: %r", raw_msg, exc_info=True)
+            return
+
+        client_id = idents[0]
+        header = msg['header']
+        metadata = msg['metadata']
+        try:
+            targets = metadata.pop('broadcast')
+        except KeyError:
+            self.log.error("broadcast::request %r from %r lists no engines",
+                header['msg_id'], client_id)
+            return
+        self.log.debug("broadcast::client %r sent %r to %i engines",
+            client_id, header['msg_id'], len(targets))
+
+        parent = msg_list[2]
+        content = msg_list[4]
+        buffers = msg_list[5:]
+        p_metadata = self.session.pack(metadata)
+        if buffers:
+            p_copy_metadata = self.session.pack(dict(metadata,
+                buffers_from=targets[0][1]))
+        delim = zmq.Frame(DELIM)
+        for i, (target, msg_id) in enumerate(targets):
+            target = cast_bytes(target)
+            parts = [self.session.pack(dict(header, msg_id=msg_id)), parent, p_metadata, content]
+            prefix = [target, client_id, delim, self.session.sign(parts)]
+            # the same buffer Frames are sent to each engine, without copying them
+            self.engine_stream.send_multipart(prefix + parts + buffers, copy=False)
+            if i == 0 or not buffers:
+                self.mon_stream.send_multipart([b'in'] + prefix + parts + buffers, copy=False)
+            else:
+                mon_parts = parts[:2] + [p_copy_metadata] + parts[3:]
+                mon_prefix = [target, client_id, delim, self.session.sign(mon_parts)]
+                self.mon_stream.send_multipart([b'in'] + mon_prefix + mon_parts, copy=False)
+
+    def dispatch_result(self, raw_msg):
+        """Relay a reply from an engine to its client, and to the Hub."""
+        if len(raw_msg) < 2:
+            self.log.error("broadcast::Invalid result: %r", raw_msg)
+            return
+        # swap the engine and client identities, as the MUX queue does
+        raw_msg = [raw_msg[1], raw_msg[0]] + raw_msg[2:]
+        self.client_stream.send_multipart(raw_msg, copy=False)
+        self.mon_stream.send_multipart([b'out'] + raw_msg, copy=False)
+
+
+def launch_broadcast_scheduler(in_addr, out_addr, mon_addr, config=None,
+                        logname='root', log_url=None, loglevel=logging.DEBUG,
+                        identity=b'broadcast', in_thread=False):
+    """Start a BroadcastScheduler, in this thread's loop or a new one."""
+
+    ZMQStream = zmqstream.ZMQStream
+
+    if config:
+        # unwrap dict back into Config
+        config = Config(config)
+
+    if in_thread:
+        # use instance() to get the same Context/Loop as our parent
+        ctx = zmq.Context.instance()
+        loop = ioloop.IOLoop.instance()
+    else:
+        # in a process, don't use instance()
+        # for safety with multiprocessing
+        ctx = zmq.Context()
+        loop = ioloop.IOLoop()
+    ins = ZMQStream(ctx.socket(zmq.ROUTER), loop)
+    util.set_hwm(ins, 0)
+    ins.setsockopt(zmq.IDENTITY, identity + b'_in')
+    ins.bind(in_addr)
+
+    outs = ZMQStream(ctx.socket(zmq.ROUTER), loop)
+    util.set_hwm(outs, 0)
+    outs.setsockopt(zmq.IDENTITY, identity + b'_out')
+    outs.bind(out_addr)
+    mons = ZMQStream(ctx.socket(zmq.PUB), loop)
+    util.set_hwm(mons, 0)
+    mons.connect(mon_addr)
+
+    # setup logging.
+    if in_thread:
+        log = Application.instance().log
+    else:
+        if log_url:
+            log = connect_logger(logname, ctx, log_url, root="broadcast", loglevel=loglevel)
+        else:
+            log = local_logger(logname, loglevel)
+
+    scheduler = BroadcastScheduler(client_stream=ins, engine_stream=outs,
+                            mon_stream=mons, loop=loop, log=log,
+                            config=config)
+    scheduler.start()
+    if not in_thread:
+        try:
+            loop.start()
+        except KeyboardInterrupt:
+            scheduler.log.critical("Interrupted, exiting...")
@@ -35,6 +35,10 @@
 DictDB supports a subset of mongodb operators::
 
     $lt,$gt,$lte,$gte,$ne,$in,$nin,$all,$mod,$exists
+
+Queries on the keys in DictDB.indexed_keys use secondary indexes
+for equality, $eq, $in, and (for datetimes) range operators,
+so that only the matching records are checked.
 """
 #-----------------------------------------------------------------------------
 #  Copyright (C) 2010-2011  The IPython Development Team
@@ -43,21 +47,28 @@
 #  the file COPYING, distributed as part of this software.
 #-----------------------------------------------------------------------------
 
+from bisect import bisect_left, bisect_right
 from copy import deepcopy as copy
 from datetime import datetime
 
 from IPython.config.configurable import LoggingConfigurable
 
 from IPython.utils.py3compat import iteritems, itervalues
-from IPython.utils.traitlets import Dict, Unicode, Integer, Float
+from IPython.utils.traitlets import Dict, Unicode, Integer, Float, List, Instance
+
+from .blobstore import BlobRef, BlobStore
+
+# the record keys that hold lists of buffers
+_buffer_keys = ('buffers', 'result_buffers')
 
+# like the other backends, comparisons never match missing (None) values
 filters = {
- '$lt' : lambda a,b: a < b,
- '$gt' : lambda a,b: b > a,
+ '$lt' : lambda a,b: a is not None and a < b,
+ '$gt' : lambda a,b: a is not None and a > b,
  '$eq' : lambda a,b: a == b,
  '$ne' : lambda a,b: a != b,
- '$lte': lambda a,b: a <= b,
- '$gte': lambda a,b: a >= b,
+ '$lte': lambda a,b: a is not None and a <= b,
+ '$gte': lambda a,b: a is not None and a >= b,
  '$in' : lambda a,b: a in b,
  '$nin': lambda a,b: a not in b,
  '$all': lambda a,b: all([ a in bb for bb in b ]),
@@ -82,11 +93,276 @@ def __call__(self, value):
                 return False
         return True
 
+class RecordIndex(object):
+    """Secondary index of msg_ids by the value of one key of their records.
+
+    Equality lookups use a dict of sets of msg_ids.  As long as the key only
+    has datetime (or None) values, they are also kept sorted for range lookups.
+    Entries are removed lazily from the sorted lists, and skipped by
+    range lookups when is_current(msg_id, value) says the record
+    no longer has that value.
+    """
+
+    def __init__(self, is_current):
+        self.is_current = is_current
+        self.by_value = {}
+        # msg_ids whose value can't be hashed, which match any lookup
+        self.unhashable = set()
+        # sorted datetime values, and their msg_ids
+        self.values = []
+        self.ids = []
+        self.ordered = True
+        self.stale = 0
+
+    def add(self, msg_id, value):
+        try:
+            self.by_value.setdefault(value, set()).add(msg_id)
+        except TypeError:
+            self.unhashable.add(msg_id)
+        if isinstance(value, datetime):
+            if not self.values or value >= self.values[-1]:
+                # records are mostly added in order
+                self.values.append(value)
+                self.ids.append(msg_id)
+            else:
+                idx = bisect_right(self.values, value)
+                self.values.insert(idx, value)
+                self.ids.insert(idx, msg_id)
+        elif value is not None:
+            self.ordered = False
+
+    def remove(self, msg_id, value):
+        try:
+            ids = self.by_value.get(value)
+        except TypeError:
+            self.unhashable.discard(msg_id)
+            ids = None
+        if ids is not None:
+            ids.discard(msg_id)
+            if not ids:
+                del self.by_value[value]
+        if isinstance(value, datetime):
+            self.stale += 1
+
+    def needs_compaction(self):
+        return self.stale > len(self.ids) // 2 + 16
+
+    def compact(self):
+        """Drop stale entries from the sorted lists."""
+        values = []
+        ids = []
+        seen = set()
+        for value, msg_id in zip(self.values, self.ids):
+            if msg_id not in seen and self.is_current(msg_id, value):
+                seen.add(msg_id)
+                values.append(value)
+                ids.append(msg_id)
+        self.values = values
+        self.ids = ids
+        self.stale = 0
+
+    def _equal(self, value):
+        """msg_ids whose value may equal `value`, or None if it is unhashable."""
+        try:
+            ids = self.by_value.get(value, ())
+        except TypeError:
+            return None
+        if self.unhashable:
+            return self.unhashable.union(ids)
+        return ids
+
+    def plan(self, spec):
+        """Plan the lookup of a query on this key.
+
+        Returns None if the index can't narrow down the query,
+        or a tuple of (estimated number of msg_ids, function returning them).
+        The msg_ids are a superset of the matching records.
+        """
+        if not isinstance(spec, dict):
+            ids = self._equal(spec)
+            if ids is None:
+                return None
+            return len(ids), lambda : ids
+
+        best = None
+        lo, hi = 0, None
+        ranged = False
+        for op, operand in iteritems(spec):
+            if op == '$eq':
+                ids = self._equal(operand)
+                candidates = None if ids is None else (len(ids), lambda ids=ids: ids)
+            elif op == '$in':
+                id_sets = [ self._equal(value) for value in operand ]
+                if any(ids is None for ids in id_sets):
+                    continue
+                n = sum(len(ids) for ids in id_sets)
+                candidates = (n, lambda id_sets=id_sets: set().union(*id_sets))
+            elif self.ordered and not self.unhashable:
+                if op == '$ne' and operand is None:
+                    # every datetime value
+                    ranged = True
+                    continue
+                if not isinstance(operand, datetime):
+                    continue
+                if op == '$gte':
+                    lo = max(lo, bisect_left(self.values, operand))
+                elif op == '$gt':
+                    lo = max(lo, bisect_right(self.values, operand))
+                elif op == '$lt':
+                    idx = bisect_left(self.values, operand)
+                    hi = idx if hi is None else min(hi, idx)
+                elif op == '$lte':
+                    idx = bisect_right(self.values, operand)
+                    hi = idx if hi is None else min(hi, idx)
+                else:
+                    continue
+                ranged = True
+                continue
+            else:
+                continue
+            if candidates is not None and (best is None or candidates[0] < best[0]):
+                best = candidates
+
+        if ranged:
+            if hi is None:
+                hi = len(self.ids)
+            n = max(hi - lo, 0)
+            if best is None or n < best[0]:
+                best = (n, lambda : self._current(lo, hi))
+        return best
+
+    def _current(self, lo, hi):
+        if not self.stale:
+            return self.ids[lo:hi]
+        is_current = self.is_current
+        return [ msg_id for value, msg_id in zip(self.values[lo:hi], self.ids[lo:hi])
+                    if is_current(msg_id, value) ]
+
+
 class BaseDB(LoggingConfigurable):
     """Empty Parent class so traitlets work on DB."""
     # base configurable traits:
     session = Unicode("")
 
+    blob_threshold = Integer(-1, config=True,
+        help="""Store buffers of at least this many bytes in a BlobStore,
+        so that records only hold references to them.
+
+        Buffers in the BlobStore are kept in memory-mapped files,
+        rather than in the db, and are sent back to clients without
+        being copied into the Hub's memory.
+        -1 (the default) disables the BlobStore.
+        """
+    )
+    blob_store = Instance(BlobStore, allow_none=True)
+    # whether the backend can store BlobRefs in its records
+    _blobs_supported = True
+    # whether the records outlive the db, so its blobs must be kept
+    _persistent = True
+
+    def __init__(self, **kwargs):
+        super(BaseDB, self).__init__(**kwargs)
+        if self.blob_threshold >= 0 and self.blob_store is None:
+            if self._blobs_supported:
+                self.blob_store = BlobStore(parent=self, log=self.log,
+                                            name=self._blob_store_name(),
+                                            temporary=not self._persistent)
+            else:
+                self.log.warn("%s does not support a BlobStore, ignoring blob_threshold",
+                    self.__class__.__name__)
+
+    # BlobStore helpers, which do nothing without a BlobStore:
+
+    def _blob_store_name(self):
+        """The name of the default BlobStore directory of this db."""
+        return self.session
+
+    def _store_buffers(self, rec):
+        """Move a record's large buffers to the BlobStore.
+
+        Returns a shallow copy of rec with BlobRefs in place of those buffers,
+        or rec itself if there was nothing to move.
+        """
+        if self.blob_store is None:
+            return rec
+        stored = None
+        for key in _buffer_keys:
+            bufs = rec.get(key, None)
+            if not bufs:
+                continue
+            if stored is None:
+                stored = dict(rec)
+            stored[key] = [ self._store_buffer(buf) for buf in bufs ]
+        return rec if stored is None else stored
+
+    def _store_buffer(self, buf):
+        if isinstance(buf, BlobRef) or len(buf) < self.blob_threshold:
+            return buf
+        return self.blob_store.put(buf)
+
+    def _load_buffers(self, rec):
+        """Replace the BlobRefs in a (copied) record with the contents of their blobs."""
+        if self.blob_store is None:
+            return rec
+        for key in _buffer_keys:
+            bufs = rec.get(key, None)
+            if bufs:
+                rec[key] = [ self.blob_store.get(buf) if isinstance(buf, BlobRef) else buf
+                             for buf in bufs ]
+        return rec
+
+    def _adopt_blobs(self, records):
+        """Adopt the blobs referred to by records loaded from an earlier session.
+
+        Backends call this once they have loaded their records.
+        """
+        if self.blob_store is None:
+            return
+        for rec in records:
+            for key in _buffer_keys:
+                for buf in rec.get(key, None) or []:
+                    if isinstance(buf, BlobRef):
+                        self.blob_store.adopt(buf)
+
+    def _release_buffers(self, rec, keys=None):
+        """Release the blobs referenced by rec, for a record being dropped or updated."""
+        if self.blob_store is None:
+            return
+        if keys is None:
+            keys = _buffer_keys
+        for key in keys:
+            for buf in rec.get(key, None) or []:
+                if isinstance(buf, BlobRef):
+                    self.blob_store.release(buf)
+
+    def add_records(self, records):
+        """Add several new Task Records at once.
+
+        Subclasses should override this if they can add them more efficiently
+        than one at a time.
+        """
+        for rec in records:
+            self.add_record(rec['msg_id'], rec)
+
+    # matching records in memory:
+
+    def _compile_check(self, check):
+        """Turn a check dict into a dict by key of tests for the values."""
+        tests = {}
+        for k,v in iteritems(check):
+            if isinstance(v, dict):
+                tests[k] = CompositeFilter(v)
+            else:
+                tests[k] = lambda o, v=v: o==v
+        return tests
+
+    def _match_one(self, rec, tests):
+        """Check if a specific record matches tests."""
+        for key,test in iteritems(tests):
+            if not test(rec.get(key, None)):
+                return False
+        return True
+
 class DictDB(BaseDB):
     """Basic in-memory dict-based object for saving Task Records.
 
@@ -100,12 +376,15 @@ class DictDB(BaseDB):
     _records = Dict()
     _culled_ids = set() # set of ids which have been culled
     _buffer_bytes = Integer(0) # running total of the bytes in the DB
+    # records in memory don't outlive the db, nor do their blobs
+    _persistent = False
     
     size_limit = Integer(1024**3, config=True,
         help="""The maximum total size (in bytes) of the buffers stored in the db
         
         When the db exceeds this size, the oldest records will be culled until
         the total size is under size_limit * (1-cull_fraction).
+        With a BlobStore, this includes the size of the blobs.
         default: 1 GB
         """
     )
@@ -126,27 +405,106 @@ class DictDB(BaseDB):
         for each of size_limit and record_limit.
         """
     )
+    indexed_keys = List(['msg_id', 'client_uuid', 'engine_uuid', 'submitted', 'completed'],
+        config=True,
+        help="""The record keys on which to keep secondary indexes.
 
-    def _match_one(self, rec, tests):
-        """Check if a specific record matches tests."""
-        for key,test in iteritems(tests):
-            if not test(rec.get(key, None)):
-                return False
-        return True
+        Queries with equality, $in, or (for dates) range checks on these keys
+        only look at the matching records, instead of scanning the whole db.
+        msg_id is always indexed, since records are stored by msg_id.
+        """
+    )
+    _indexes = Dict()
+
+    def __init__(self, **kwargs):
+        super(DictDB, self).__init__(**kwargs)
+        self._build_indexes()
+
+    def _indexed_keys_changed(self, name, old, new):
+        self._build_indexes()
+
+    def _build_indexes(self):
+        self._indexes = {}
+        for key in self.indexed_keys:
+            if key != 'msg_id':
+                self._indexes[key] = RecordIndex(self._value_checker(key))
+        for rec in itervalues(self._records):
+            self._index_record(rec)
+
+    def _index_record(self, rec):
+        for key, index in iteritems(self._indexes):
+            index.add(rec['msg_id'], rec.get(key, None))
+
+    def _unindex_record(self, rec):
+        for key, index in iteritems(self._indexes):
+            index.remove(rec['msg_id'], rec.get(key, None))
+            if index.needs_compaction():
+                index.compact()
+
+    def _value_checker(self, key):
+        """Return a function checking whether a record still has a given value for key."""
+        def is_current(msg_id, value):
+            rec = self._records.get(msg_id, None)
+            return rec is not None and rec.get(key, None) == value
+        return is_current
+
+    def _candidates(self, check):
+        """The msg_ids of a superset of the records matching check,
+        or None if the indexes can't narrow down the query."""
+        best = None
+        for key, spec in iteritems(check):
+            if key == 'msg_id':
+                plan = self._plan_msg_id(spec)
+            elif key in self._indexes:
+                plan = self._indexes[key].plan(spec)
+            else:
+                continue
+            if plan is not None and (best is None or plan[0] < best[0]):
+                best = plan
+        if best is None:
+            return None
+        return best[1]()
+
+    def _plan_msg_id(self, spec):
+        """Plan a lookup by msg_id, which is the key of self._records."""
+        if isinstance(spec, dict):
+            if '$eq' in spec:
+                values = [spec['$eq']]
+            elif '$in' in spec:
+                values = spec['$in']
+            else:
+                return None
+        else:
+            values = [spec]
+        ids = []
+        seen = set()
+        try:
+            for value in values:
+                # a msg_id repeated in $in matches its record only once
+                if value in self._records and value not in seen:
+                    seen.add(value)
+                    ids.append(value)
+        except TypeError:
+            return None
+        return len(ids), lambda : ids
 
     def _match(self, check):
-        """Find all the matches for a check dict."""
+        """Find all the matches for a check dict.
+
+        The records themselves are returned, not copies.
+        """
         matches = []
-        tests = {}
-        for k,v in iteritems(check):
-            if isinstance(v, dict):
-                tests[k] = CompositeFilter(v)
-            else:
-                tests[k] = lambda o: o==v
+        tests = self._compile_check(check)
 
-        for rec in itervalues(self._records):
+        candidates = self._candidates(check)
+        if candidates is None:
+            records = itervalues(self._records)
+        else:
+            records = [ self._records[msg_id] for msg_id in candidates
+                        if msg_id in self._records ]
+        for rec in records:
             if self._match_one(rec, tests):
-                matches.append(copy(rec))
+                matches.append(rec)
         return matches
 
     def _extract_subdict(self, rec, keys):
@@ -154,22 +512,31 @@ def _extract_subdict(self, rec, keys):
         d = {}
         d['msg_id'] = rec['msg_id']
         for key in keys:
-            d[key] = rec[key]
-        return copy(d)
+            d[key] = copy(rec[key])
+        return d
     
     # methods for monitoring size / culling history
     
     def _add_bytes(self, rec):
-        for key in ('buffers', 'result_buffers'):
+        for key in _buffer_keys:
             for buf in rec.get(key) or []:
-                self._buffer_bytes += len(buf)
+                if not isinstance(buf, BlobRef):
+                    self._buffer_bytes += len(buf)
         
         self._maybe_cull()
     
     def _drop_bytes(self, rec):
-        for key in ('buffers', 'result_buffers'):
+        for key in _buffer_keys:
             for buf in rec.get(key) or []:
-                self._buffer_bytes -= len(buf)
+                if not isinstance(buf, BlobRef):
+                    self._buffer_bytes -= len(buf)
+    
+    def _total_bytes(self):
+        """The bytes in buffers held in memory, plus those in the BlobStore"""
+        total = self._buffer_bytes
+        if self.blob_store is not None:
+            total += self.blob_store.size
+        return total
     
     def _cull_oldest(self, n=1):
         """cull the oldest N records"""
@@ -188,13 +555,13 @@ def _maybe_cull(self):
             self._cull_oldest(to_cull)
         
         # cull by size:
-        if self._buffer_bytes > self.size_limit:
+        if self._total_bytes() > self.size_limit:
             limit = self.size_limit * (1 - self.cull_fraction)
             
-            before = self._buffer_bytes
+            before = self._total_bytes()
             before_count = len(self._records)
             culled = 0
-            while self._buffer_bytes > limit:
+            while self._total_bytes() > limit and self._records:
                 self._cull_oldest(1)
                 culled += 1
         
@@ -215,17 +582,35 @@ def add_record(self, msg_id, rec):
         if msg_id in self._records:
             raise KeyError("Already have msg_id %r"%(msg_id))
         self._check_dates(rec)
+        rec = self._store_buffers(rec)
         self._records[msg_id] = rec
+        self._index_record(rec)
         self._add_bytes(rec)
         self._maybe_cull()
 
+    def add_records(self, records):
+        """Add several new Task Records at once.
+
+        No records are added if any of them already exists.
+        """
+        for rec in records:
+            if rec['msg_id'] in self._records:
+                raise KeyError("Already have msg_id %r"%(rec['msg_id']))
+            self._check_dates(rec)
+        for rec in records:
+            rec = self._store_buffers(rec)
+            self._records[rec['msg_id']] = rec
+            self._index_record(rec)
+            self._add_bytes(rec)
+        self._maybe_cull()
+
     def get_record(self, msg_id):
         """Get a specific Task Record, by msg_id."""
         if msg_id in self._culled_ids:
             raise KeyError("Record %r has been culled for size" % msg_id)
         if not msg_id in self._records:
             raise KeyError("No such msg_id %r"%(msg_id))
-        return copy(self._records[msg_id])
+        return self._load_buffers(copy(self._records[msg_id]))
 
     def update_record(self, msg_id, rec):
         """Update the data in an existing record."""
@@ -233,7 +618,18 @@ def update_record(self, msg_id, rec):
             raise KeyError("Record %r has been culled for size" % msg_id)
         self._check_dates(rec)
         _rec = self._records[msg_id]
+        rec = self._store_buffers(rec)
+        self._release_buffers(_rec, [ key for key in _buffer_keys if key in rec ])
         self._drop_bytes(_rec)
+        for key, index in iteritems(self._indexes):
+            if key in rec:
+                old = _rec.get(key, None)
+                new = rec[key]
+                if old is not new and old != new:
+                    index.remove(msg_id, old)
+                    index.add(msg_id, new)
+                    if index.needs_compaction():
+                        index.compact()
         _rec.update(rec)
         self._add_bytes(_rec)
 
@@ -242,13 +638,17 @@ def drop_matching_records(self, check):
         matches = self._match(check)
         for rec in matches:
             self._drop_bytes(rec)
+            self._release_buffers(rec)
             del self._records[rec['msg_id']]
+            self._unindex_record(rec)
 
     def drop_record(self, msg_id):
         """Remove a record from the DB."""
         rec = self._records[msg_id]
         self._drop_bytes(rec)
+        self._release_buffers(rec)
         del self._records[msg_id]
+        self._unindex_record(rec)
 
     def find_records(self, check, keys=None):
         """Find records matching a query dict, optionally extracting subset of keys.
@@ -266,12 +666,20 @@ def find_records(self, check, keys=None):
         """
         matches = self._match(check)
         if keys:
-            return [ self._extract_subdict(rec, keys) for rec in matches ]
+            records = [ self._extract_subdict(rec, keys) for rec in matches ]
         else:
-            return matches
+            records = [ copy(rec) for rec in matches ]
+        if self.blob_store is not None:
+            records = [ self._load_buffers(rec) for rec in records ]
+        return records
 
     def get_history(self):
         """get all msg_ids, ordered by time submitted."""
+        index = self._indexes.get('submitted', None)
+        if index is not None and index.ordered:
+            if index.stale:
+                index.compact()
+            return list(index.ids)
         msg_ids = self._records.keys()
         # Remove any that do not have a submitted timestamp.
         # This is extremely unlikely to happen,
@@ -293,6 +701,7 @@ class NoDB(BaseDB):
     minimize the memory footprint of the Hub when its record-keeping
     functionality is not required.
     """
+    _blobs_supported = False
     
     def add_record(self, msg_id, record):
         pass
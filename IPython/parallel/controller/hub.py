@@ -153,6 +153,11 @@ def _mux_default(self):
     def _task_default(self):
         return tuple(util.select_random_ports(2))
 
+    broadcast = Tuple(Integer,Integer,config=True,
+        help="""Client/Engine Port pair for Broadcast scheduler""")
+    def _broadcast_default(self):
+        return tuple(util.select_random_ports(2))
+
     control = Tuple(Integer,Integer,config=True,
         help="""Client/Engine Port pair for Control queue""")
 
@@ -282,6 +287,7 @@ def init_hub(self):
             'hb_ping'       : self.hb[0],
             'hb_pong'       : self.hb[1],
             'task'          : self.task[1],
+            'broadcast'     : self.broadcast[1],
             'iopub'         : self.iopub[1],
             }
 
@@ -292,6 +298,7 @@ def init_hub(self):
             'mux'           : self.mux[0],
             'task'          : self.task[0],
             'task_scheme'   : scheme,
+            'broadcast'     : self.broadcast[0],
             'iopub'         : self.iopub[0],
             'notification'  : self.notifier_port,
             }
@@ -663,6 +670,20 @@ def save_queue_result(self, idents, msg):
             self.log.error("queue::unknown engine %r is sending a reply: ", queue_id)
             return
 
+        if msg['header']['msg_type'] == 'batch':
+            try:
+                msgs = self.session.unserialize_batch(msg)
+            except Exception:
+                self.log.error("queue::engine %r sent invalid batch to %r: %r",
+                        queue_id, client_id, msg['header'], exc_info=True)
+                return
+        else:
+            msgs = [msg]
+        for msg in msgs:
+            self._save_queue_result(eid, msg)
+
+    def _save_queue_result(self, eid, msg):
+        """Save a single unserialized MUX result."""
         parent = msg['parent_header']
         if not parent:
             return
@@ -711,14 +732,47 @@ def save_task_request(self, idents, msg):
             self.log.error("task::client %r sent invalid task message: %r",
                     client_id, msg, exc_info=True)
             return
+        if msg['header']['msg_type'] == 'batch':
+            return self.save_task_batch(client_id, msg)
+        self._save_task_record(self._init_task_record(msg))
+
+    def save_task_batch(self, client_id, batch):
+        """Save a batch of task submissions.
+
+        The records are added to the db all at once, unless that fails
+        (e.g. iopub arrived first for some of them), in which case they
+        are saved one at a time.
+        """
+        records = []
+        try:
+            for msg in self.session.unserialize_batch(batch):
+                records.append(self._init_task_record(msg))
+        except Exception:
+            self.log.error("task::client %r sent invalid task batch: %r",
+                    client_id, batch['header'], exc_info=True)
+            return
+        try:
+            self.db.add_records(records)
+        except Exception:
+            self.log.debug("Saving %i tasks in batch %r one at a time",
+                    len(records), batch['header']['msg_id'], exc_info=True)
+            for record in records:
+                self._save_task_record(record)
+
+    def _init_task_record(self, msg):
+        """Build the record of a task submission, and mark it pending."""
         record = init_record(msg)
 
         record['client_uuid'] = msg['header']['session']
         record['queue'] = 'task'
-        header = msg['header']
-        msg_id = header['msg_id']
+        msg_id = record['msg_id']
         self.pending.add(msg_id)
         self.unassigned.add(msg_id)
+        return record
+
+    def _save_task_record(self, record):
+        """Save a single task record, merging with any existing record."""
+        msg_id = record['msg_id']
         try:
             # it's posible iopub arrived first:
             existing = self.db.get_record(msg_id)
@@ -762,6 +816,20 @@ def save_task_result(self, idents, msg):
                     client_id, msg, exc_info=True)
             return
 
+        if msg['header']['msg_type'] == 'batch':
+            try:
+                msgs = self.session.unserialize_batch(msg)
+            except Exception:
+                self.log.error("task::invalid task result batch sent to %r: %r",
+                        client_id, msg['header'], exc_info=True)
+                return
+        else:
+            msgs = [msg]
+        for msg in msgs:
+            self._save_task_result(msg)
+
+    def _save_task_result(self, msg):
+        """Save the result of a single completed task."""
         parent = msg['parent_header']
         if not parent:
             # print msg
@@ -1253,7 +1321,7 @@ def finish(reply):
         reply = dict(status='ok')
         try:
             records = self.db.find_records({'msg_id' : {'$in' : msg_ids}}, keys=[
-                'header', 'content', 'buffers'])
+                'header', 'content', 'buffers', 'metadata'])
         except Exception:
             self.log.error('db::db error finding tasks to resubmit', exc_info=True)
             return finish(error.wrap_exception())
@@ -1285,6 +1353,13 @@ def finish(reply):
             # except Exception:
             #     return finish(error.wrap_exception())
 
+        # copies of a broadcast request share the buffers of the first copy
+        try:
+            self._fetch_broadcast_buffers(records)
+        except Exception:
+            self.log.exception("Failed to resubmit task")
+            return finish(error.wrap_exception())
+
         # mapping of original IDs to resubmitted IDs
         resubmitted = {}
 
@@ -1322,6 +1397,29 @@ def finish(reply):
                 self.log.error("db::DB Error updating record: %s", msg_id, exc_info=True)
 
 
+    def _fetch_broadcast_buffers(self, records):
+        """Fill in the buffers of copies of broadcast requests.
+
+        The Hub only gets the buffers of a broadcast request with its first copy.
+        The records of the others have the msg_id of that one in their
+        metadata, as 'buffers_from'.
+        """
+        sources = {}
+        for rec in records:
+            source = (rec['metadata'] or {}).get('buffers_from')
+            if source and not rec['buffers']:
+                sources.setdefault(source, []).append(rec)
+        if not sources:
+            return
+        found = self.db.find_records({'msg_id' : {'$in' : list(sources)}},
+            keys=['buffers'])
+        for source_rec in found:
+            for rec in sources.pop(source_rec['msg_id']):
+                rec['buffers'] = source_rec['buffers']
+        if sources:
+            raise KeyError("Buffers of broadcast request(s) %r are no longer "
+                "in the database" % sorted(sources))
+
     def _extract_record(self, rec):
         """decompose a TaskRecord dict into subsection of reply for get_result"""
         io_dict = {}
@@ -1337,7 +1435,8 @@ def _extract_record(self, rec):
             'io' : io_dict,
         }
         if rec['result_buffers']:
-            buffers = list(map(bytes, rec['result_buffers']))
+            # not copied to bytes, since they may be mapped from the BlobStore
+            buffers = list(rec['result_buffers'])
         else:
             buffers = []
 
@@ -46,6 +46,8 @@ class MongoDB(BaseDB):
         get_result methods.""")
 
     _connection = Instance(Connection) # pymongo connection
+    # records must be BSON documents, and mongodb already stores binary data well
+    _blobs_supported = False
     
     def __init__(self, **kwargs):
         super(MongoDB, self).__init__(**kwargs)
@@ -70,6 +72,11 @@ def add_record(self, msg_id, rec):
         # print rec
         rec = self._binary_buffers(rec)
         self._records.insert(rec)
+
+    def add_records(self, records):
+        """Add several new Task Records at once, with a single insert."""
+        if records:
+            self._records.insert([ self._binary_buffers(rec) for rec in records ])
     
     def get_record(self, msg_id):
         """Get a specific Task Record, by msg_id."""
@@ -19,11 +19,12 @@
 # Imports
 #----------------------------------------------------------------------
 
+import heapq
 import logging
 import sys
 import time
 
-from collections import deque
+from collections import deque, OrderedDict
 from datetime import datetime
 from random import randint, random
 from types import FunctionType
@@ -40,6 +41,7 @@
 from IPython.external.decorator import decorator
 from IPython.config.application import Application
 from IPython.config.loader import Config
+from IPython.kernel.zmq.session import DELIM
 from IPython.utils.traitlets import Instance, Dict, List, Set, Integer, Enum, CBytes
 from IPython.utils.py3compat import cast_bytes
 
@@ -117,6 +119,123 @@ def leastload(loads):
     """
     return loads.index(min(loads))
 
+class LoadIndex(object):
+    """An indexed priority queue of engine loads.
+
+    Engines are ordered by ``(load, lru)``, where ``lru`` increases each time
+    an engine is assigned a job, so ties between equally loaded engines go to
+    the least recently used one.  This is the same choice `leastload` makes
+    by scanning the LRU-ordered loads list, but the least loaded engine is
+    found in O(1), and updates cost O(log n).
+
+    Stale heap entries are invalidated lazily, and the heap is rebuilt
+    when they outnumber the live ones.  Each entry also has a sequence
+    number, unique to the entry, so that a stale entry and a live one
+    with the same load and lru never compare by ident.  The LRU order itself is kept
+    in an OrderedDict, for the schemes that need the whole loads list.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._entries = {} # dict by engine ident of [load, lru, seq, ident]
+        self._order = OrderedDict() # engine idents, least recently used first
+        self._counts = {} # dict by load of the number of engines with that load
+        self._next_lru = 0 # increases as engines are used
+        self._next_head = -1 # decreases as engines are registered
+        self._next_seq = 0 # increases with each entry pushed
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, uid):
+        return uid in self._entries
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def add(self, uid, load=0):
+        """Add a new engine at the head of the line."""
+        lru = self._next_head
+        self._next_head -= 1
+        self._push(uid, load, lru)
+        # registration is rare, so rebuilding the order here is fine
+        order = OrderedDict([(uid, None)])
+        order.update(self._order)
+        self._order = order
+
+    def remove(self, uid):
+        """Remove an engine."""
+        entry = self._entries.pop(uid)
+        self._invalidate(entry)
+        del self._order[uid]
+
+    def update(self, uid, load, used=False):
+        """Set the load of an engine.
+
+        If `used`, the engine also moves to the back of the line.
+        """
+        entry = self._entries[uid]
+        if used:
+            lru = self._next_lru
+            self._next_lru += 1
+            # move to the back of the line
+            self._order[uid] = self._order.pop(uid)
+        elif entry[0] == load:
+            return
+        else:
+            lru = entry[1]
+        self._invalidate(entry)
+        self._push(uid, load, lru)
+
+    def least_loaded(self):
+        """Return (load, ident) of the least loaded engine, or None if empty."""
+        heap = self._heap
+        while heap and heap[0][3] is None:
+            heapq.heappop(heap)
+        if not heap:
+            return None
+        load, lru, seq, uid = heap[0]
+        return load, uid
+
+    def load(self, uid):
+        """The current load of an engine."""
+        return self._entries[uid][0]
+
+    def count(self, load):
+        """The number of engines with a given load."""
+        return self._counts.get(load, 0)
+
+    def lru_order(self):
+        """Return a list of (ident, load) for every engine,
+        least recently used first.
+
+        This is the order of the loads list the other schemes expect.
+        The order is kept up to date as engines are used, so this is
+        a single O(n) pass, like walking the old loads list.
+        """
+        entries = self._entries
+        return [ (uid, entries[uid][0]) for uid in self._order ]
+
+    def _push(self, uid, load, lru):
+        entry = [load, lru, self._next_seq, uid]
+        self._next_seq += 1
+        self._entries[uid] = entry
+        self._counts[load] = self._counts.get(load, 0) + 1
+        heapq.heappush(self._heap, entry)
+        if len(self._heap) > 2 * len(self._entries) + 16:
+            # too many stale entries, rebuild
+            self._heap = list(self._entries.values())
+            heapq.heapify(self._heap)
+
+    def _invalidate(self, entry):
+        # seq is unique, so entries never compare by ident,
+        # and the ident can be cleared in place to mark the entry as stale
+        entry[3] = None
+        load = entry[0]
+        self._counts[load] -= 1
+        if not self._counts[load]:
+            del self._counts[load]
+
 #---------------------------------------------------------------------
 # Classes
 #---------------------------------------------------------------------
@@ -141,10 +260,12 @@ def __init__(self, msg_id, raw_msg, idents, msg, header, metadata,
         self.follow = follow
         self.timeout = timeout
         
-        self.removed = False # used for lazy-delete from sorted queue
+        self.removed = False # used for lazy-delete from the ready queues
         self.timestamp = time.time()
         self.timeout_id = 0
         self.blacklist = set()
+        self.unmet = 0 # number of dependencies that have not finished
+        self.ready_id = 0 # invalidates stale entries in the ready queues
 
     def __lt__(self, other):
         return self.timestamp < other.timestamp
@@ -156,6 +277,24 @@ def __cmp__(self, other):
     def dependents(self):
         return self.follow.union(self.after)
 
+    def blocked_after(self, dep_id, success):
+        """Whether this job is certainly still blocked after `dep_id` finished.
+
+        True if `dep_id` satisfied every dependency it belongs to, and some
+        other all-dependency is still unfinished, so that the full
+        (unreachable, check) pass can be skipped.
+        """
+        if not self.unmet:
+            return False
+        for dep in (self.after, self.follow):
+            if not dep:
+                continue
+            if not dep.all:
+                return False
+            if dep_id in dep and not (dep.success if success else dep.failure):
+                return False
+        return True
+
 
 class TaskScheduler(SessionFactory):
     """Python TaskScheduler object.
@@ -201,11 +340,12 @@ def _scheme_default(self):
     query_stream = Instance(zmqstream.ZMQStream) # hub-facing DEALER stream
 
     # internals:
-    queue = Instance(deque) # sorted list of Jobs
-    def _queue_default(self):
-        return deque()
-    queue_map = Dict() # dict by msg_id of Jobs (for O(1) access to the Queue)
+    queue_map = Dict() # dict by msg_id of waiting Jobs
     graph = Dict() # dict by msg_id of [ msg_ids that depend on key ]
+    ready = Instance(deque) # queue of Jobs with met time deps that can run anywhere
+    def _ready_default(self):
+        return deque()
+    ready_for = Dict() # dict by engine_uuid of queues of Jobs that can only run there
     retries = Dict() # dict by msg_id of retries remaining (non-neg ints)
     # waiting = List() # list of msg_ids ready to run, but haven't due to HWM
     pending = Dict() # dict by engine_uuid of submitted tasks
@@ -213,6 +353,10 @@ def _queue_default(self):
     failed = Dict() # dict by engine_uuid of failed tasks
     destinations = Dict() # dict by msg_id of engine_uuids where jobs ran (reverse of completed+failed)
     clients = Dict() # dict by msg_id for who submitted the task
+    load_index = Instance(LoadIndex) # heap of engine loads and LRU order, by IDENT
+    def _load_index_default(self):
+        return LoadIndex()
+    # only kept for subclasses that override the index-based add_job/finish_job:
     targets = List() # list of target IDENTs
     loads = List() # list of engine loads
     # full = Set() # set of IDENTs that have HWM outstanding tasks
@@ -226,6 +370,19 @@ def _queue_default(self):
     def _ident_default(self):
         return self.session.bsession
 
+    def __init__(self, **kwargs):
+        super(TaskScheduler, self).__init__(**kwargs)
+        self._index_hooks = self._overrides('add_job') or self._overrides('finish_job')
+
+    def _overrides(self, name):
+        """Whether a subclass overrides the TaskScheduler method `name`."""
+        for cls in type(self).__mro__:
+            if cls is TaskScheduler:
+                return False
+            if name in vars(cls):
+                return True
+        return False
+
     def start(self):
         self.query_stream.on_recv(self.dispatch_query_reply)
         self.session.send(self.query_stream, "connection_request", {})
@@ -300,20 +457,25 @@ def dispatch_notification(self, msg):
     def _register_engine(self, uid):
         """New engine with ident `uid` became available."""
         # head of the line:
-        self.targets.insert(0,uid)
-        self.loads.insert(0,0)
+        self.load_index.add(uid)
+        if self._index_hooks:
+            self.targets.insert(0,uid)
+            self.loads.insert(0,0)
 
         # initialize sets
         self.completed[uid] = set()
         self.failed[uid] = set()
         self.pending[uid] = {}
 
-        # rescan the graph:
-        self.update_graph(None)
+        # give the new engine any work that was waiting for one:
+        self.run_ready(uid)
+        if self.ready_for:
+            # jobs restricted to other engines may be allowed on this one
+            self.update_graph(None)
 
     def _unregister_engine(self, uid):
         """Existing engine with ident `uid` became unavailable."""
-        if len(self.targets) == 1:
+        if len(self.load_index) == 1:
             # this was our only engine
             pass
 
@@ -325,9 +487,15 @@ def _unregister_engine(self, uid):
         # map(self.destinations.pop, self.failed.pop(uid))
 
         # prevent this engine from receiving work
-        idx = self.targets.index(uid)
-        self.targets.pop(idx)
-        self.loads.pop(idx)
+        self.load_index.remove(uid)
+        if self._index_hooks:
+            idx = self.targets.index(uid)
+            self.targets.pop(idx)
+            self.loads.pop(idx)
+
+        # jobs that could only run here may have become impossible
+        for job in self._live_ready(self.ready_for.pop(uid, [])):
+            self.check_job(job)
 
         # wait 5 seconds before cleaning up pending jobs, since the results might
         # still be incoming
@@ -394,6 +562,33 @@ def dispatch_submission(self, raw_msg):
         # send to monitor
         self.mon_stream.send_multipart([b'intask']+raw_msg, copy=False)
 
+        if msg['header']['msg_type'] == 'batch':
+            return self.dispatch_batch(raw_msg, idents, msg)
+        self.dispatch_job(raw_msg, idents, msg)
+
+    def dispatch_batch(self, raw_msg, idents, batch):
+        """Split a batch of submissions, and dispatch each of them as a job.
+
+        The batch itself has already been authenticated, and split_batch
+        checks the signature of each part, so the parts are not verified again.
+        """
+        try:
+            parts = self.session.split_batch(batch, copy=False)
+        except Exception:
+            self.log.error("task::Invalid task batch: %r", batch['header'], exc_info=True)
+            return
+        prefix = raw_msg[:len(idents)] + [zmq.Frame(DELIM)]
+        for msg_list in parts:
+            try:
+                msg = self.session.unserialize(list(msg_list), content=False,
+                                                copy=False, verify=False)
+            except Exception:
+                self.log.error("task::Invalid task in batch: %r", batch['header'], exc_info=True)
+                continue
+            self.dispatch_job(prefix + msg_list, idents, msg)
+
+    def dispatch_job(self, raw_msg, idents, msg):
+        """Create a Job for a single unserialized submission, and schedule it."""
         header = msg['header']
         md = msg['metadata']
         msg_id = header['msg_id']
@@ -490,11 +685,11 @@ def fail_unreachable(self, msg_id, why=error.ImpossibleDependency):
             self.log.error("task %r already failed!", msg_id)
             return
         job = self.queue_map.pop(msg_id)
-        # lazy-delete from the queue
+        # lazy-delete from the ready queues
         job.removed = True
         for mid in job.dependents:
             if mid in self.graph:
-                self.graph[mid].remove(msg_id)
+                self.graph[mid].discard(msg_id)
 
         try:
             raise why()
@@ -511,32 +706,39 @@ def fail_unreachable(self, msg_id, why=error.ImpossibleDependency):
 
         self.update_graph(msg_id, success=False)
 
-    def available_engines(self):
-        """return a list of available engine indices based on HWM"""
+    def engines_available(self):
+        """return whether any engine can accept a task based on HWM"""
+        if not self.load_index:
+            return False
         if not self.hwm:
-            return list(range(len(self.targets)))
-        available = []
-        for idx in range(len(self.targets)):
-            if self.loads[idx] < self.hwm:
-                available.append(idx)
-        return available
+            return True
+        return self.load_index.least_loaded()[0] < self.hwm
+
+    def engine_loads(self):
+        """return a list of (IDENT, load) for every engine, in LRU order"""
+        if self._index_hooks:
+            return list(zip(self.targets, self.loads))
+        return self.load_index.lru_order()
+
+    def available_engines(self):
+        """return a list of available engine IDENTs based on HWM, in LRU order"""
+        return [ uid for uid, load in self.engine_loads()
+                if not self.hwm or load < self.hwm ]
 
     def maybe_run(self, job):
         """check location dependencies, and run if they are met."""
         msg_id = job.msg_id
         self.log.debug("Attempting to assign task %s", msg_id)
-        available = self.available_engines()
-        if not available:
+        if not self.engines_available():
             # no engines, definitely can't run
             return False
         
-        if job.follow or job.targets or job.blacklist or self.hwm:
+        # leastload picks from the load index, which already respects HWM
+        use_index = self.scheme is leastload and not self._index_hooks
+        if job.follow or job.targets or job.blacklist or (self.hwm and not use_index):
             # we need a can_run filter
-            def can_run(idx):
-                # check hwm
-                if self.hwm and self.loads[idx] == self.hwm:
-                    return False
-                target = self.targets[idx]
+            available = self.available_engines()
+            def can_run(target):
                 # check blacklist
                 if target in job.blacklist:
                     return False
@@ -546,9 +748,9 @@ def can_run(idx):
                 # check follow
                 return job.follow.check(self.completed[target], self.failed[target])
 
-            indices = list(filter(can_run, available))
+            targets = list(filter(can_run, available))
 
-            if not indices:
+            if not targets:
                 # couldn't run
                 if job.follow.all:
                     # check follow for impossibility
@@ -567,15 +769,15 @@ def can_run(idx):
                 if job.targets:
                     # check blacklist+targets for impossibility
                     job.targets.difference_update(job.blacklist)
-                    if not job.targets or not job.targets.intersection(self.targets):
+                    if not job.targets or not job.targets.intersection(self.load_index):
                         self.queue_map[msg_id] = job
                         self.fail_unreachable(msg_id)
                         return False
                 return False
         else:
-            indices = None
+            targets = None
 
-        self.submit_task(job, indices)
+        self.submit_task(job, targets)
         return True
 
     def save_unmet(self, job):
@@ -583,13 +785,18 @@ def save_unmet(self, job):
         msg_id = job.msg_id
         self.log.debug("Adding task %s to the queue", msg_id)
         self.queue_map[msg_id] = job
-        self.queue.append(job)
         # track the ids in follow or after, but not those already finished
-        for dep_id in job.after.union(job.follow).difference(self.all_done):
+        unmet = job.after.union(job.follow).difference(self.all_done)
+        job.unmet = len(unmet)
+        for dep_id in unmet:
             if dep_id not in self.graph:
                 self.graph[dep_id] = set()
             self.graph[dep_id].add(msg_id)
         
+        if job.after.check(self.all_completed, self.all_failed):
+            # only waiting for an engine
+            self.save_ready(job)
+
         # schedule timeout callback
         if job.timeout:
             timeout_id = job.timeout_id = job.timeout_id + 1
@@ -598,22 +805,27 @@ def save_unmet(self, job):
             )
         
 
-    def submit_task(self, job, indices=None):
-        """Submit a task to any of a subset of our targets."""
-        if indices:
-            loads = [self.loads[i] for i in indices]
+    def submit_task(self, job, targets=None):
+        """Submit a task to any of a subset of our targets.
+
+        `targets` is a list of engine IDENTs, in LRU order.
+        """
+        if not targets and self.scheme is leastload and not self._index_hooks:
+            # no filter, so the head of the load index is the leastload choice
+            target = self.load_index.least_loaded()[1]
         else:
-            loads = self.loads
-        idx = self.scheme(loads)
-        if indices:
-            idx = indices[idx]
-        target = self.targets[idx]
+            if targets:
+                loads = [ self.load_index.load(t) for t in targets ]
+            else:
+                targets, loads = zip(*self.engine_loads())
+                loads = list(loads)
+            target = targets[self.scheme(loads)]
         # print (target, map(str, msg[:3]))
         # send job to the engine
         self.engine_stream.send(target, flags=zmq.SNDMORE, copy=False)
         self.engine_stream.send_multipart(job.raw_msg, copy=False)
         # update load
-        self.add_job(idx)
+        self._add_job(target)
         self.pending[target][job.msg_id] = job
         # notify Hub
         content = dict(msg_id=job.msg_id, engine_id=target.decode('ascii'))
@@ -632,16 +844,40 @@ def dispatch_result(self, raw_msg):
         try:
             idents,msg = self.session.feed_identities(raw_msg, copy=False)
             msg = self.session.unserialize(msg, content=False, copy=False)
-            engine = idents[0]
-            try:
-                idx = self.targets.index(engine)
-            except ValueError:
-                pass # skip load-update for dead engines
-            else:
-                self.finish_job(idx)
         except Exception:
             self.log.error("task::Invalid result: %r", raw_msg, exc_info=True)
             return
+        if msg['header']['msg_type'] == 'batch':
+            return self.dispatch_result_batch(raw_msg, idents, msg)
+        self.dispatch_reply(raw_msg, idents, msg)
+
+    def dispatch_result_batch(self, raw_msg, idents, batch):
+        """Split a batch of results from an engine, and dispatch each of them.
+
+        As with submissions, split_batch checks the signature of each part,
+        so the parts are not verified again.
+        """
+        try:
+            parts = self.session.split_batch(batch, copy=False)
+        except Exception:
+            self.log.error("task::Invalid result batch: %r", batch['header'], exc_info=True)
+            return
+        prefix = raw_msg[:len(idents)] + [zmq.Frame(DELIM)]
+        for msg_list in parts:
+            try:
+                msg = self.session.unserialize(list(msg_list), content=False,
+                                                copy=False, verify=False)
+            except Exception:
+                self.log.error("task::Invalid result in batch: %r", batch['header'], exc_info=True)
+                continue
+            self.dispatch_reply(prefix + msg_list, idents, msg)
+
+    def dispatch_reply(self, raw_msg, idents, msg):
+        """Handle a single unserialized result reply."""
+        engine = idents[0]
+        if engine in self.load_index:
+            self._finish_job(engine)
+        # else skip load-update for dead engines
 
         md = msg['metadata']
         parent = msg['parent_header']
@@ -662,6 +898,10 @@ def dispatch_result(self, raw_msg):
         else:
             self.handle_unmet_dependency(idents, parent)
 
+        # the engine has room for another job
+        if engine in self.load_index:
+            self.run_ready(engine)
+
     def handle_result(self, idents, parent, raw_msg, success=True):
         """handle a real task result, either success or failure"""
         # first, relay result to client
@@ -702,86 +942,200 @@ def handle_unmet_dependency(self, idents, parent):
                 # put it back in our dependency tree
                 self.save_unmet(job)
 
-        if self.hwm:
-            try:
-                idx = self.targets.index(engine)
-            except ValueError:
-                pass # skip load-update for dead engines
-            else:
-                if self.loads[idx] == self.hwm-1:
-                    self.update_graph(None)
-
     def update_graph(self, dep_id=None, success=True):
         """dep_id just finished. Update our dependency
         graph and submit any jobs that just became runnable.
 
-        Called with dep_id=None to update entire graph for hwm, but without finishing a task.
+        Only the direct dependents of dep_id are checked.
+        Called with dep_id=None to recheck every waiting job, without finishing a task.
         """
-        # print ("\n\n***********")
-        # pprint (dep_id)
-        # pprint (self.graph)
-        # pprint (self.queue_map)
-        # pprint (self.all_completed)
-        # pprint (self.all_failed)
-        # print ("\n\n***********\n\n")
-        # update any jobs that depended on the dependency
-        msg_ids = self.graph.pop(dep_id, [])
-
-        # recheck *all* jobs if
-        # a) we have HWM and an engine just become no longer full
-        # or b) dep_id was given as None
-        
-        if dep_id is None or self.hwm and any( [ load==self.hwm-1 for load in self.loads ]):
-            jobs = self.queue
-            using_queue = True
+        if dep_id is None:
+            jobs = sorted(self.queue_map.values())
         else:
-            using_queue = False
-            jobs = deque(sorted( self.queue_map[msg_id] for msg_id in msg_ids ))
-        
-        to_restore = []
-        while jobs:
-            job = jobs.popleft()
-            if job.removed:
+            jobs = []
+            for msg_id in self.graph.pop(dep_id, []):
+                job = self.queue_map[msg_id]
+                job.unmet -= 1
+                if not job.blocked_after(dep_id, success):
+                    jobs.append(job)
+            jobs.sort()
+
+        for job in jobs:
+            if job.removed or job.msg_id not in self.queue_map:
+                # failed or run while handling an earlier job
                 continue
-            msg_id = job.msg_id
-            
-            put_it_back = True
-            
-            if job.after.unreachable(self.all_completed, self.all_failed)\
-                    or job.follow.unreachable(self.all_completed, self.all_failed):
-                self.fail_unreachable(msg_id)
-                put_it_back = False
-
-            elif job.after.check(self.all_completed, self.all_failed): # time deps met, maybe run
-                if self.maybe_run(job):
-                    put_it_back = False
-                    self.queue_map.pop(msg_id)
-                    for mid in job.dependents:
-                        if mid in self.graph:
-                            self.graph[mid].remove(msg_id)
-                    
-                    # abort the loop if we just filled up all of our engines.
-                    # avoids an O(N) operation in situation of full queue,
-                    # where graph update is triggered as soon as an engine becomes
-                    # non-full, and all tasks after the first are checked,
-                    # even though they can't run.
-                    if not self.available_engines():
-                        break
-            
-            if using_queue and put_it_back:
-                # popped a job from the queue but it neither ran nor failed,
-                # so we need to put it back when we are done
-                # make sure to_restore preserves the same ordering
-                to_restore.append(job)
-        
-        # put back any tasks we popped but didn't run
-        if using_queue:
-            self.queue.extendleft(to_restore)
-    
+            self.check_job(job)
+            # when rechecking everything, abort the loop if we just filled up
+            # all of our engines. Jobs left unchecked are already in the graph
+            # or the ready queues. Direct dependents must all be checked,
+            # so that those that just became ready get indexed.
+            if dep_id is None and not self.engines_available():
+                break
+
+    def check_job(self, job):
+        """Check a waiting job's dependencies, and run it if they are met.
+
+        Returns whether the job was submitted.
+        """
+        msg_id = job.msg_id
+        if job.after.unreachable(self.all_completed, self.all_failed)\
+                or job.follow.unreachable(self.all_completed, self.all_failed):
+            self.fail_unreachable(msg_id)
+            return False
+
+        if not job.after.check(self.all_completed, self.all_failed):
+            # still waiting on time deps, which the graph tracks
+            return False
+
+        if self.maybe_run(job):
+            self.queue_map.pop(msg_id)
+            # invalidate any entries in the ready queues
+            job.ready_id += 1
+            for mid in job.dependents:
+                if mid in self.graph:
+                    self.graph[mid].discard(msg_id)
+            return True
+        elif msg_id in self.queue_map:
+            # didn't fail, but can't run yet
+            self.save_ready(job)
+        return False
+
+    #-----------------------------------------------------------------------
+    # Ready Queues
+    #-----------------------------------------------------------------------
+
+    def ready_engines(self, job):
+        """Return the set of engines a job may run on,
+        or None if it may run on any engine.
+        """
+        engines = None
+        if job.targets:
+            engines = job.targets
+        if job.follow:
+            follow = job.follow
+            dests = set()
+            for m in follow:
+                if m in self.destinations:
+                    dests.add(self.destinations[m])
+            followed = set()
+            for engine in dests:
+                if engine in self.completed and \
+                        follow.check(self.completed[engine], self.failed[engine]):
+                    followed.add(engine)
+            engines = followed if engines is None else engines.intersection(followed)
+        if engines is not None:
+            engines = set(e for e in engines
+                if e in self.load_index and e not in job.blacklist)
+        return engines
+
+    def save_ready(self, job):
+        """Index a job whose time dependencies are met, but is waiting
+        for an engine that can run it.
+        """
+        job.ready_id += 1
+        entry = (job.ready_id, job)
+        engines = self.ready_engines(job)
+        if engines is None:
+            self.ready.append(entry)
+        elif not engines and job.targets and \
+                not job.targets.difference(job.blacklist).intersection(self.load_index):
+            # none of the requested engines are left
+            self.fail_unreachable(job.msg_id)
+        else:
+            # no engines means waiting on location deps, which the graph tracks
+            for engine in engines:
+                if engine not in self.ready_for:
+                    self.ready_for[engine] = deque()
+                self.ready_for[engine].append(entry)
+
+    def _live_ready(self, entries):
+        """Filter stale entries out of a ready queue."""
+        return [ job for ready_id, job in entries
+                if job.ready_id == ready_id and not job.removed ]
+
+    def _trim_ready(self, queue):
+        """Drop stale entries from the head of a ready queue."""
+        while queue:
+            ready_id, job = queue[0]
+            if job.ready_id == ready_id and not job.removed:
+                break
+            queue.popleft()
+
+    def _next_ready(self, queue, engine):
+        """Return the oldest live job in a ready queue that engine may run.
+
+        Stale entries are dropped from the head of the queue.
+        """
+        self._trim_ready(queue)
+        for ready_id, job in queue:
+            if job.ready_id != ready_id or job.removed:
+                continue
+            if engine in job.blacklist:
+                # should be rare, only on resubmission
+                continue
+            return job
+        return None
+
+    def run_ready(self, engine):
+        """Submit ready jobs that `engine` may run, while it has room.
+
+        Only the heads of the shared ready queue and of `engine`'s own
+        queue are considered, so this does not scan waiting jobs.
+        """
+        own = self.ready_for.get(engine)
+        while not self.hwm or self.load_index.load(engine) < self.hwm:
+            job = self._next_ready(self.ready, engine)
+            if own:
+                mine = self._next_ready(own, engine)
+                if mine is not None and (job is None or mine < job):
+                    job = mine
+            if job is None:
+                break
+            if not self.check_job(job):
+                # avoid spinning on a job that can't run
+                break
+        # the jobs just submitted left stale entries behind
+        self._trim_ready(self.ready)
+        if own is not None:
+            self._trim_ready(own)
+            if not own:
+                self.ready_for.pop(engine, None)
+
+    #----------------------------------------------------------------------
+    # Load Tracking
+    #----------------------------------------------------------------------
+
+    def _add_job(self, target):
+        """The engine `target` just got a job."""
+        if self._index_hooks:
+            self.add_job(self.targets.index(target))
+            self._sync_load(target)
+        else:
+            load = self.load_index.load(target) + 1
+            self.load_index.update(target, load, used=True)
+
+    def _finish_job(self, target):
+        """The engine `target` just finished a job."""
+        if self._index_hooks:
+            self.finish_job(self.targets.index(target))
+            self._sync_load(target)
+        else:
+            load = self.load_index.load(target) - 1
+            self.load_index.update(target, load)
+
+    def _sync_load(self, target):
+        """Copy the load a subclass's hooks gave `target` into the load index."""
+        load = self.loads[self.targets.index(target)]
+        self.load_index.update(target, load)
+
     #----------------------------------------------------------------------
     # methods to be overridden by subclasses
     #----------------------------------------------------------------------
 
+    # The targets and loads lists are only kept, and these hooks only called,
+    # when a subclass overrides add_job or finish_job. Otherwise the
+    # load index is updated directly, so that dispatch is O(log n).
+
     def add_job(self, idx):
         """Called after self.targets[idx] just got the job with header.
         Override with subclasses.  The default ordering is simple LRU.
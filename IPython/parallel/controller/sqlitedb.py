@@ -13,6 +13,7 @@
 
 import json
 import os
+from copy import deepcopy
 try:
     import cPickle as pickle
 except ImportError:
@@ -26,7 +27,8 @@
 
 from zmq.eventloop import ioloop
 
-from IPython.utils.traitlets import Unicode, Instance, List, Dict
+from IPython.utils.traitlets import Unicode, Instance, List, Dict, Bool, Float, Integer
+from .blobstore import BlobRef
 from .dictdb import BaseDB
 from IPython.utils.jsonutil import date_default, extract_dates, squash_dates
 from IPython.utils.py3compat import iteritems
@@ -75,8 +77,10 @@ def _convert_dict(ds):
 def _adapt_bufs(bufs):
     # this is *horrible*
     # copy buffers into single list and pickle it:
-    if bufs and isinstance(bufs[0], (bytes, buffer)):
-        return sqlite3.Binary(pickle.dumps(list(map(bytes, bufs)),-1))
+    if bufs and isinstance(bufs[0], (bytes, buffer, BlobRef)):
+        # BlobRefs are pickled in place of the buffers they refer to
+        bufs = [ buf if isinstance(buf, BlobRef) else bytes(buf) for buf in bufs ]
+        return sqlite3.Binary(pickle.dumps(bufs,-1))
     elif bufs:
         return bufs
     else:
@@ -105,6 +109,22 @@ class SQLiteDB(BaseDB):
         a new table will be created with the Hub's IDENT.  Specifying the table will result
         in tasks from previous sessions being available via Clients' db_query and
         get_result methods.""")
+    write_behind = Bool(False, config=True,
+        help="""Queue record inserts and updates, and write them in a single
+        transaction every flush_interval seconds, or as soon as flush_size
+        records are pending. This also enables WAL journaling.
+
+        Queries made through find_records write the pending records first,
+        if any of them could match, so they always see every record.
+        A crash can lose the records written in the last flush_interval,
+        much as it could lose the last two seconds of uncommitted records
+        without write-behind.""")
+    flush_interval = Float(0.1, config=True,
+        help="""The interval (in seconds) at which pending records are written,
+        when write_behind is enabled.""")
+    flush_size = Integer(1000, config=True,
+        help="""The number of pending records which triggers an immediate write,
+        when write_behind is enabled.""")
 
     if sqlite3 is not None:
         _db = Instance('sqlite3.Connection')
@@ -158,6 +178,8 @@ class SQLiteDB(BaseDB):
             'stdout' : 'text',
             'stderr' : 'text',
         })
+    # write_behind queue of {msg_id : (is_insert, record or partial record)}
+    _pending = Dict()
 
     def __init__(self, **kwargs):
         super(SQLiteDB, self).__init__(**kwargs)
@@ -178,12 +200,20 @@ def __init__(self, **kwargs):
             else:
                 self.location = u'.'
         self._init_db()
+        if self.blob_store is not None:
+            self._adopt_blobs(self._stored_buffers())
 
-        # register db commit as 2s periodic callback
-        # to prevent clogging pipes
-        # assumes we are being run in a zmq ioloop app
         loop = ioloop.IOLoop.instance()
-        pc = ioloop.PeriodicCallback(self._db.commit, 2000, loop)
+        if self.write_behind:
+            # WAL makes each flush's commit cheap, and lets queries read during it
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            pc = ioloop.PeriodicCallback(self.flush, 1000 * self.flush_interval, loop)
+        else:
+            # register db commit as 2s periodic callback
+            # to prevent clogging pipes
+            # assumes we are being run in a zmq ioloop app
+            pc = ioloop.PeriodicCallback(self._db.commit, 2000, loop)
         pc.start()
 
     def _defaults(self, keys=None):
@@ -214,7 +244,8 @@ def _check_table(self):
             self.log.warn('keys mismatch')
             return False
         for key in self._keys:
-            if types[key] != self._types[key]:
+            # sqlite may report the declared types in upper case
+            if types[key].lower() != self._types[key]:
                 self.log.warn(
                     'type mismatch: %s: %s != %s'%(key,types[key],self._types[key])
                 )
@@ -271,6 +302,17 @@ def _init_db(self):
                 """%self.table)
         self._db.commit()
 
+    def _blob_store_name(self):
+        """Blobs are kept per db file and table, like the records referring to them."""
+        table = self.table or '_'+self.session.replace('-','_')
+        return u'%s-%s' % (os.path.splitext(self.filename)[0], table)
+
+    def _stored_buffers(self):
+        """Yield the buffers of every record in the table, as dicts by buffer key."""
+        query = """SELECT buffers, result_buffers FROM '%s'"""%self.table
+        for line in self._db.execute(query):
+            yield dict(zip(('buffers', 'result_buffers'), line))
+
     def _dict_to_list(self, d):
         """turn a mongodb-style record dict into a list."""
 
@@ -330,50 +372,197 @@ def _render_expression(self, check):
         expr = " AND ".join(expressions)
         return expr, args
 
+    def _insert_query(self):
+        tups = '(%s)'%(','.join(['?']*len(self._keys)))
+        return "INSERT INTO '%s' VALUES %s"%(self.table, tups)
+
+    def _update_query(self, keys):
+        sets = [ '%s = ?'%key for key in keys ]
+        return "UPDATE '%s' SET %s WHERE msg_id == ?"%(self.table, ', '.join(sets))
+
+    def _check_unique(self, msg_ids):
+        """Raise IntegrityError if any of msg_ids is pending or already stored,
+        as the INSERT would without write_behind."""
+        if len(set(msg_ids)) < len(msg_ids):
+            raise sqlite3.IntegrityError("msg_ids are not unique")
+        for msg_id in msg_ids:
+            if msg_id in self._pending:
+                raise sqlite3.IntegrityError("msg_id %r is not unique" % msg_id)
+        # stay well under sqlite's limit of 999 parameters per query
+        for i in range(0, len(msg_ids), 500):
+            chunk = msg_ids[i:i+500]
+            query = """SELECT msg_id FROM '%s' WHERE msg_id IN (%s)"""%(
+                self.table, ','.join(['?']*len(chunk)))
+            line = self._db.execute(query, chunk).fetchone()
+            if line is not None:
+                raise sqlite3.IntegrityError("msg_id %r is not unique" % line[0])
+
+    def _queue_insert(self, msg_id, d):
+        self._pending[msg_id] = (True, d)
+
+    def _maybe_flush(self):
+        if len(self._pending) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        """Write pending records to the database, in a single transaction.
+
+        Only used with write_behind.
+        """
+        if not self._pending:
+            return
+        pending = self._pending
+        self._pending = {}
+        inserts = []
+        updates = {}
+        for msg_id, (is_insert, d) in iteritems(pending):
+            if is_insert:
+                inserts.append(self._dict_to_list(d))
+            else:
+                keys = tuple(sorted(d.keys()))
+                values = [ d[key] for key in keys ] + [msg_id]
+                updates.setdefault(keys, []).append(values)
+        try:
+            with self._db:
+                if inserts:
+                    self._db.executemany(self._insert_query(), inserts)
+                for keys, lines in iteritems(updates):
+                    self._db.executemany(self._update_query(keys), lines)
+        except sqlite3.Error:
+            # e.g. a row inserted by another writer since the record was
+            # queued, which shouldn't lose the whole batch
+            self.log.warn("Error writing %i records at once, writing them one at a time",
+                len(pending), exc_info=True)
+            for msg_id, (is_insert, d) in iteritems(pending):
+                try:
+                    self._write_one(msg_id, is_insert, d)
+                except sqlite3.Error:
+                    # keep it for the next flush, rather than lose it
+                    self.log.error("DB Error writing record %r, will retry",
+                        msg_id, exc_info=True)
+                    self._pending[msg_id] = (is_insert, d)
+            self._db.commit()
+
+    def _write_one(self, msg_id, is_insert, d):
+        """Write a single pending record.
+
+        A record whose msg_id has been stored since it was queued
+        is merged into the stored one.
+        """
+        if is_insert:
+            try:
+                self._db.execute(self._insert_query(), self._dict_to_list(d))
+                return
+            except sqlite3.IntegrityError:
+                # like Hub._save_task_record, empty values don't clobber stored ones
+                self.log.warn("Merging record %r into the one already stored", msg_id)
+                d = dict( (key, value) for key, value in iteritems(d) if value )
+        keys = sorted(d.keys())
+        self._db.execute(self._update_query(keys),
+            [ d[key] for key in keys ] + [msg_id])
+
     def add_record(self, msg_id, rec):
         """Add a new Task Record, by msg_id."""
         d = self._defaults()
-        d.update(rec)
+        d.update(self._store_buffers(rec))
         d['msg_id'] = msg_id
+        if self.write_behind:
+            self._check_unique([msg_id])
+            self._queue_insert(msg_id, d)
+            return self._maybe_flush()
         line = self._dict_to_list(d)
-        tups = '(%s)'%(','.join(['?']*len(line)))
-        self._db.execute("INSERT INTO '%s' VALUES %s"%(self.table, tups), line)
+        self._db.execute(self._insert_query(), line)
         # self._db.commit()
 
+    def add_records(self, records):
+        """Add several new Task Records at once, with a single executemany."""
+        records_d = []
+        for rec in records:
+            d = self._defaults()
+            d.update(self._store_buffers(rec))
+            records_d.append(d)
+        if not records_d:
+            return
+        if self.write_behind:
+            self._check_unique([ d['msg_id'] for d in records_d ])
+            for d in records_d:
+                self._queue_insert(d['msg_id'], d)
+            return self._maybe_flush()
+        lines = [ self._dict_to_list(d) for d in records_d ]
+        self._db.executemany(self._insert_query(), lines)
+
     def get_record(self, msg_id):
         """Get a specific Task Record, by msg_id."""
+        return self._load_buffers(self._get_record(msg_id))
+
+    def _get_record(self, msg_id):
+        """Get a Task Record, with BlobRefs in place of any stored buffers."""
+        pending = self._pending.get(msg_id, None)
+        if pending is not None and pending[0]:
+            # not written yet
+            return deepcopy(pending[1])
         cursor = self._db.execute("""SELECT * FROM '%s' WHERE msg_id==?"""%self.table, (msg_id,))
         line = cursor.fetchone()
         if line is None:
             raise KeyError("No such msg: %r"%msg_id)
-        return self._list_to_dict(line)
+        rec = self._list_to_dict(line)
+        if pending is not None:
+            rec.update(deepcopy(pending[1]))
+        return rec
 
     def update_record(self, msg_id, rec):
         """Update the data in an existing record."""
-        query = "UPDATE '%s' SET "%self.table
-        sets = []
+        if self.blob_store is not None:
+            keys = [ key for key in ('buffers', 'result_buffers') if key in rec ]
+            if keys:
+                rec = self._store_buffers(rec)
+                self._release_stored_buffers(msg_id, keys)
+        if self.write_behind:
+            if msg_id in self._pending:
+                self._pending[msg_id][1].update(rec)
+            else:
+                self._pending[msg_id] = (False, dict(rec))
+            return self._maybe_flush()
         keys = sorted(rec.keys())
-        values = []
-        for key in keys:
-            sets.append('%s = ?'%key)
-            values.append(rec[key])
-        query += ', '.join(sets)
-        query += ' WHERE msg_id == ?'
+        values = [ rec[key] for key in keys ]
         values.append(msg_id)
-        self._db.execute(query, values)
+        self._db.execute(self._update_query(keys), values)
         # self._db.commit()
 
+    def _release_stored_buffers(self, msg_id, keys=None):
+        """Release the blobs referenced by a stored record."""
+        try:
+            rec = self._get_record(msg_id)
+        except KeyError:
+            return
+        self._release_buffers(rec, keys)
+
     def drop_record(self, msg_id):
         """Remove a record from the DB."""
+        if msg_id in self._pending:
+            self.flush()
+        if self.blob_store is not None:
+            self._release_stored_buffers(msg_id)
         self._db.execute("""DELETE FROM '%s' WHERE msg_id==?"""%self.table, (msg_id,))
-        # self._db.commit()
+        self._commit_drop()
 
     def drop_matching_records(self, check):
         """Remove a record from the DB."""
+        if self._pending_matches(check):
+            self.flush()
+        if self.blob_store is not None:
+            for rec in self._find_records(check, ['buffers', 'result_buffers']):
+                self._release_buffers(rec)
         expr,args = self._render_expression(check)
         query = "DELETE FROM '%s' WHERE %s"%(self.table, expr)
         self._db.execute(query,args)
-        # self._db.commit()
+        self._commit_drop()
+
+    def _commit_drop(self):
+        """Commit deleted records straight away with write_behind,
+        where the only other commits are those of non-empty flushes."""
+        if self.write_behind:
+            self._db.commit()
 
     def find_records(self, check, keys=None):
         """Find records matching a query dict, optionally extracting subset of keys.
@@ -389,6 +578,13 @@ def find_records(self, check, keys=None):
             if specified, the subset of keys to extract.  msg_id will *always* be
             included.
         """
+        records = self._find_records(check, keys)
+        if self.blob_store is not None:
+            records = [ self._load_buffers(rec) for rec in records ]
+        return records
+
+    def _find_records(self, check, keys=None):
+        """find_records, with BlobRefs in place of any stored buffers."""
         if keys:
             bad_keys = [ key for key in keys if key not in self._keys ]
             if bad_keys:
@@ -403,6 +599,9 @@ def find_records(self, check, keys=None):
         else:
             req = '*'
         expr,args = self._render_expression(check)
+        # queries see all the pending records
+        if self._pending_matches(check):
+            self.flush()
         query = """SELECT %s FROM '%s' WHERE %s"""%(req, self.table, expr)
         cursor = self._db.execute(query, args)
         matches = cursor.fetchall()
@@ -412,8 +611,47 @@ def find_records(self, check, keys=None):
             records.append(rec)
         return records
 
+    def _pending_matches(self, check):
+        """Whether any pending record could match a check dict.
+
+        Pending inserts are checked against the query. A pending update
+        could make the record it applies to match, or change the values
+        returned for it, so updates match unless the check is limited
+        to other msg_ids.
+        """
+        if not self._pending:
+            return False
+        msg_ids = None
+        spec = check.get('msg_id', None)
+        if isinstance(spec, dict):
+            if list(spec.keys()) == ['$in']:
+                msg_ids = spec['$in']
+            elif list(spec.keys()) == ['$eq']:
+                msg_ids = [spec['$eq']]
+        elif spec is not None:
+            msg_ids = [spec]
+        if msg_ids is None:
+            pending = list(self._pending.values())
+        else:
+            pending = [ self._pending[msg_id] for msg_id in msg_ids
+                        if msg_id in self._pending ]
+        tests = self._compile_check(check)
+        for is_insert, d in pending:
+            if not is_insert:
+                return True
+            try:
+                if self._match_one(d, tests):
+                    return True
+            except Exception:
+                # e.g. a comparison sqlite would make differently
+                return True
+        return False
+
     def get_history(self):
         """get all msg_ids, ordered by time submitted."""
+        if any( is_insert or 'submitted' in d
+                for is_insert, d in self._pending.values() ):
+            self.flush()
         query = """SELECT msg_id FROM '%s' ORDER by submitted ASC"""%self.table
         cursor = self._db.execute(query)
         # will be a list of length 1 tuples
@@ -196,7 +196,9 @@ def url(key):
             heart.start()
 
             # create Shell Connections (MUX, Task, etc.):
-            shell_addrs = url('mux'), url('task')
+            shell_addrs = [url('mux'), url('task')]
+            if 'broadcast' in info:
+                shell_addrs.append(url('broadcast'))
 
             # Use only one shell stream for mux and tasks
             stream = zmqstream.ZMQStream(ctx.socket(zmq.ROUTER), loop)
@@ -21,6 +21,7 @@
 import nose.tools as nt
 
 from IPython.utils.io import capture_output
+from IPython.testing import decorators as dec
 
 from IPython.parallel.error import TimeoutError
 from IPython.parallel import error, Client
@@ -72,6 +73,47 @@ def test_get_after_error(self):
         self.assertRaisesRemote(ZeroDivisionError, ar.get)
         self.assertRaisesRemote(ZeroDivisionError, ar.get_dict)
     
+    def test_add_done_callback(self):
+        ar = self.client[-1].apply_async(wait, 0.1)
+        results = []
+        ar.add_done_callback(lambda ar: results.append(ar.get(0)))
+        self.assertEqual(results, [])
+        ar.wait(10)
+        self.assertEqual(results, [0.1])
+        # callbacks added after the fact are called immediately
+        ar.add_done_callback(lambda ar: results.append('done'))
+        self.assertEqual(results, [0.1, 'done'])
+    
+    @dec.skip_without('concurrent.futures')
+    def test_future(self):
+        ar = self.client[-1].apply_async(lambda : 1/0)
+        f = ar.as_future()
+        self.assertFalse(f.done())
+        ar.wait(10)
+        self.assertTrue(f.done())
+        self.assertTrue(ar.done())
+        self.assertIsInstance(f.exception(), error.RemoteError)
+        self.assertIsInstance(ar.exception(), error.RemoteError)
+        self.assertFalse(ar.cancel())
+    
+    def test_attach_loop(self):
+        from zmq.eventloop import ioloop
+        loop = ioloop.IOLoop()
+        self.client.attach_loop(loop)
+        try:
+            ar = self.client[-1].apply_async(wait, 0.1)
+            results = []
+            def done(ar):
+                results.append(ar.get(0))
+                loop.stop()
+            ar.add_done_callback(done)
+            loop.add_timeout(time.time() + 10, loop.stop)
+            loop.start()
+            self.assertEqual(results, [0.1])
+        finally:
+            self.client.detach_loop()
+            loop.close()
+    
     def test_get_dict(self):
         n = len(self.client)
         ar = self.client[:].apply_async(lambda : 5)
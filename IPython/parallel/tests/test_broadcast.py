@@ -0,0 +1,160 @@
+"""Tests for the broadcast scheduler"""
+
+#-------------------------------------------------------------------------------
+#  Copyright (C) 2014  The IPython Development Team
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------
+
+import time
+from unittest import TestCase
+
+import zmq
+from zmq.eventloop.zmqstream import ZMQStream
+
+from IPython.kernel.zmq.session import Session
+from IPython.parallel.controller.broadcast import BroadcastScheduler
+from IPython.parallel.tests import add_engines
+
+from .clienttest import ClusterTestCase
+
+def setup():
+    add_engines(2, total=True)
+
+#-------------------------------------------------------------------------------
+# Utilities
+#-------------------------------------------------------------------------------
+
+class RecordingStream(ZMQStream):
+    """A ZMQStream stand-in that records what is sent on it"""
+    def __init__(self):
+        self.sent = []
+
+    def send_multipart(self, msg_list, flags=0, copy=True, track=False, callback=None):
+        self.sent.append([ m.bytes if isinstance(m, zmq.Frame) else m for m in msg_list ])
+
+    def on_recv(self, *args, **kwargs):
+        pass
+
+#-------------------------------------------------------------------------------
+# Tests
+#-------------------------------------------------------------------------------
+
+class TestBroadcastScheduler(TestCase):
+
+    def setUp(self):
+        self.session = Session(key=b'secret')
+        self.clients = RecordingStream()
+        self.engines = RecordingStream()
+        self.monitor = RecordingStream()
+        self.scheduler = BroadcastScheduler(client_stream=self.clients,
+            engine_stream=self.engines, mon_stream=self.monitor,
+            session=self.session,
+        )
+
+    def submit(self, targets, buffers):
+        md = dict(broadcast=[ [t, 'msg-%s' % t] for t in targets ], other=5)
+        msg = self.session.msg('apply_request', content={}, metadata=md)
+        msg_list = self.session.serialize(msg, ident=b'client')
+        msg_list.extend(buffers)
+        self.scheduler.dispatch_submission([ zmq.Frame(m) for m in msg_list ])
+        return msg
+
+    def test_submission(self):
+        msg = self.submit(['a', 'b', 'c'], [b'x' * 100])
+        self.assertEqual(len(self.engines.sent), 3)
+        for target, sent in zip([b'a', b'b', b'c'], self.engines.sent):
+            self.assertEqual(sent[:2], [target, b'client'])
+            idents, msg_list = self.session.feed_identities(sent)
+            engine_msg = self.session.unserialize(msg_list)
+            self.assertEqual(engine_msg['header']['msg_id'], 'msg-' + target.decode('ascii'))
+            self.assertEqual(engine_msg['header']['session'], msg['header']['session'])
+            self.assertEqual(engine_msg['metadata'], dict(other=5))
+            self.assertEqual(engine_msg['buffers'], [b'x' * 100])
+
+    def test_monitor_buffers_once(self):
+        self.submit(['a', 'b'], [b'x' * 100])
+        self.assertEqual(len(self.monitor.sent), 2)
+        first, second = self.monitor.sent
+        self.assertEqual(first[:3], [b'in', b'a', b'client'])
+        self.assertEqual(first[-1], b'x' * 100)
+        self.assertEqual(second[:3], [b'in', b'b', b'client'])
+        self.assertEqual(len(second), len(first) - 1)
+        # the second copy's record points to the first copy's buffers
+        idents, msg_list = self.session.feed_identities(second[1:])
+        mon_msg = self.session.unserialize(msg_list)
+        self.assertEqual(mon_msg['header']['msg_id'], 'msg-b')
+        self.assertEqual(mon_msg['metadata'], dict(other=5, buffers_from='msg-a'))
+
+    def test_monitor_no_buffers(self):
+        """requests without buffers are sent to the Hub unchanged"""
+        self.submit(['a', 'b'], [])
+        for sent in self.monitor.sent:
+            idents, msg_list = self.session.feed_identities(sent[1:])
+            self.assertEqual(self.session.unserialize(msg_list)['metadata'], dict(other=5))
+
+    def test_unsigned_submission(self):
+        msg = self.session.msg('apply_request', content={},
+            metadata=dict(broadcast=[['a', 'msg-a']]))
+        msg_list = self.session.serialize(msg, ident=b'client')
+        # break the signature
+        msg_list[2] = b'bad'
+        self.scheduler.dispatch_submission([ zmq.Frame(m) for m in msg_list ])
+        self.assertEqual(self.engines.sent, [])
+
+    def test_result(self):
+        reply = [zmq.Frame(m) for m in [b'a', b'client', b'<IDS|MSG>', b'sig', b'reply']]
+        self.scheduler.dispatch_result(reply)
+        self.assertEqual(self.clients.sent, [[b'client', b'a', b'<IDS|MSG>', b'sig', b'reply']])
+        self.assertEqual(self.monitor.sent[0][:3], [b'out', b'client', b'a'])
+
+
+class TestBroadcastView(ClusterTestCase):
+    """DirectView requests sent via the broadcast scheduler"""
+
+    def setUp(self):
+        ClusterTestCase.setUp(self)
+        self.minimum_engines(2)
+        self.view = self.client[:]
+        self.view.block = True
+        self.view.broadcast = True
+
+    def test_apply(self):
+        data = b'x' * 4096
+        self.assertEqual(self.view.apply(len, data), [len(data)] * len(self.view))
+
+    def test_execute(self):
+        self.view.execute('a = 5')
+        self.assertEqual(self.view.pull('a'), [5] * len(self.view))
+
+    def test_push(self):
+        data = b'x' * 4096
+        self.view.push(dict(data=data, b=list(range(5))))
+        self.assertEqual(self.view.pull('data'), [data] * len(self.view))
+        self.assertEqual(self.view.pull('b'), [list(range(5))] * len(self.view))
+
+    def test_resubmit(self):
+        """resubmit finds the buffers of every copy of a broadcast request"""
+        def f(data):
+            import random
+            return len(data), random.random()
+        ar = self.view.apply_async(f, b'x' * 4096)
+        r1 = ar.get(10)
+        # wait for the Hub to record the requests
+        for i in range(50):
+            records = self.client.db_query({'msg_id' : {'$in' : ar.msg_ids}},
+                keys=['metadata'])
+            if len(records) == len(ar.msg_ids):
+                break
+            time.sleep(0.1)
+        copies = [ rec for rec in records if 'buffers_from' in rec['metadata'] ]
+        self.assertEqual(len(copies), len(ar.msg_ids) - 1)
+        ahr = self.client.resubmit(ar.msg_ids)
+        r2 = ahr.get(10)
+        self.assertEqual([ r[0] for r in r2 ], [4096] * len(ar.msg_ids))
+        self.assertNotEqual(r1, r2)
@@ -163,6 +163,76 @@ def test_get_result(self):
         self.assertFalse(isinstance(ar2, AsyncHubResult))
         c.close()
     
+    def test_hub_result_done_callback(self):
+        """done callbacks of Hub results don't poll the Hub"""
+        c = clientmod.Client(profile='iptest')
+        t = c.ids[-1]
+        ar = c[t].apply_async(wait, 1)
+        # give the monitor time to notice the message
+        time.sleep(.25)
+        ahr = self.client.get_result(ar.msg_ids[0])
+        results = []
+        self.assertRaises(RuntimeError, ahr.add_done_callback, results.append)
+        ar.get()
+        self._wait_for(lambda : not self.client.result_status(ar.msg_ids)['pending'])
+        ahr.add_done_callback(lambda ahr: results.append(ahr.get(0)))
+        self.assertEqual(results, [1])
+        c.close()
+
+    def test_wait_timeout(self):
+        """wait returns False on timeout, and forgets what it was waiting for"""
+        t = self.client.ids[-1]
+        ar = self.client[t].apply_async(wait, 0.5)
+        self.assertFalse(self.client.wait(ar, timeout=0.1))
+        self.assertEqual(len(self.client._waits), 0)
+        self.assertTrue(self.client.wait(ar, timeout=5))
+        self.assertEqual(ar.get(), 0.5)
+    
+    def test_wait_many(self):
+        """wait counts many results as they arrive"""
+        v = self.client.load_balanced_view()
+        ars = [ v.apply_async(lambda x: x, i) for i in range(100) ]
+        self.assertTrue(self.client.wait(ars, timeout=10))
+        self.assertEqual(len(self.client._waits), 0)
+        self.assertEqual([ ar.get(0) for ar in ars ], list(range(100)))
+    
+    def _set_apply_batch_window(self, view, window):
+        def set_window(window):
+            from IPython.core.getipython import get_ipython
+            get_ipython().kernel.apply_batch_window = window
+        view.apply_sync(set_window, window)
+
+    def test_apply_batch_window(self):
+        """apply_replies coalesced by an engine resolve every result, and reach the Hub"""
+        t = self.client.ids[-1]
+        view = self.client[t]
+        batches = []
+        handle_batch = self.client._queue_handlers['batch']
+        def count_batch(batch):
+            batches.append(batch)
+            handle_batch(batch)
+        self.client._queue_handlers['batch'] = count_batch
+        self._set_apply_batch_window(view, 1.)
+        try:
+            # the requests wait behind the first, so their replies are held
+            ars = [ view.apply_async(wait, 0.25) ]
+            ars.extend([ view.apply_async(lambda x: x, i) for i in range(20) ])
+            self.assertEqual([ ar.get(10) for ar in ars ], [0.25] + list(range(20)))
+        finally:
+            self.client._queue_handlers['batch'] = handle_batch
+            self._set_apply_batch_window(view, 0)
+        self.assertTrue(len(batches) > 0)
+        self.assertEqual(set(ar.engine_id for ar in ars), set([t]))
+        msg_ids = [ ar.msg_ids[0] for ar in ars ]
+        query = {'msg_id' : {'$in' : msg_ids}, 'completed' : {'$ne' : None}}
+        self._wait_for(lambda : len(self.client.db_query(query, keys=['msg_id'])) == len(msg_ids))
+        recs = self.client.db_query({'msg_id' : {'$in' : msg_ids}},
+            keys=['msg_id', 'completed', 'result_content'])
+        self.assertEqual(sorted(rec['msg_id'] for rec in recs), sorted(msg_ids))
+        for rec in recs:
+            self.assertTrue(rec['completed'] is not None)
+            self.assertEqual(rec['result_content']['status'], 'ok')
+
     def test_get_execute_result(self):
         """test getting execute results from the Hub."""
         c = clientmod.Client(profile='iptest')
@@ -535,6 +605,30 @@ def test_spin_thread(self):
                 break
         self.assertIsInstance(md['received'], datetime)
     
+    def test_wait_spin_thread(self):
+        """wait and done callbacks count results a spin_thread receives as they start"""
+        client = self.client
+        ar = client[-1].apply_async(lambda : 1)
+        # leave the reply waiting in the socket
+        time.sleep(0.5)
+        class SlowSet(set):
+            """outstanding, with time for the spin_thread to spin in intersection"""
+            def intersection(self, other):
+                pending = set.intersection(self, other)
+                time.sleep(0.2)
+                return pending
+        client.outstanding = SlowSet(client.outstanding)
+        done = []
+        try:
+            client.spin_thread(0.05)
+            ar.add_done_callback(done.append)
+            self.assertTrue(client.wait(ar, timeout=2))
+        finally:
+            client.stop_spin_thread()
+            client.outstanding = set(client.outstanding)
+        self.assertEqual(done, [ar])
+        self.assertEqual(len(client._waits), 0)
+
     def test_stop_spin_thread(self):
         self.client.spin_thread(0.01)
         self.client.stop_spin_thread()
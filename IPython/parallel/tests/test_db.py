@@ -20,6 +20,7 @@
 
 import logging
 import os
+import shutil
 import tempfile
 import time
 
@@ -27,6 +28,7 @@
 from unittest import TestCase
 
 from IPython.parallel import error
+from IPython.parallel.controller.blobstore import BlobRef, BlobStore
 from IPython.parallel.controller.dictdb import DictDB
 from IPython.parallel.controller.sqlitedb import SQLiteDB
 from IPython.parallel.controller.hub import init_record, empty_record
@@ -75,6 +77,19 @@ def test_add_record(self):
         self.assertEqual(len(after), len(before)+5)
         self.assertEqual(after[:-5],before)
         
+    def test_add_records(self):
+        before = self.db.get_history()
+        records = []
+        for i in range(5):
+            msg = self.session.msg('apply_request', content=dict(a=5))
+            msg['buffers'] = []
+            records.append(init_record(msg))
+        self.db.add_records(records)
+        after = self.db.get_history()
+        self.assertEqual(after, before + [ rec['msg_id'] for rec in records ])
+        rec = self.db.get_record(records[2]['msg_id'])
+        self.assertEqual(rec['content'], dict(a=5))
+
     def test_drop_record(self):
         msg_id = self.load_records()[-1]
         rec = self.db.get_record(msg_id)
@@ -122,6 +137,18 @@ def test_find_records_dt(self):
         for s in same:
             self.assertTrue(s['submitted'] == tic)
     
+    def test_find_records_gt(self):
+        """test finding records with '$gt','$lte' operators"""
+        hist = self.db.get_history()
+        tic = self.db.get_record(hist[len(hist)//2])['submitted']
+        after = self.db.find_records({'submitted' : {'$gt' : tic}})
+        before = self.db.find_records({'submitted' : {'$lte' : tic}})
+        self.assertEqual(len(before)+len(after),len(hist))
+        for a in after:
+            self.assertTrue(a['submitted'] > tic)
+        for b in before:
+            self.assertTrue(b['submitted'] <= tic)
+
     def test_find_records_keys(self):
         """test extracting subset of record keys"""
         found = self.db.find_records({'msg_id': {'$ne' : ''}},keys=['submitted', 'completed'])
@@ -152,6 +179,13 @@ def test_find_records_in(self):
         found = [ r['msg_id'] for r in recs ]
         self.assertEqual(set(odd), set(found))
     
+    def test_find_records_in_repeated(self):
+        """a msg_id repeated in '$in' matches its record once"""
+        hist = self.db.get_history()
+        recs = self.db.find_records({ 'msg_id' : {'$in' : [hist[0], hist[1], hist[0]]}})
+        found = [ r['msg_id'] for r in recs ]
+        self.assertEqual(sorted(found), sorted(hist[:2]))
+
     def test_get_history(self):
         msg_ids = self.db.get_history()
         latest = datetime(1984,1,1)
@@ -252,6 +286,19 @@ def test_cull_count(self):
             self.assertTrue(len(self.db.get_history()) >= 17)
             self.assertTrue(len(self.db.get_history()) <= 20)
 
+    def test_cull_count_add_records(self):
+        self.db = self.create_db() # skip the load-records init from setUp
+        self.db.record_limit = 20
+        self.db.cull_fraction = 0.2
+        records = []
+        for i in range(21):
+            msg = self.session.msg('apply_request', content=dict(a=5))
+            msg['buffers'] = []
+            records.append(init_record(msg))
+        self.db.add_records(records)
+        # 0.2 * 20 = 4, 21 - 4 = 17
+        self.assertEqual(self.db.get_history(), [ rec['msg_id'] for rec in records[4:] ])
+
     def test_cull_size(self):
         self.db = self.create_db() # skip the load-records init from setUp
         self.db.size_limit = 1000
@@ -293,6 +340,185 @@ def test_cull_size_update(self):
         self.db.update_record(msg_id, dict(result_buffers = [os.urandom(11)], buffers=[]))
         self.assertEqual(len(self.db.get_history()), 79)
 
+    def test_indexed_update(self):
+        """queries on indexed keys see updated values"""
+        hist = self.db.get_history()
+        now = datetime.now()
+        self.db.update_record(hist[0], dict(completed=now, engine_uuid='engine'))
+        self.db.update_record(hist[1], dict(completed=now, engine_uuid='engine'))
+        self.db.update_record(hist[1], dict(completed=None))
+        query = {'completed' : {'$lte' : now}, 'engine_uuid' : 'engine'}
+        found = [ rec['msg_id'] for rec in self.db.find_records(query) ]
+        self.assertEqual(found, [hist[0]])
+        found = [ rec['msg_id'] for rec in self.db.find_records({'completed' : {'$ne' : None}}) ]
+        self.assertEqual(found, [hist[0]])
+        self.db.drop_record(hist[0])
+        self.assertEqual(self.db.find_records(query), [])
+
+    def test_unindexed(self):
+        """queries give the same results without indexes"""
+        unindexed = DictDB(indexed_keys=[], blob_threshold=self.db.blob_threshold,
+                           blob_store=self.db.blob_store)
+        for msg_id in self.db.get_history():
+            unindexed.add_record(msg_id, self.db.get_record(msg_id))
+        hist = self.db.get_history()
+        tic = self.db.get_record(hist[len(hist)//2])['submitted']
+        for query in [
+            {'submitted' : {'$lt' : tic}},
+            {'submitted' : {'$gte' : tic}, 'msg_id' : {'$in' : hist[::2]}},
+            {'engine_uuid' : None, 'completed' : None},
+            {'msg_id' : hist[3]},
+        ]:
+            found = sorted(rec['msg_id'] for rec in self.db.find_records(query))
+            expected = sorted(rec['msg_id'] for rec in unindexed.find_records(query))
+            self.assertEqual(found, expected)
+        self.assertEqual(self.db.get_history(), unindexed.get_history())
+
+class BlobTest:
+    """Tests for a db backend with a BlobStore"""
+
+    def tearDown(self):
+        shutil.rmtree(self.db.blob_store.location)
+
+    def create_blob_store(self):
+        return BlobStore(location=tempfile.mkdtemp())
+
+    def _blobs(self):
+        return sorted(os.listdir(self.db.blob_store.location))
+
+    def test_blob_refs(self):
+        """records hold references to buffers, which are loaded on get"""
+        data = os.urandom(100)
+        msg = self.session.msg('apply_request', content={})
+        msg['buffers'] = [data]
+        msg_id = msg['header']['msg_id']
+        self.db.add_record(msg_id, init_record(msg))
+        self.assertTrue(isinstance(self._get_raw(msg_id)['buffers'][0], BlobRef))
+        rec = self.db.get_record(msg_id)
+        self.assertEqual(bytes(rec['buffers'][0]), data)
+        found = self.db.find_records({'msg_id' : msg_id}, keys=['buffers'])
+        self.assertEqual(bytes(found[0]['buffers'][0]), data)
+
+    def test_blob_release(self):
+        """blobs are shared by records, and removed with the last of them"""
+        self.db.drop_matching_records({'msg_id' : {'$ne' : None}})
+        self.assertEqual(self._blobs(), [])
+        data = os.urandom(100)
+        msg_ids = []
+        for i in range(2):
+            msg = self.session.msg('apply_request', content={})
+            msg['buffers'] = [data]
+            msg_ids.append(msg['header']['msg_id'])
+            self.db.add_record(msg_ids[-1], init_record(msg))
+        self.assertEqual(len(self._blobs()), 1)
+        self.assertEqual(self.db.blob_store.size, 100)
+        self.db.drop_record(msg_ids[0])
+        self.assertEqual(len(self._blobs()), 1)
+        self.db.drop_record(msg_ids[1])
+        self.assertEqual(self._blobs(), [])
+        self.assertEqual(self.db.blob_store.size, 0)
+
+    def test_blob_update(self):
+        """updating buffers releases the blobs they replace"""
+        self.db.drop_matching_records({'msg_id' : {'$ne' : None}})
+        msg_id = self.load_records(1)[0]
+        self.db.update_record(msg_id, dict(result_buffers=[b'a' * 10]))
+        self.assertEqual(len(self._blobs()), 2)
+        self.db.update_record(msg_id, dict(result_buffers=[b'b' * 10]))
+        self.assertEqual(len(self._blobs()), 2)
+        rec = self.db.get_record(msg_id)
+        self.assertEqual(bytes(rec['result_buffers'][0]), b'b' * 10)
+
+    def test_blob_threshold(self):
+        """buffers smaller than blob_threshold stay in the records"""
+        self.db.blob_threshold = 50
+        msg = self.session.msg('apply_request', content={})
+        msg['buffers'] = [b'small', os.urandom(50)]
+        msg_id = msg['header']['msg_id']
+        self.db.add_record(msg_id, init_record(msg))
+        small, big = self._get_raw(msg_id)['buffers']
+        self.assertEqual(small, b'small')
+        self.assertTrue(isinstance(big, BlobRef))
+
+    def test_blob_collect(self):
+        """loading a db deletes no blobs, and collect only deletes its own"""
+        location = self.db.blob_store.location
+        with open(os.path.join(location, 'stray'), 'wb') as f:
+            f.write(b'stray')
+        before = self._blobs()
+        self.db = self.reopen_db(BlobStore(location=location))
+        self.assertEqual(self._blobs(), before)
+        self.assertEqual(self.db.blob_store.collect(), 0)
+        self.assertEqual(self._blobs(), before)
+        # the adopted blobs are deleted with the last record using them
+        self.db.drop_matching_records({'msg_id' : {'$ne' : None}})
+        self.assertEqual(self._blobs(), self.unowned_blobs(before))
+        self.assertEqual(self.db.blob_store.size, 0)
+
+    def test_collect_written(self):
+        """collect leaves the blobs of another store in the same location"""
+        location = self.db.blob_store.location
+        before = self._blobs()
+        store = BlobStore(location=location)
+        other = BlobStore(location=location)
+        ref = other.put(b'other')
+        store.put(b'mine')
+        # drop the references without releasing them
+        store._refs.clear()
+        self.assertEqual(store.collect(), 1)
+        self.assertEqual(self._blobs(), sorted(before + [ref.key]))
+        other.release(ref)
+
+    def test_temporary_location(self):
+        """a BlobStore without a profile uses a temporary directory, removed on close"""
+        store = BlobStore()
+        self.assertTrue(os.path.isdir(store.location))
+        store.put(b'abc')
+        store.close()
+        self.assertFalse(os.path.exists(store.location))
+
+
+class TestDictBlobs(BlobTest, TestDictBackend):
+
+    def create_db(self):
+        return DictDB(blob_threshold=0, blob_store=self.create_blob_store())
+
+    def reopen_db(self, blob_store):
+        return DictDB(blob_threshold=0, blob_store=blob_store)
+
+    def unowned_blobs(self, before):
+        # the blobs of the first db's records are still its own
+        return before
+
+    def _get_raw(self, msg_id):
+        return self.db._records[msg_id]
+
+    def test_default_location(self):
+        """each DictDB's default BlobStore is its own, removed on close"""
+        dbs = [ DictDB(blob_threshold=0, session=session) for session in (u'a', u'b') ]
+        stores = [ db.blob_store for db in dbs ]
+        self.assertEqual([ store.name for store in stores ], [u'a', u'b'])
+        self.assertNotEqual(stores[0].location, stores[1].location)
+        for store in stores:
+            self.assertTrue(store.temporary)
+            store.close()
+            self.assertFalse(os.path.exists(store.location))
+
+    def test_cull_size_blobs(self):
+        """size_limit applies to blobs"""
+        self.db.drop_matching_records({'msg_id' : {'$ne' : None}})
+        self.db.size_limit = 1000
+        self.db.cull_fraction = 0.2
+        self.load_records(10, buffer_size=100)
+        self.assertEqual(self.db._buffer_bytes, 0)
+        self.assertEqual(len(self.db.get_history()), 10)
+        self.load_records(1, buffer_size=1)
+        # culled until total size is under 800
+        self.assertEqual(len(self.db.get_history()), 8)
+        self.assertEqual(self.db.blob_store.size, 701)
+        self.assertEqual(len(self._blobs()), 8)
+
+
 class TestSQLiteBackend(TaskDBTest, TestCase):
 
     @dec.skip_without('sqlite3')
@@ -303,7 +529,133 @@ def create_db(self):
         return SQLiteDB(location=location, fname=fname, log=log)
     
     def tearDown(self):
+        # each test starts with an empty table
+        self.db._db.execute("DROP TABLE '%s'" % self.db.table)
+        self.db._db.close()
+
+
+class TestSQLiteWriteBehind(TestSQLiteBackend):
+
+    @dec.skip_without('sqlite3')
+    def create_db(self):
+        location, fname = os.path.split(temp_db)
+        log = logging.getLogger('test')
+        log.setLevel(logging.CRITICAL)
+        return SQLiteDB(location=location, fname=fname, log=log, write_behind=True,
+                        table='write_behind')
+
+    def test_pending(self):
+        """pending records are visible before they are written"""
+        msg_id = self.load_records(1)[0]
+        self.assertTrue(msg_id in self.db._pending)
+        now = datetime.now()
+        self.db.update_record(msg_id, dict(stdout='hi', completed=now))
+        rec = self.db.get_record(msg_id)
+        self.assertEqual(rec['stdout'], 'hi')
+        self.db.flush()
+        self.assertFalse(self.db._pending)
+        self.db.update_record(msg_id, dict(stderr='bye'))
+        rec = self.db.get_record(msg_id)
+        self.assertEqual((rec['stdout'], rec['stderr']), ('hi', 'bye'))
+        found = self.db.find_records({'stderr' : 'bye'}, keys=['completed'])
+        self.assertEqual(len(found), 1)
+        self.assertEqual(found[0]['msg_id'], msg_id)
+
+    def test_add_duplicate(self):
+        """duplicate records raise at once, like they do without write_behind"""
+        import sqlite3
+        msg_id = self.load_records(1)[0]
+        rec = self.db.get_record(msg_id)
+        self.assertRaises(sqlite3.IntegrityError, self.db.add_record, msg_id, rec)
+        self.db.flush()
+        self.assertRaises(sqlite3.IntegrityError, self.db.add_record, msg_id, rec)
+        msg = self.session.msg('apply_request', content=dict(a=5))
+        msg['buffers'] = []
+        records = [init_record(msg), rec]
+        self.assertRaises(sqlite3.IntegrityError, self.db.add_records, records)
+        self.assertFalse(self.db._pending)
+
+    def test_flush_merges(self):
+        """a record stored by another writer since it was queued is merged, not lost"""
+        import sqlite3
+        msg_ids = self.load_records(2)
+        self.db.update_record(msg_ids[0], dict(stdout='hi'))
+        conn = sqlite3.connect(os.path.join(self.db.location, self.db.filename))
+        try:
+            query = "INSERT INTO '%s' (msg_id, stderr) VALUES (?, ?)" % self.db.table
+            conn.execute(query, (msg_ids[0], 'bye'))
+            conn.commit()
+        finally:
+            conn.close()
+        self.db.flush()
+        self.assertFalse(self.db._pending)
+        rec = self.db.get_record(msg_ids[0])
+        self.assertEqual((rec['stdout'], rec['stderr']), ('hi', 'bye'))
+        self.assertEqual(rec['content'], dict(a=5))
+        self.assertEqual(self.db.get_record(msg_ids[1])['content'], dict(a=5))
+
+    def test_query_flushes_matches(self):
+        """queries only write the pending records when some of them could match"""
+        old_id = self.db.get_history()[-1]
+        self.db.flush()
+        msg_id = self.load_records(1)[0]
+        found = self.db.find_records({'msg_id' : {'$in' : [old_id]}})
+        self.assertEqual([ rec['msg_id'] for rec in found ], [old_id])
+        found = self.db.find_records({'stdout' : 'hi'})
+        self.assertEqual(found, [])
+        self.assertTrue(msg_id in self.db._pending)
+        found = self.db.find_records({'msg_id' : msg_id}, keys=['content'])
+        self.assertEqual(found[0]['content'], dict(a=5))
+        self.assertFalse(self.db._pending)
+        self.db.update_record(old_id, dict(stdout='hi'))
+        self.db.get_history()
+        self.assertTrue(old_id in self.db._pending)
+        found = self.db.find_records({'stdout' : 'hi'})
+        self.assertEqual([ rec['msg_id'] for rec in found ], [old_id])
+
+    def test_drop_committed(self):
+        """dropped records are committed without waiting for a flush"""
+        import sqlite3
+        msg_ids = self.load_records(3)
+        self.db.flush()
+        self.db.drop_record(msg_ids[0])
+        self.db.drop_matching_records({'msg_id' : msg_ids[1]})
+        # another connection only sees committed changes
+        conn = sqlite3.connect(os.path.join(self.db.location, self.db.filename))
+        try:
+            query = "SELECT msg_id FROM '%s' WHERE msg_id IN (?,?,?)" % self.db.table
+            found = [ row[0] for row in conn.execute(query, msg_ids) ]
+        finally:
+            conn.close()
+        self.assertEqual(found, msg_ids[2:])
+
+
+class TestSQLiteBlobs(BlobTest, TestSQLiteBackend):
+
+    @dec.skip_without('sqlite3')
+    def create_db(self):
+        location, fname = os.path.split(temp_db)
+        log = logging.getLogger('test')
+        log.setLevel(logging.CRITICAL)
+        return SQLiteDB(location=location, fname=fname, log=log, table='blobs',
+                        blob_threshold=0, blob_store=self.create_blob_store())
+
+    def reopen_db(self, blob_store):
+        self.db._db.commit()
         self.db._db.close()
+        location, fname = os.path.split(temp_db)
+        return SQLiteDB(location=location, fname=fname, log=self.db.log, table='blobs',
+                        blob_threshold=0, blob_store=blob_store)
+
+    def unowned_blobs(self, before):
+        return ['stray']
+
+    def _get_raw(self, msg_id):
+        return self.db._get_record(msg_id)
+
+    def tearDown(self):
+        TestSQLiteBackend.tearDown(self)
+        BlobTest.tearDown(self)
 
 
 def teardown():
@@ -18,6 +18,8 @@
 
 import sys
 import time
+from datetime import datetime, timedelta
+from unittest import TestCase
 
 import zmq
 from nose import SkipTest
@@ -25,6 +27,7 @@
 
 from IPython import parallel  as pmod
 from IPython.parallel import error
+from IPython.parallel.client.view import _AdaptiveChunks
 
 from IPython.parallel.tests import add_engines
 
@@ -131,6 +134,39 @@ def slow_f(x):
         self.assertEqual(astheycame, reference)
         self.assertEqual(amr.result, reference)
 
+    def test_map_batchsize(self):
+        """map with several tasks in each submission message"""
+        def f(x):
+            return x**2
+        data = list(range(33))
+        reference = list(map(f, data))
+        r = self.view.map_sync(f, data, batchsize=5)
+        self.assertEqual(r, reference)
+        amr = self.view.map_async(f, data, chunksize=2, batchsize=4)
+        self.assertEqual(len(amr.msg_ids), 17)
+        self.assertEqual(amr.get(), reference)
+        # the Hub has a record of each task in the batches,
+        # though it may store them after the results reach us
+        query = {'msg_id' : {'$in' : amr.msg_ids}, 'completed' : {'$ne' : None}}
+        def all_completed():
+            recs = self.client.db_query(query, keys=['msg_id'])
+            return len(recs) == len(amr.msg_ids)
+        self._wait_for(all_completed)
+        recs = self.client.db_query({'msg_id' : {'$in' : amr.msg_ids}}, keys=['msg_id', 'completed'])
+        self.assertEqual(sorted(rec['msg_id'] for rec in recs), sorted(amr.msg_ids))
+        for rec in recs:
+            self.assertTrue(rec['completed'] is not None)
+
+    def test_map_batchsize_unordered(self):
+        def slow_f(x):
+            import time
+            time.sleep(0.05*x)
+            return x**2
+        data = list(range(16,0,-1))
+        amr = self.view.map_async(slow_f, data, batchsize=8, ordered=False)
+        astheycame = list(amr)
+        self.assertEqual(sorted(astheycame, reverse=True), [ x**2 for x in data ])
+
     def test_map_iterable(self):
         """test map on iterables (balanced)"""
         view = self.view
@@ -141,6 +177,75 @@ def test_map_iterable(self):
         r = view.map_sync(lambda x:x, arr)
         self.assertEqual(r, list(arr))
 
+    def test_imap_endless(self):
+        """imap consumes an endless generator a few tasks at a time"""
+        import itertools
+        consumed = []
+        def gen():
+            for i in itertools.count():
+                consumed.append(i)
+                yield i
+        it = self.view.imap(lambda x: x*2, gen(), chunksize=3, max_outstanding=2)
+        r = list(itertools.islice(it, 10))
+        self.assertEqual(r, [ 2*i for i in range(10) ])
+        # 4 chunks have been yielded from, and 2 more are in flight
+        self.assertEqual(len(consumed), 18)
+
+    def test_imap_unordered(self):
+        def slow_f(x):
+            import time
+            time.sleep(0.05*x)
+            return x**2
+        data = list(range(16,0,-1))
+        astheycame = list(self.view.imap(slow_f, iter(data), ordered=False, max_outstanding=16))
+        self.assertNotEqual(astheycame, [ x**2 for x in data ], "should not have preserved order")
+        self.assertEqual(sorted(astheycame, reverse=True), [ x**2 for x in data ])
+
+    def test_map_auto_chunksize(self):
+        """chunksize='auto' grows the chunks of cheap tasks"""
+        n_previous = len(self.client.history)
+        r = self.view.map(lambda x: x*2, range(500), chunksize='auto', block=True)
+        self.assertEqual(r, [ 2*i for i in range(500) ])
+        self.assertTrue(len(self.client.history) - n_previous < 500)
+
+    def test_map_auto_chunksize_unordered(self):
+        """an unordered 'auto' map still returns the results in order"""
+        def slow_f(x):
+            import time
+            time.sleep(0.05*x)
+            return x**2
+        data = list(range(16,0,-1))
+        r = self.view.map(slow_f, data, chunksize='auto', ordered=False, block=True)
+        self.assertEqual(r, [ x**2 for x in data ])
+        astheycame = list(self.view.imap(slow_f, data, chunksize='auto', ordered=False))
+        self.assertEqual(sorted(astheycame, reverse=True), [ x**2 for x in data ])
+
+    def test_map_auto_chunksize_error(self):
+        def fail(x):
+            assert x != 3
+            return x
+        self.assertRaisesRemote(AssertionError, self.view.map, fail, range(5),
+            chunksize='auto', block=True)
+
+    def test_map_auto_chunksize_invalid(self):
+        """chunksize='auto' doesn't silently ignore track, batchsize and block=False"""
+        f = lambda x: x
+        self.assertRaises(ValueError, self.view.map, f, range(5),
+            chunksize='auto', track=True)
+        self.assertRaises(ValueError, self.view.map, f, range(5),
+            chunksize='auto', batchsize=4)
+        # it needs to block, to submit chunks as results come back
+        self.assertRaises(ValueError, self.view.map, f, range(5),
+            chunksize='auto', block=False)
+        self.assertRaises(ValueError, self.view.map_async, f, range(5),
+            chunksize='auto')
+        self.assertRaises(TypeError, self.view.map, f, range(5), bad_key=True)
+
+    def test_imap_shortest(self):
+        """imap stops at the end of the shortest sequence"""
+        r = list(self.view.imap(lambda x,y: x+y, range(10), iter(range(5)), chunksize=2))
+        self.assertEqual(r, [ 2*i for i in range(5) ])
+
     
     def test_abort(self):
         view = self.view
@@ -219,3 +324,70 @@ def test_after(self):
         ar.wait()
         ar2.wait()
         self.assertTrue(ar2.started >= ar.completed, "%s not >= %s"%(ar.started, ar.completed))
+
+
+class TestAdaptiveChunks(TestCase):
+    """The sizing of chunksize='auto' chunks, with fixed timestamps"""
+
+    started = datetime(2014, 1, 1)
+
+    def record(self, chunks, n, seconds):
+        chunks.record(n, self.started, self.started + timedelta(seconds=seconds))
+        chunks.submitted += n
+
+    def test_first_chunk(self):
+        chunks = _AdaptiveChunks(1., 4)
+        self.assertEqual(chunks.next_size(), 1)
+        # chunks that haven't come back don't count
+        chunks.record(1, self.started, None)
+        chunks.record(0, self.started, self.started)
+        self.assertEqual(chunks.next_size(), 1)
+
+    def test_growth(self):
+        chunks = _AdaptiveChunks(1., 4)
+        self.record(chunks, 1, 0.1)
+        self.assertEqual(chunks.per_element, 0.1)
+        self.assertEqual(chunks.next_size(), 10)
+        self.record(chunks, 10, 0.5)
+        # 0.1 + 0.3 * (0.05 - 0.1)
+        self.assertAlmostEqual(chunks.per_element, 0.085)
+        self.assertEqual(chunks.next_size(), 11)
+        # faster chunks pull the average down only gradually
+        self.record(chunks, 11, 0.0011)
+        self.assertEqual(chunks.next_size(), 16)
+
+    def test_max_chunksize(self):
+        chunks = _AdaptiveChunks(1., 4)
+        self.record(chunks, 1, 1e-9)
+        self.assertEqual(chunks.next_size(), chunks.max_chunksize)
+
+    def test_tail(self):
+        chunks = _AdaptiveChunks(1., 4, total=100)
+        self.record(chunks, 1, 0.01)
+        # ceil(99 / 8)
+        self.assertEqual(chunks.next_size(), 13)
+        chunks.submitted = 60
+        self.assertEqual(chunks.next_size(), 5)
+        chunks.submitted = 59
+        self.assertEqual(chunks.next_size(), 6)
+        chunks.submitted = 99
+        self.assertEqual(chunks.next_size(), 1)
+
+    def test_tail_above_estimate(self):
+        """the tail cap only ever shrinks chunks"""
+        chunks = _AdaptiveChunks(1., 1, total=1000)
+        self.record(chunks, 1, 0.25)
+        self.assertEqual(chunks.next_size(), 4)
+
+    def test_instant_chunks(self):
+        """chunks that take no time at all get the largest chunks"""
+        chunks = _AdaptiveChunks(1., 4)
+        self.record(chunks, 5, 0)
+        self.assertEqual(chunks.per_element, 0)
+        self.assertEqual(chunks.next_size(), chunks.max_chunksize)
+        # clocks going backwards, too
+        chunks = _AdaptiveChunks(1., 4, total=1000)
+        self.record(chunks, 5, -1)
+        self.assertTrue(chunks.per_element < 0)
+        # ceil(995 / 8)
+        self.assertEqual(chunks.next_size(), 125)
@@ -0,0 +1,397 @@
+"""Tests for the Python task scheduler's data structures"""
+
+#-------------------------------------------------------------------------------
+#  Copyright (C) 2014  The IPython Development Team
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+# Imports
+#-------------------------------------------------------------------------------
+
+from unittest import TestCase
+
+import zmq
+from zmq.eventloop import zmqstream
+
+from IPython.kernel.zmq.session import Session
+from IPython.parallel.controller.dependency import Dependency
+from IPython.parallel.controller.scheduler import (Job, LoadIndex, TaskScheduler,
+                                                   leastload, lru, MET)
+
+#-------------------------------------------------------------------------------
+# Tests
+#-------------------------------------------------------------------------------
+
+class TestLoadIndex(TestCase):
+
+    def setUp(self):
+        # mirror TaskScheduler's LRU-ordered targets/loads lists
+        self.index = LoadIndex()
+        self.targets = []
+        self.loads = []
+        for uid in [b'a', b'b', b'c', b'd']:
+            self.register(uid)
+
+    def register(self, uid):
+        self.targets.insert(0, uid)
+        self.loads.insert(0, 0)
+        self.index.add(uid)
+
+    def assign(self):
+        idx = leastload(self.loads)
+        load, uid = self.index.least_loaded()
+        self.assertEqual(uid, self.targets[idx])
+        self.assertEqual(load, self.loads[idx])
+        self.loads[idx] += 1
+        self.index.update(uid, self.loads[idx], used=True)
+        for lis in (self.targets, self.loads):
+            lis.append(lis.pop(idx))
+        return uid
+
+    def finish(self, uid):
+        idx = self.targets.index(uid)
+        self.loads[idx] -= 1
+        self.index.update(uid, self.loads[idx])
+
+    def test_empty(self):
+        index = LoadIndex()
+        self.assertEqual(index.least_loaded(), None)
+        self.assertEqual(len(index), 0)
+
+    def test_newest_engine_first(self):
+        self.assertEqual(self.index.least_loaded(), (0, b'd'))
+
+    def test_matches_leastload(self):
+        assigned = [self.assign() for i in range(10)]
+        for uid in assigned[::3]:
+            self.finish(uid)
+        self.register(b'e')
+        for i in range(10):
+            self.assign()
+
+    def test_lru_order(self):
+        assigned = [self.assign() for i in range(6)]
+        for uid in assigned[::2]:
+            self.finish(uid)
+        self.assertEqual(self.index.lru_order(), list(zip(self.targets, self.loads)))
+        self.assertEqual(set(self.index), set(self.targets))
+
+    def test_lru_tiebreak(self):
+        first = self.assign()
+        for i in range(3):
+            self.assign()
+        self.finish(first)
+        self.assertEqual(self.index.least_loaded(), (0, first))
+
+    def test_remove(self):
+        self.index.remove(b'd')
+        self.assertFalse(b'd' in self.index)
+        self.assertEqual(self.index.least_loaded(), (0, b'c'))
+        self.assertEqual(self.index.count(0), 3)
+
+    def test_count(self):
+        self.assertEqual(self.index.count(0), 4)
+        uid = self.assign()
+        self.assertEqual(self.index.count(0), 3)
+        self.assertEqual(self.index.count(1), 1)
+        self.finish(uid)
+        self.assertEqual(self.index.count(1), 0)
+
+    def test_same_load_and_lru(self):
+        """a load that changes back, without the engine being used,
+        leaves stale entries that are equal to live ones but for their ident"""
+        index = LoadIndex()
+        index.add(b'a')
+        for load in (1, 0, 1, 0):
+            index.update(b'a', load)
+            self.assertEqual(index.least_loaded(), (load, b'a'))
+
+    def test_stale_entries_are_compacted(self):
+        for i in range(1000):
+            self.finish(self.assign())
+        self.assertTrue(len(self.index._heap) <= 2 * len(self.index) + 16)
+
+
+def make_job(after=MET, follow=MET):
+    return Job(msg_id='job', raw_msg=[], idents=[], msg={}, header={},
+        metadata={}, targets=set(), after=after, follow=follow, timeout=None,
+    )
+
+class TestJob(TestCase):
+
+    def test_blocked_all(self):
+        job = make_job(after=Dependency(['a', 'b']))
+        job.unmet = 1
+        self.assertTrue(job.blocked_after('a', True))
+        # a failure makes the dependency unreachable, so check it
+        self.assertFalse(job.blocked_after('a', False))
+        job.unmet = 0
+        self.assertFalse(job.blocked_after('a', True))
+
+    def test_blocked_any(self):
+        job = make_job(after=Dependency(['a', 'b'], all=False))
+        job.unmet = 1
+        self.assertFalse(job.blocked_after('a', True))
+
+    def test_blocked_follow(self):
+        job = make_job(after=Dependency(['a']), follow=Dependency(['b'], all=False))
+        job.unmet = 1
+        self.assertFalse(job.blocked_after('a', True))
+        job = make_job(after=Dependency(['a']), follow=Dependency(['b']))
+        job.unmet = 1
+        self.assertTrue(job.blocked_after('a', True))
+
+
+class FakeStream(zmqstream.ZMQStream):
+    """A stream that records what is sent on it, instead of sending."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, msg, flags=0, copy=True, track=False, callback=None):
+        self.sent.append(msg)
+
+    def send_multipart(self, msg_list, flags=0, copy=True, track=False, callback=None):
+        self.sent.append(msg_list)
+
+    def flush(self, flag=None, limit=None):
+        return 0
+
+
+class SchedulerTestCase(TestCase):
+    """Drive a TaskScheduler by calling its handlers directly."""
+
+    scheduler_class = TaskScheduler
+    engines = [b'a', b'b', b'c']
+
+    def setUp(self):
+        self.session = Session(key=b'')
+        self.scheduler = self.scheduler_class(session=self.session,
+            client_stream=FakeStream(), engine_stream=FakeStream(),
+            mon_stream=FakeStream(), notifier_stream=FakeStream(),
+            query_stream=FakeStream(),
+        )
+        for uid in self.engines:
+            self.scheduler._register_engine(uid)
+
+    def submit(self, msg_id, **metadata):
+        """Submit a task, with metadata as LoadBalancedView would send it."""
+        msg = self.session.msg('apply_request', {}, metadata=metadata)
+        msg['header']['msg_id'] = msg_id
+        self.scheduler.dispatch_job([b'client', msg_id], [b'client'], msg)
+
+    def engine_of(self, msg_id):
+        """The engine a task was sent to, or None."""
+        for uid, pending in self.scheduler.pending.items():
+            if msg_id in pending:
+                return uid
+
+    def finish(self, msg_id, status='ok'):
+        """Reply to a task from the engine it was sent to."""
+        engine = self.engine_of(msg_id)
+        msg = dict(parent_header={'msg_id' : msg_id},
+                   metadata={'status' : status, 'dependencies_met' : True})
+        self.scheduler.dispatch_reply([engine, b'client', msg_id], [engine, b'client'], msg)
+
+
+class IndexHookScheduler(TaskScheduler):
+    """A subclass written against the index-based add_job/finish_job hooks."""
+
+    def add_job(self, idx):
+        self.added = self.targets[idx]
+        super(IndexHookScheduler, self).add_job(idx)
+
+    def finish_job(self, idx):
+        self.finished = self.targets[idx]
+        super(IndexHookScheduler, self).finish_job(idx)
+
+
+class TestLoadTracking(SchedulerTestCase):
+
+    def test_loads(self):
+        s = self.scheduler
+        s.hwm = 0
+        for i in range(4):
+            self.submit('t%i' % i)
+        engines = [ self.engine_of('t%i' % i) for i in range(4) ]
+        # newest engine first, then in LRU order
+        self.assertEqual(engines, [b'c', b'b', b'a', b'c'])
+        self.assertEqual(s.engine_loads(), [(b'b', 1), (b'a', 1), (b'c', 2)])
+        self.finish('t0')
+        self.assertEqual(s.engine_loads(), [(b'b', 1), (b'a', 1), (b'c', 1)])
+
+    def test_lru_scheme(self):
+        s = self.scheduler
+        s.scheme = lru
+        for i in range(3):
+            self.submit('t%i' % i)
+        self.assertEqual([ self.engine_of('t%i' % i) for i in range(3) ],
+            [b'c', b'b', b'a'])
+        self.assertEqual(s.available_engines(), [])
+        self.finish('t1')
+        self.assertEqual(s.available_engines(), [b'b'])
+
+    def test_lists(self):
+        s = self.scheduler
+        self.assertFalse(s._index_hooks)
+        self.submit('t0')
+        self.assertEqual(s.targets, [])
+        self.assertEqual(s.loads, [])
+
+
+class TestIndexHooks(TestLoadTracking):
+
+    scheduler_class = IndexHookScheduler
+
+    def test_lists(self):
+        s = self.scheduler
+        self.assertTrue(s._index_hooks)
+        self.assertEqual(s.targets, [b'c', b'b', b'a'])
+        self.submit('t0')
+        self.assertEqual(s.added, b'c')
+        self.assertEqual(s.targets, [b'b', b'a', b'c'])
+        self.assertEqual(s.loads, [0, 0, 1])
+        self.assertEqual(s.load_index.load(b'c'), 1)
+        self.finish('t0')
+        self.assertEqual(s.finished, b'c')
+        self.assertEqual(s.loads, [0, 0, 0])
+        s._unregister_engine(b'b')
+        self.assertEqual(s.targets, [b'a', b'c'])
+
+
+class TestReadyQueues(SchedulerTestCase):
+
+    def fill(self):
+        """Give each engine one task, so that all of them are full."""
+        for i, uid in enumerate([b'c', b'b', b'a']):
+            self.submit('t%i' % i)
+            self.assertEqual(self.engine_of('t%i' % i), uid)
+
+    def test_release_dependents(self):
+        s = self.scheduler
+        self.submit('a')
+        self.submit('b')
+        self.submit('x', after=['a', 'b'])
+        self.assertEqual(self.engine_of('x'), None)
+        self.assertEqual(s.graph['a'], set(['x']))
+        self.finish('a')
+        self.assertEqual(self.engine_of('x'), None)
+        self.assertFalse('a' in s.graph)
+        self.assertEqual(s.queue_map['x'].unmet, 1)
+        self.finish('b')
+        # a is the least recently used engine
+        self.assertEqual(self.engine_of('x'), b'a')
+        self.assertFalse('x' in s.queue_map)
+
+    def test_failed_dependency(self):
+        s = self.scheduler
+        self.submit('a')
+        self.submit('x', after=['a'])
+        self.submit('y', after=['x'])
+        self.finish('a', status='error')
+        # x can never run, so neither can y
+        self.assertEqual(s.queue_map, {})
+        self.assertEqual(s.all_failed, set(['a', 'x', 'y']))
+
+    def test_ready_anywhere(self):
+        s = self.scheduler
+        self.fill()
+        self.submit('x')
+        self.assertEqual(s._live_ready(s.ready), [s.queue_map['x']])
+        self.finish('t1')
+        self.assertEqual(self.engine_of('x'), b'b')
+        self.assertEqual(s._live_ready(s.ready), [])
+
+    def test_ready_in_order(self):
+        self.fill()
+        self.submit('x')
+        self.submit('y', targets=['a'])
+        self.submit('z')
+        self.finish('t2')
+        self.assertEqual(self.engine_of('x'), b'a')
+        self.finish('x')
+        self.assertEqual(self.engine_of('y'), b'a')
+        self.assertEqual(self.engine_of('z'), None)
+
+    def test_ready_for_engine(self):
+        s = self.scheduler
+        self.fill()
+        self.submit('x', targets=['a'])
+        self.assertEqual(s._live_ready(s.ready), [])
+        self.assertEqual(s._live_ready(s.ready_for[b'a']), [s.queue_map['x']])
+        self.finish('t1')
+        self.assertEqual(self.engine_of('x'), None)
+        self.finish('t2')
+        self.assertEqual(self.engine_of('x'), b'a')
+        self.assertFalse(b'a' in s.ready_for)
+
+    def test_ready_for_dead_engine(self):
+        s = self.scheduler
+        self.fill()
+        self.submit('x', targets=['a'])
+        s._unregister_engine(b'a')
+        self.assertTrue('x' in s.all_failed)
+
+    def test_follow(self):
+        s = self.scheduler
+        self.fill()
+        self.submit('x', follow=['t0'])
+        self.assertEqual(s.graph['t0'], set(['x']))
+        # b is free, but x must run where t0 did
+        self.finish('t1')
+        self.assertEqual(self.engine_of('x'), None)
+        self.finish('t0')
+        self.assertEqual(self.engine_of('x'), b'c')
+
+    def test_stale_entries(self):
+        s = self.scheduler
+        self.fill()
+        self.submit('x', targets=['a', 'b'])
+        self.submit('y', targets=['a'])
+        job = s.queue_map['x']
+        self.finish('t1')
+        self.assertEqual(self.engine_of('x'), b'b')
+        # x is still queued for a, but the entry is stale
+        self.assertEqual(len(s.ready_for[b'a']), 2)
+        self.assertEqual(s._live_ready(s.ready_for[b'a']), [s.queue_map['y']])
+        self.assertEqual(s._next_ready(s.ready_for[b'a'], b'a'), s.queue_map['y'])
+        # the stale head was dropped
+        self.assertEqual(len(s.ready_for[b'a']), 1)
+        self.finish('t2')
+        self.assertEqual(self.engine_of('y'), b'a')
+        self.assertEqual(self.engine_of('x'), b'b')
+        sent = [ m for m in s.engine_stream.sent if m == job.raw_msg ]
+        self.assertEqual(len(sent), 1)
+
+
+class TestResultBatch(SchedulerTestCase):
+
+    def test_result_batch(self):
+        """each reply in a batch from an engine finishes its task,
+        and is relayed to the client and the Hub by itself"""
+        s = self.scheduler
+        s.hwm = 0
+        msg_ids = [ 't%i' % i for i in range(3) ]
+        for msg_id in msg_ids:
+            self.submit(msg_id, targets=['a'])
+        replies = [ self.session.msg('apply_reply', {'status' : 'ok'},
+                        parent={'msg_id' : msg_id},
+                        metadata={'status' : 'ok', 'dependencies_met' : True})
+                    for msg_id in msg_ids ]
+        batch, msg_list = self.session.serialize_batch(replies, ident=[b'a', b'client'])
+        s.dispatch_result([ zmq.Frame(part) for part in msg_list ])
+        self.assertEqual(s.all_completed, set(msg_ids))
+        self.assertEqual(s.pending[b'a'], {})
+        self.assertEqual(s.load_index.load(b'a'), 0)
+        relayed = []
+        for raw in s.client_stream.sent:
+            raw = [ part if isinstance(part, bytes) else part.bytes for part in raw ]
+            idents, parts = self.session.feed_identities(raw)
+            self.assertEqual(idents[0], b'client')
+            relayed.append(self.session.unserialize(parts)['parent_header']['msg_id'])
+        self.assertEqual(relayed, msg_ids)
+        monitored = [ raw[0] for raw in s.mon_stream.sent if raw[0] == b'outtask' ]
+        self.assertEqual(len(monitored), len(msg_ids))
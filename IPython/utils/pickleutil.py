@@ -18,7 +18,7 @@
 from . import codeutil  # This registers a hook when it's imported
 from . import py3compat
 from .importstring import import_item
-from .py3compat import string_types, iteritems
+from .py3compat import string_types, iteritems, buffer_to_bytes
 
 from IPython.config import Application
 
@@ -213,13 +213,15 @@ def get_object(self, g=None):
         data = self.buffers[0]
         if self.pickled:
             # no shape, we just pickled it
-            return pickle.loads(data)
+            return pickle.loads(buffer_to_bytes(data))
         else:
+            # data may be a memoryview of a zmq Frame,
+            # in which case the array shares memory with the Frame
             return frombuffer(data, dtype=self.dtype).reshape(self.shape)
 
 
 class CannedBytes(CannedObject):
-    wrap = bytes
+    wrap = staticmethod(buffer_to_bytes)
     def __init__(self, obj):
         self.buffers = [obj]
     
@@ -227,7 +229,7 @@ def get_object(self, g=None):
         data = self.buffers[0]
         return self.wrap(data)
 
-def CannedBuffer(CannedBytes):
+class CannedBuffer(CannedBytes):
     wrap = buffer
 
 #-------------------------------------------------------------------------------
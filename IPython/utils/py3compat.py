@@ -32,6 +32,15 @@ def cast_bytes(s, encoding=None):
         return encode(s, encoding)
     return s
 
+def buffer_to_bytes(buf):
+    """Cast a buffer object (bytes, buffer, memoryview, zmq Frame...) to bytes"""
+    if isinstance(buf, bytes):
+        return buf
+    if isinstance(buf, memoryview):
+        # bytes(memoryview) is its repr on Python 2
+        return buf.tobytes()
+    return bytes(buf)
+
 def _modify_str_or_docstring(str_change_func):
     @functools.wraps(str_change_func)
     def wrapper(func_or_str):
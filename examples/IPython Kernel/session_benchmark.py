@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""Benchmark building, serializing and unserializing messages with a Session.
+
+For each packer, a typical message is built with Session.msg, serialized,
+and unserialized again, and the script reports the number of messages per
+second for each step::
+
+    python session_benchmark.py -n 10000
+    python session_benchmark.py --packer json --packer msgpack
+
+With --send, messages are instead sent with Session.send over a PUSH/PULL
+pair of sockets, and received with Session.recv in another thread.
+This measures sustained throughput, including signing, verification,
+and replay protection, once the digest history is full::
+
+    python session_benchmark.py --send --key secret -n 200000
+
+The msgpack packer requires msgpack-python.
+"""
+from __future__ import print_function
+
+import time
+from datetime import datetime
+from optparse import OptionParser
+from threading import Thread
+
+import zmq
+
+from IPython.kernel.zmq.session import Session
+
+
+def sample_content():
+    """content similar to that of an execute_reply"""
+    return dict(
+        status='ok',
+        execution_count=42,
+        user_variables={},
+        payload=[],
+        user_expressions=dict(x=dict(status='ok', data={'text/plain': '1' * 64})),
+        started=datetime.now(),
+    )
+
+
+def timeit(f, n):
+    """the rate at which f can be called, in calls per second"""
+    tic = time.time()
+    for i in range(n):
+        f()
+    return n / (time.time() - tic)
+
+
+def bench_packer(packer, n, key=b''):
+    session = Session(packer=packer, key=key)
+    # keep the replay protection from rejecting the same message n times
+    session.digest_history_size = 0
+    content = sample_content()
+    msg = session.msg('execute_reply', content=content)
+    wire = session.feed_identities(session.serialize(msg))[1]
+
+    results = []
+    results.append(('msg', timeit(lambda : session.msg('execute_reply', content=content), n)))
+    results.append(('serialize', timeit(lambda : session.serialize(msg), n)))
+    results.append(('unserialize', timeit(lambda : session.unserialize(wire), n)))
+    nbytes = sum(len(part) for part in wire)
+    return results, nbytes
+
+
+def bench_send(packer, n, key=b'', url='tcp://127.0.0.1'):
+    """the rate at which n messages can be sent from one Session to another"""
+    ctx = zmq.Context.instance()
+    push = ctx.socket(zmq.PUSH)
+    pull = ctx.socket(zmq.PULL)
+    port = push.bind_to_random_port(url)
+    pull.connect('%s:%i' % (url, port))
+    sender = Session(packer=packer, key=key)
+    receiver = Session(packer=packer, key=key)
+    content = sample_content()
+
+    def receive():
+        for i in range(n):
+            receiver.recv(pull, mode=0, copy=False)
+
+    # send one message first, so the connection is up before timing starts
+    sender.send(push, 'execute_reply', content=content)
+    receiver.recv(pull, mode=0)
+
+    thread = Thread(target=receive)
+    tic = time.time()
+    thread.start()
+    for i in range(n):
+        sender.send(push, 'execute_reply', content=content)
+    thread.join()
+    rate = n / (time.time() - tic)
+    push.close()
+    pull.close()
+    return rate, len(receiver.digest_history)
+
+
+def main():
+    parser = OptionParser()
+    parser.set_defaults(n=10000, packers=[], key='', send=False)
+    parser.add_option('-n', type='int', dest='n',
+        help='the number of messages per step [default: 10000]')
+    parser.add_option('--packer', action='append', dest='packers',
+        help='a packer to benchmark; may be given more than once '
+             '[default: json, pickle, msgpack]')
+    parser.add_option('--key', type='str', dest='key',
+        help='the key with which to sign messages [default: no signing]')
+    parser.add_option('--send', action='store_true', dest='send',
+        help='benchmark Session.send/recv over sockets')
+    (opts, args) = parser.parse_args()
+
+    packers = opts.packers or ['json', 'pickle', 'msgpack']
+    key = opts.key.encode('ascii')
+    if opts.send:
+        print("%-10s %12s %12s" % ('packer', 'send+recv/s', 'digests'))
+    else:
+        print("%-10s %12s %12s %13s %8s" % ('packer', 'msg/s', 'serialize/s', 'unserialize/s', 'bytes'))
+    for packer in packers:
+        try:
+            if opts.send:
+                rate, ndigests = bench_send(packer, opts.n, key)
+            else:
+                results, nbytes = bench_packer(packer, opts.n, key)
+        except ImportError as e:
+            print("%-10s skipped: %s" % (packer, e))
+            continue
+        if opts.send:
+            print("%-10s %12.0f %12i" % (packer, rate, ndigests))
+        else:
+            rates = ' '.join('%12.0f' % rate for name, rate in results[:2])
+            print("%-10s %s %13.0f %8i" % (packer, rates, results[2][1], nbytes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""Benchmark fixed and adaptive chunk sizes for LoadBalancedView.map.
+
+Each element of the map sleeps for a time drawn from a skewed
+distribution: most elements are cheap, but a few cost a hundred times
+as much, and the expensive ones are clustered towards the end, where
+large fixed chunks leave engines idle while the last ones finish.
+
+Start a cluster first, then compare chunksize=1, some fixed sizes,
+and chunksize='auto'::
+
+    ipcluster start -n 4 --daemonize
+    python chunksize_benchmark.py -n 5000 --chunksize 1 --chunksize 50 --chunksize 500
+
+For each chunk size, the wall time of the map is reported, along with
+the ideal time, the total cost of all the elements divided among the engines.
+"""
+from __future__ import print_function
+
+import random
+import time
+from optparse import OptionParser
+
+from IPython import parallel
+
+
+def skewed_costs(n, cheap, seed=0):
+    """n costs in seconds, mostly `cheap`, with 1% costing 100x as much,
+    more of them towards the end"""
+    rng = random.Random(seed)
+    costs = []
+    for i in range(n):
+        p = 0.02 * i / n
+        costs.append(100 * cheap if rng.random() < p else cheap)
+    return costs
+
+
+def work(cost):
+    import time
+    time.sleep(cost)
+    return cost
+
+
+def run(view, costs, chunksize):
+    tic = time.time()
+    results = view.map(work, costs, chunksize=chunksize, block=True)
+    toc = time.time()
+    assert results == costs
+    return toc - tic
+
+
+def main():
+    parser = OptionParser()
+    parser.set_defaults(n=5000, cheap=0.001, chunksizes=[], profile='default')
+    parser.add_option('-n', type='int', dest='n',
+        help='the number of elements to map over [default: 5000]')
+    parser.add_option('--cheap', type='float', dest='cheap',
+        help='the cost of a cheap element, in seconds [default: 0.001]')
+    parser.add_option('--chunksize', type='int', action='append', dest='chunksizes',
+        help="a fixed chunk size to compare with 'auto'; may be given more than once "
+             "[default: 1, 100]")
+    parser.add_option('--profile', type='str', dest='profile',
+        help='the profile of the cluster [default: default]')
+    (opts, args) = parser.parse_args()
+
+    rc = parallel.Client(profile=opts.profile)
+    view = rc.load_balanced_view()
+    nengines = len(rc.ids)
+    costs = skewed_costs(opts.n, opts.cheap)
+    ideal = sum(costs) / nengines
+
+    print("%i elements on %i engines, ideal time %.2fs" % (opts.n, nengines, ideal))
+    for chunksize in (opts.chunksizes or [1, 100]) + ['auto']:
+        elapsed = run(view, costs, chunksize)
+        print("chunksize %6s: %7.2fs (%.2fx ideal)" % (chunksize, elapsed, elapsed / ideal))
+    rc.close()
+
+
+if __name__ == '__main__':
+    main()
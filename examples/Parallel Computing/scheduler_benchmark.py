@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""Benchmark engine selection in the Python task scheduler.
+
+This script drives a TaskScheduler directly, with simulated engines, so no
+controller or engines need to be running.  It submits a number of no-op
+tasks, replying to the oldest assigned task whenever more than half of the
+engines are busy, and reports how many tasks per second the scheduler can
+assign and retire with each scheme::
+
+    python scheduler_benchmark.py -n 100000 -e 1024
+
+Since replies are generated instantly, this measures only the cost of the
+scheduler itself, which with many engines is dominated by engine selection.
+"""
+from __future__ import print_function
+
+import logging
+import time
+from collections import deque
+from optparse import OptionParser
+
+import zmq
+from zmq.eventloop.zmqstream import ZMQStream
+
+from IPython.kernel.zmq.session import Session
+from IPython.parallel.controller.scheduler import TaskScheduler, numpy
+
+
+class NullStream(ZMQStream):
+    """A ZMQStream stand-in that discards everything sent to it."""
+    def __init__(self):
+        pass
+
+    def send(self, *args, **kwargs):
+        pass
+
+    def send_multipart(self, *args, **kwargs):
+        pass
+
+    def flush(self, *args, **kwargs):
+        pass
+
+    def on_recv(self, *args, **kwargs):
+        pass
+
+
+class EngineStream(NullStream):
+    """Records which engine each task was assigned to."""
+    def __init__(self):
+        self.assigned = deque()
+        self._target = None
+
+    def send(self, target, *args, **kwargs):
+        self._target = target
+
+    def send_multipart(self, raw_msg, *args, **kwargs):
+        self.assigned.append((self._target, raw_msg))
+
+
+def build_tasks(session, n):
+    """Build n no-op task requests, and the (engine-less) replies to them."""
+    client = b'client'
+    requests = {}
+    replies = {}
+    for i in range(n):
+        msg = session.msg('apply_request', content={})
+        msg_id = msg['header']['msg_id']
+        requests[msg_id] = session.serialize(msg, ident=client)
+        reply = session.msg('apply_reply', content={}, parent=msg['header'],
+            metadata=dict(status='ok', dependencies_met=True),
+        )
+        replies[msg_id] = session.serialize(reply, ident=client)
+    return requests, replies
+
+
+def run(scheme, ntasks, nengines, hwm):
+    session = Session(key=b'')
+    engine_stream = EngineStream()
+    scheduler = TaskScheduler(
+        client_stream=NullStream(), engine_stream=engine_stream,
+        mon_stream=NullStream(), notifier_stream=NullStream(),
+        query_stream=NullStream(), session=session,
+        scheme_name=scheme, hwm=hwm, log=logging.getLogger('benchmark'),
+    )
+    for i in range(nengines):
+        scheduler._register_engine(('engine-%i' % i).encode('ascii'))
+
+    requests, replies = build_tasks(session, ntasks)
+    window = max(nengines // 2, 1)
+    Frame = zmq.Frame
+
+    def retire():
+        target, raw_msg = engine_stream.assigned.popleft()
+        msg_id = session.unpack(raw_msg[3].bytes)['msg_id']
+        reply = [Frame(target)] + [Frame(m) for m in replies.pop(msg_id)]
+        scheduler.dispatch_result(reply)
+
+    tic = time.time()
+    for msg_id, request in requests.items():
+        scheduler.dispatch_submission([Frame(m) for m in request])
+        while len(engine_stream.assigned) > window:
+            retire()
+    while engine_stream.assigned:
+        retire()
+    toc = time.time()
+    return ntasks / (toc - tic)
+
+
+def main():
+    parser = OptionParser()
+    parser.set_defaults(n=100000, engines=1024, hwm=1)
+    parser.add_option("-n", type='int', dest='n',
+        help='the number of tasks to submit')
+    parser.add_option("-e", '--engines', type='int', dest='engines',
+        help='the number of simulated engines')
+    parser.add_option('--hwm', type='int', dest='hwm',
+        help='TaskScheduler.hwm [default: 1]')
+    (opts, args) = parser.parse_args()
+
+    schemes = ['leastload', 'lru', 'twobin', 'plainrandom']
+    if numpy is not None:
+        schemes.append('weighted')
+
+    print("%i no-op tasks on %i simulated engines (hwm=%i)" % (
+        opts.n, opts.engines, opts.hwm))
+    for scheme in schemes:
+        rate = run(scheme, opts.n, opts.engines, opts.hwm)
+        print("%12s: %8.0f tasks/s" % (scheme, rate))
+
+
+if __name__ == '__main__':
+    main()
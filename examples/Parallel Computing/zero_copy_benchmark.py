@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""Benchmark pushing and pulling large numpy arrays.
+
+Start a cluster with at least one engine first, e.g.::
+
+    ipcluster start -n 1
+    python zero_copy_benchmark.py --size 1024 -n 5
+
+For each round, a `size` MB array is pushed to an engine and pulled back.
+The script reports the throughput of each direction, and the peak resident
+memory (RSS) of the client and the engine, relative to the size of the array.
+When the data is not copied on the way in or out, the peak RSS of each
+process stays within a small multiple of the array size.
+"""
+from __future__ import print_function
+
+import time
+from optparse import OptionParser
+
+import numpy
+
+from IPython import parallel
+
+
+def peak_rss():
+    """The peak resident set size of this process, in MB"""
+    # imported here, so this can run on the engine
+    import resource
+    import sys
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # bytes on OS X, kB elsewhere
+        rss //= 1024
+    return rss / 1024.
+
+
+def main():
+    parser = OptionParser()
+    parser.set_defaults(size=1024, n=5, profile='default')
+    parser.add_option('-s', '--size', type='int', dest='size',
+        help='the size of the array, in MB [default: 1024]')
+    parser.add_option('-n', type='int', dest='n',
+        help='the number of push/pull rounds [default: 5]')
+    parser.add_option('-p', '--profile', type='str', dest='profile',
+        help='the cluster profile to use')
+    (opts, args) = parser.parse_args()
+
+    rc = parallel.Client(profile=opts.profile)
+    view = rc[rc.ids[0]]
+    view.block = True
+    view.execute('import numpy')
+
+    nbytes = opts.size * 1024 * 1024
+    A = numpy.ones(nbytes // 8, dtype='float64')
+    print("pushing and pulling a %i MB array to engine %i, %i times" % (
+        opts.size, rc.ids[0], opts.n))
+
+    push_times = []
+    pull_times = []
+    for i in range(opts.n):
+        tic = time.time()
+        view.push(dict(A=A))
+        push_times.append(time.time() - tic)
+
+        tic = time.time()
+        B = view.pull('A')
+        pull_times.append(time.time() - tic)
+        assert B.shape == A.shape
+        del B
+
+    engine_rss = view.apply_sync(peak_rss)
+    view.execute('del A')
+
+    for name, times in [('push', push_times), ('pull', pull_times)]:
+        best = min(times)
+        print("%s: %8.1f MB/s (best of %i: %.3f s)" % (name, opts.size / best, opts.n, best))
+    client_rss = peak_rss()
+    print("peak RSS:  client %8.1f MB (%.2fx array), engine %8.1f MB (%.2fx array)" % (
+        client_rss, client_rss / opts.size, engine_rss, engine_rss / opts.size))
+
+
+if __name__ == '__main__':
+    main()